@@ -3,6 +3,7 @@
 from ansible.module_utils.basic import AnsibleModule
 import subprocess as sp
 import shutil
+from ansible.module_utils.ibm_was_proc import process_table
 
 
 ANSIBLE_METADATA = {
@@ -60,8 +61,8 @@ def run_cleanup():
     """Function to run general cleanup of IBM Application server
 	Function will do the following saftey checks
 	1. Check to see if any running JAVA processes exist
-	if .pid files exist in <WAS_Profile_Root>/logs dir
-	then changed=False and will print message to ensure
+	if a JVM of the profile runs, or a .pid file in <WAS_Profile_Root>/logs
+	names a live process, then changed=False and will print message to ensure
 	all java processes are stopped before running cleanup
     """
 	
@@ -82,23 +83,16 @@ def run_cleanup():
     cleanup_dirs = ['/wstemp', '/temp', '/workspace']
     cache = ['clearClassCache.sh', 'osgiCfgInit.sh -all']
 
-    child = sp.Popen(
-        [
-            'find ' + was_root + '/profiles/' + profile_name +
-            '/logs/ -name *.pid'
-	],
-	shell=True,
-	stdout=sp.PIPE,
-	stderr=sp.PIPE
-    ) 
-    stdout_value, stderr_value = child.communicate()
-
-    if stdout_value:
+    checks = process_table().check_profile(was_root + '/profiles/' + profile_name)
+    running = sorted(server for server, check in checks.items() if check['running'])
+
+    if running:
         module.fail_json(
             msg="Won't run cleanup as java processes are still running... please stop them then try again",
             changed=False,
-	    stdout=stdout_value
-	)
+            running=running,
+            stale_pid_files=sorted(check['pid_file'] for check in checks.values() if check['stale'])
+        )
     else:
         try:
 
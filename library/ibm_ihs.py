@@ -1,7 +1,7 @@
 #!/usr/bin/python
 
-import os
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.ibm_was_proc import process_table
 
 
 ANSIBLE_METADATA = {
@@ -126,19 +126,22 @@ def main():
     path = module.params['path']
 
 
-    admin_pid = "{0}/logs/admin.pid".format(path)
-    httpd_pid = "{0}/logs/httpd.pid".format(path)
+    # Both the admin server and IHS itself run bin/httpd; a pid file left behind by a
+    # killed process does not count as running.
+    table = process_table()
+    admin_running = table.check("{0}/logs/admin.pid".format(path), command='httpd')['running']
+    httpd_running = table.check("{0}/logs/httpd.pid".format(path), command='httpd')['running']
 
     if state =='start':
         if name == 'adminctl':
-            if os.path.exists(admin_pid):
+            if admin_running:
                 module.exit_json(
                     msg="Service {0} is already running".format(name),
                     changed=False
                 )
             send_service(module)
         if name == 'apachectl':
-            if os.path.exists(httpd_pid):
+            if httpd_running:
                 module.exit_json(
                     msg="Service {0} is already running".format(name),
                     changed=False
@@ -146,14 +149,14 @@ def main():
             send_service(module)
     if state == 'stop':
         if name == 'adminctl':
-            if not os.path.exists(admin_pid):
+            if not admin_running:
                 module.exit_json(
                     msg="Service {0} is already stopped".format(name),
                     changed=False
                 )
             send_service(module)
         if name == 'apachectl':
-            if not os.path.exists(httpd_pid):
+            if not httpd_running:
                 module.exit_json(
                     msg="Service {0} is not running".format(name),
                     changed=False
@@ -162,7 +165,7 @@ def main():
     if module.check_mode:
         if state == 'start':
             if name == 'adminctl':
-                if os.path.exists(admin_pid):
+                if admin_running:
                     module.exit_json(
                             msg="Service {0} is already running".format(name),
                             changed=False
@@ -173,7 +176,7 @@ def main():
                             changed=True
                     )
             if name == 'apachectl':
-                if os.path.exists(httpd_pid):
+                if httpd_running:
                     module.exit_json(
                             msg="Service {0} is already running ".format(name),
                             changed=False
@@ -185,7 +188,7 @@ def main():
                     )
         if state == 'stop': 
             if name == 'adminctl':
-                if not os.path.exists(admin_pid):
+                if not admin_running:
                     module.exit_json(
                             msg="Service {0} is already stopped".format(name),
                             changed=False
@@ -196,7 +199,7 @@ def main():
                             changed=True
                     )
             if name == 'apachectl':
-                if not os.path.exists(httpd_pid):
+                if not httpd_running:
                     module.exit_json(
                             msg="Service {0} is already stopped".format(name),
                             changed=False
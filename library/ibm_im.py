@@ -2,6 +2,9 @@
 
 import os
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.ibm_kit_cache import DEFAULT_KIT_CACHE_DIR, DEFAULT_KIT_CACHE_MB, DIGEST_CACHE, KitError, \
+    cached_kit
+from ansible.module_utils.ibm_kit_verify import verify_kit
 
 ANSIBLE_METADATA = {
     'metadata_version': '1.1',
@@ -32,10 +35,33 @@ options:
     src:
         description:
             - Path to IBM IM installation binaries. E.g /tmp/IM.1.8/
-        required: true
+            - With state absent, the directory holding uninstallc. When only C(kit) is given, its extracted
+            - directory is used instead.
+        required_if: kit == None
     dest:
         description:
             - Installation Path where IBM IM will be installed. E.g /opt/IBM/InstallationManager/
+        required_if: state == present
+    kit:
+        description:
+            - Zip or tar IBM IM kit to install from instead of an extracted C(src). E.g /was855/agent.installer.linux.gtk.x86_64_1.8.5.zip
+            - The kit is extracted once per content hash into C(kit_cache_dir) and reused by later runs.
+        required: false
+    kit_cache_dir:
+        description:
+            - Directory of the extracted kit cache shared by the installer modules.
+        required: false
+        default: ~/.ansible/ibm_kits
+    kit_cache_mb:
+        description:
+            - Disk budget of C(kit_cache_dir) in MB. Least recently used kits are evicted beyond it.
+        required: false
+        default: 20480
+    kit_manifest:
+        description:
+            - sha256sum style manifest of the C(kit) or C(src) files, checked before the install starts.
+            - Paths are relative to the manifest's directory. Digests are cached by path, size and mtime
+            - in C(kit_cache_dir), so verifying an unchanged kit again is instant.
         required: false
 
 
@@ -49,6 +75,11 @@ EXAMPLES = '''
     state: present
     src: /was855/IM.1.8/
     dest: /opt/IBM/InstallationManager
+- name: Install IBM IM from a zipped kit
+  ibm_im:
+    state: present
+    kit: /was855/agent.installer.linux.gtk.x86_64_1.8.5000.20160506_1125.zip
+    dest: /opt/IBM/InstallationManager
 - name: Install IBM IM with standard dest
   ibm_im:
     state: present
@@ -66,10 +97,48 @@ result:
     type: str
 message:
     description: Succesfully installed or uninstalled IBM IM
+kit:
+    description: Kit cache key, whether it was a cache hit, extraction time and evicted kits, when kit was used.
+    type: dict
+verify:
+    description: Files verified, failed and taken from the digest cache, MB hashed and MB/s, when kit_manifest was used.
+    type: dict
 
 '''
 
-def install_ibmim(module, src, dest):
+def kit_src(module):
+    """Function that returns the extracted directory of the kit from the shared kit cache."""
+
+    try:
+        return cached_kit(module.params['kit'], module.params['kit_cache_dir'], module.params['kit_cache_mb'])
+    except (KitError, IOError, OSError) as e:
+        module.fail_json(
+            msg="Failed to extract kit %s: %s" % (module.params['kit'], e),
+            changed=False
+        )
+
+def verify_src(module):
+    """Function that checks the kit against kit_manifest, so a truncated kit fails before the install starts."""
+
+    try:
+        report = verify_kit(module.params['kit_manifest'],
+                            os.path.join(os.path.expanduser(module.params['kit_cache_dir']), DIGEST_CACHE))
+    except (IOError, OSError) as e:
+        module.fail_json(
+            msg="Failed to read kit manifest %s: %s" % (module.params['kit_manifest'], e),
+            changed=False
+        )
+
+    if report['failed']:
+        module.fail_json(
+            msg="Kit verification against %s failed for: %s" % (module.params['kit_manifest'],
+                                                                ', '.join(sorted(report['failed']))),
+            changed=False,
+            verify=report
+        )
+    return report
+
+def install_ibmim(module, src, dest, kit=None, verify=None):
     """Function that will install IBM Installation Manager.
     This will only get installed if an installation path with a binary related to the install
     is not located on the server. If the binary is found, install will skip.
@@ -78,7 +147,9 @@ def install_ibmim(module, src, dest):
     if os.path.exists(dest+"/eclipse/tools/imcl"):
         module.exit_json(
             msg="Installation Manager already exists at %s" % (dest),
-            changed=False
+            changed=False,
+            kit=kit,
+            verify=verify
         )
     else:
         install_im = module.run_command(src+'/userinstc -acceptLicense -installationDirectory ' +
@@ -88,12 +159,16 @@ def install_ibmim(module, src, dest):
             module.fail_json(
                 msg="Failed to install IBM IM at %s" % (dest),
                 changed=False,
-                stderr=install_im[2]
+                stderr=install_im[2],
+                kit=kit,
+                verify=verify
             )
         else:
             module.exit_json(
                 msg="Succesfully installed IBM IM at %s" % (dest),
                 changed=True,
+                kit=kit,
+                verify=verify
             )
 
 def remove_ibmim(module, src):
@@ -132,9 +207,15 @@ def main():
     module = AnsibleModule(
         argument_spec=dict(
             state=dict(required=True, type='str', choices=['present', 'absent']),
-            src=dict(required=True, type='str'),
-            dest=dict(required=False, type='str')
+            src=dict(required=False, type='str'),
+            dest=dict(required=False, type='str'),
+            kit=dict(required=False, type='path'),
+            kit_cache_dir=dict(required=False, type='path', default=DEFAULT_KIT_CACHE_DIR),
+            kit_cache_mb=dict(required=False, type='int', default=DEFAULT_KIT_CACHE_MB),
+            kit_manifest=dict(required=False, type='path')
         ),
+        required_one_of=[['src', 'kit']],
+        required_if=[['state', 'present', ['dest']]],
         supports_check_mode=True
     )
 
@@ -142,8 +223,26 @@ def main():
     src = module.params['src']
     dest = module.params['dest']
 
+    verify = None
+    if state == 'present' and module.params['kit_manifest'] is not None \
+            and not os.path.exists(dest+"/eclipse/tools/imcl"):
+        verify = verify_src(module)
+
+    kit = None
+    if state == 'present' and module.params['kit'] is not None and not module.check_mode \
+            and not os.path.exists(dest+"/eclipse/tools/imcl"):
+        src, kit = kit_src(module)
+
     if state == 'present' and not module.check_mode:
-        install_ibmim(module, src, dest)
+        install_ibmim(module, src, dest, kit, verify)
+
+    if state == 'absent' and src is None and module.check_mode:
+        module.exit_json(
+            msg="IBM IM will be uninstalled with the uninstallc of kit %s." % (module.params['kit']),
+            changed=True
+        )
+    if state == 'absent' and src is None:
+        src, kit = kit_src(module)
 
     if state == 'absent' and not module.check_mode:
         remove_ibmim(module, src)
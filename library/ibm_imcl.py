@@ -1,7 +1,29 @@
 #!/usr/bin/python
 
+import glob
+import json
 import os
+import re
+import shutil
+import time
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.ibm_im_agent import DEFAULT_CACHE_DIR, AgentDataFormatError, agent_data_location, \
+    installed_features, installed_inventory, invalidate_inventory, package_installed, read_agent_data
+from ansible.module_utils.ibm_im_lock import DEFAULT_QUEUE_DIR, agent_data_key, queued_run
+from ansible.module_utils.ibm_im_mirror import MirrorError, mirror_path, mirror_repository
+from ansible.module_utils.ibm_im_preflight import SPACE_FACTORS, prerequisite_problems, space_report
+from ansible.module_utils.ibm_im_prune import MB, plan_prune, prune, shared_resource_location, tree_size
+from ansible.module_utils.ibm_im_repo import is_remote, offering_size, repositories_index, resolve_offering, \
+    split_package, suggest_offerings
+from ansible.module_utils.ibm_im_snapshot import create_snapshot, default_snapshot_dir, list_snapshots, \
+    prune_snapshots, restore_snapshot
+from ansible.module_utils.ibm_imcl_progress import run_imcl
+from ansible.module_utils.ibm_kit_cache import DEFAULT_KIT_CACHE_DIR, DEFAULT_KIT_CACHE_MB, DIGEST_CACHE, KitError, \
+    cached_kit
+from ansible.module_utils.ibm_kit_verify import verify_kit
+
+
+SWITCH_HISTORY = 'ibm_imcl_was_home.json'
 
 
 ANSIBLE_METADATA = {
@@ -21,7 +43,8 @@ description:
     - Module that takes care of installing IBM products via imcl cli.
     - Module does a package lookup within the target cell to check for package existance.
     - Depending on the specified module state, the package check will determine the outcome of the run.
-    - Module supports dry runs.
+    - Requested offerings are validated against an index of the C(src) repository metadata before imcl starts.
+    - Module supports dry runs. Dry runs never start imcl or touch a remote repository.
 
 options:
     state:
@@ -33,9 +56,13 @@ options:
           - absent
           - update
           - rollback
+          - prune
     src:
         description:
             - Path to IBM IM installation binaries. E.g /tmp/WASND8.5.5/
+            - May be a repository directory, a zipped repository or an HTTP(S) repository.
+            - Its repository.config/repository.xml is indexed and cached in C(cache_dir) keyed by the
+            - metadata digest, so offerings can be validated and resolved without imcl listAvailablePackages.
         required: false
     dest:
         description:
@@ -53,7 +80,13 @@ options:
         required: false
     name:
         description:
-            - Name of package to be installed, updated, or removed from any given cell.
+            - Name of package(s) to be installed, updated, or removed from any given cell.
+            - Accepts a list of offering IDs, or a string of space separated ones. Each offering is checked
+            - against the installed inventory, and only the missing ones are handed to a single imcl invocation.
+            - A legacy <offering>,<feature> spec is rejected, features are given in C(features).
+            - Per offering results are returned in C(packages).
+            - With state update, a bare offering id (e.g. com.ibm.websphere.ND.v85) resolves to the latest
+            - fix pack available in C(src).
         required: true
     shared_resource:
         description:
@@ -84,6 +117,197 @@ options:
         required_if: secure_storage != None
         default:
           - None
+    agent_data:
+        description:
+            - Path to the IBM IM agent data directory (appDataLocation).
+            - Defaults to cic.appDataLocation from the IM config.ini next to C(path).
+        required: false
+    cache_dir:
+        description:
+            - Host-local directory used to cache the installed package inventory.
+            - Presence checks read installRegistry.xml/installed.xml from the agent data directly. Only when
+            - that format is not recognized is imcl listInstalledPackages used, and its output is cached
+            - until the IM agent data changes.
+        required: false
+        default: ~/.ansible/ibm_imcl
+    status_file:
+        description:
+            - JSON file that install and update runs keep up to date with their phase, percentage,
+            - last imcl output line and timings, so an async poll can follow a long imcl run.
+            - Defaults to imcl-status-<key>.json in C(cache_dir), with key derived from the IM agent data
+            - directory, so tasks driving different IM installations on one host never share it.
+        required: false
+    fail_patterns:
+        description:
+            - Extra regular expressions that abort an install or update as soon as they show up
+            - in imcl's output or -log file.
+            - Disk full, unreachable repository and CRIM* error codes are always detected.
+        required: false
+    queue_dir:
+        description:
+            - Host-local directory of the queue every imcl invocation waits in.
+            - Tasks working on the same IM agent data run one at a time in arrival order instead
+            - of failing on IM's global lock, and queued installs from the same C(src) into the same
+            - C(dest) are merged into one imcl run. Wait and run times are returned in C(queue).
+        required: false
+        default: /tmp/ibm_imcl_queue
+    queue_timeout:
+        description:
+            - Seconds to wait for the IM lock before failing.
+        required: false
+        default: 7200
+    update_mode:
+        description:
+            - How state update is applied.
+            - in_place updates C(dest) itself, so every server using it is down for the whole run.
+            - stage installs the update into C(staged_dest) while C(dest) keeps serving.
+            - switch points the WAS_HOME of every profile in C(profiles) at C(staged_dest). Only this
+            - step needs the servers stopped. The previous directory is kept as it is.
+            - switch_back points every profile in C(profiles) back at the directory it used before its last switch.
+        required: false
+        default: in_place
+        choices:
+          - in_place
+          - stage
+          - switch
+          - switch_back
+    staged_dest:
+        description:
+            - Sibling installation directory used by update_mode stage and switch.
+            - Defaults to <dest>_<version> of the offering being updated.
+        required: false
+    profiles:
+        description:
+            - Profile directories switched by update_mode switch and switch_back.
+        required_if: update_mode == 'switch' or 'switch_back'
+    kit:
+        description:
+            - Zip or tar kit of a repository to install from, e.g. WAS_ND_V8.5.5_1of3.zip.
+            - Naming one part of a multi-part kit means the whole set; the parts are extracted in parallel.
+            - The kit is extracted once per content hash into C(kit_cache_dir) and put in front of C(src).
+            - It is only extracted when a requested package is missing, except for state update without C(src),
+            - where the kit is needed to resolve offering ids to its fix packs.
+        required: false
+    kit_cache_dir:
+        description:
+            - Directory of the extracted kit cache shared by the installer modules.
+        required: false
+        default: ~/.ansible/ibm_kits
+    kit_cache_mb:
+        description:
+            - Disk budget of C(kit_cache_dir) in MB. Least recently used kits are evicted beyond it.
+        required: false
+        default: 20480
+    kit_manifest:
+        description:
+            - sha256sum style manifest of the kit or C(src) files, checked before imcl starts so a truncated
+            - or corrupted kit fails right away. Paths are relative to the manifest's directory.
+            - Files are hashed in parallel and their digests cached by path, size and mtime in C(kit_cache_dir),
+            - so verifying an unchanged kit again is instant. Only checked when something will be installed.
+        required: false
+    mirror_dir:
+        description:
+            - Host-local directory the C(src) repositories are mirrored into before imcl runs.
+            - imcl is then pointed at the mirrors instead of C(src). The mirrors are only synced when a requested
+            - package is missing or its features change, so a rerun with everything installed lists and downloads nothing.
+            - Only missing or changed artifacts are fetched, several at a time. Interrupted downloads are
+            - resumed on the next run. Artifacts are checked against the SHA-256 in the repository's
+            - SHA256SUMS file (HTTP) or of the source file (directory) before they are used.
+            - An HTTP repository with SHA256SUMS is mirrored as that file lists it. One without SHA256SUMS is
+            - listed from the server's directory index pages; its artifacts can not be verified, they are
+            - mirrored as they arrive and listed as unverified in the C(mirror) result.
+            - In check mode HTTP repositories are not contacted, their mirrors are reported from local state.
+        required: false
+    mirror_workers:
+        description:
+            - Number of artifacts fetched at the same time when syncing C(mirror_dir).
+        required: false
+        default: 4
+    preflight:
+        description:
+            - What to do when a preflight check fails. The checks run before imcl starts, for state present and update.
+            - The space needed in C(dest), C(shared_resource) and /tmp is estimated from the offering sizes in the
+            - C(src) repository metadata and compared with the free space of every filesystem involved; targets on
+            - the same filesystem are added up. The shortfall per filesystem is reported.
+            - imcl is checked to be executable and C(dest)/C(shared_resource) to be writable.
+            - Offerings without a recorded size are not counted.
+        required: false
+        default: fail
+        choices:
+          - fail
+          - warn
+          - skip
+    features:
+        description:
+            - Features that must be installed for every offering in C(name), e.g. com.ibm.sdk.7.1.
+            - Missing offerings are installed with exactly these features (plus the ones they require).
+            - Installed offerings lacking some of them get them added with imcl modify -addFeatures,
+            - instead of an uninstall and reinstall of the whole offering.
+            - Installed features are read from the IM agent data, or imcl listInstalledPackages -features -long,
+            - so only the difference is applied.
+            - Only used with state present.
+        required: false
+        default: []
+    remove_features:
+        description:
+            - Features that must not be installed for every offering in C(name), e.g. samples.
+            - Installed ones are removed with imcl modify -removeFeatures.
+            - Only used with state present.
+        required: false
+        default: []
+    snapshot:
+        description:
+            - With state update, snapshot C(dest) and the IM agent data right before imcl runs.
+            - The snapshot of C(dest) is a tree of reflinks where the filesystem supports them (XFS with reflink,
+            - btrfs), hardlinks otherwise, so files the update leaves alone take no extra space.
+            - With hardlinks, a file of C(dest) imcl rewrote in place instead of replacing it changes in the snapshot
+            - too. The IM agent data is rewritten in place, so it is always copied.
+            - With state rollback, restore the newest snapshot of C(dest) (or C(snapshot_id)) instead of running
+            - imcl rollback. This does not need IM rollback files. The restore is a reflink clone, which takes
+            - seconds, or a full copy where the filesystem has no reflinks.
+        required: false
+        default: false
+    snapshot_dir:
+        description:
+            - Directory holding the snapshots. Defaults to .ibm_imcl_snapshots next to C(dest),
+            - which keeps them on the same filesystem as C(dest).
+        required: false
+    snapshot_keep:
+        description:
+            - Number of snapshots of C(dest) to keep. Older ones are evicted after every new snapshot.
+        required: false
+        default: 3
+    snapshot_id:
+        description:
+            - Snapshot to restore with state rollback. Defaults to the newest snapshot of C(dest).
+        required: false
+    rollback_keep:
+        description:
+            - With state prune, the number of offering versions older than the installed one whose payloads
+            - are kept in C(shared_resource), so imcl rollback can still go back that far.
+            - Payloads of older versions are removed. Entries IM keeps for offerings that are not installed,
+            - or whose name is not <offering id>_<version>, are never touched.
+        required: false
+        default: 1
+    log_retention_days:
+        description:
+            - With state prune, IM agent data logs older than this many days are removed.
+            - Temporary files in the agent data older than an hour are removed as well.
+        required: false
+        default: 30
+    prune_workers:
+        description:
+            - With state prune, the number of trees sized and removed at the same time.
+            - Sizes are computed with a parallel scandir walk of the agent data and C(shared_resource).
+        required: false
+        default: 8
+    prune_shared:
+        description:
+            - With state prune, also remove the rollback payloads in C(shared_resource) beyond C(rollback_keep).
+            - IM is not told about the removal, so an imcl rollback to such a version needs its repository again.
+            - When false, only logs and temporary files of the agent data are removed.
+        required: false
+        default: false
 author:
     - Tom Davison (@tntdavison784)
 '''
@@ -108,6 +332,16 @@ EXAMPLES = '''
     state: update
     path: /opt/IBM/InstallationManager/eclipse/tools/imcl
     name: com.ibm.websphere.ND.v85_8.5.5013.20180112_1418
+- name: Install WAS ND, Java SDK, IHS and plugins in one imcl run
+  ibm_imcl:
+    state: present
+    src: /tmp/WASND8.5/
+    dest: /opt/IBM/WebSphere/AppServer
+    path: /opt/IBM/InstallationManager/eclipse/tools/imcl
+    name:
+      - com.ibm.websphere.ND.v85_8.5.5012.20170627_1018
+      - com.ibm.websphere.IBMJAVA.v71_7.1.4010.20170713_1456
+    shared_resource: /opt/IBM/IMShared
 - name: INSTALL IBM IHS WITH PROPERTIES
   ibm_imcl:
     state: present
@@ -116,6 +350,98 @@ EXAMPLES = '''
     name: com.ibm.websphere.IHS.v85_8.5.5000.20130514_1044
     src: /tmp/IHS-Binaries/
     properties: user.ihs.allowNonRootSilentInstall=true,user.ihs.httpPort=8080
+- name: UPDATE IN THE BACKGROUND AND FOLLOW PROGRESS
+  ibm_imcl:
+    state: update
+    src: /tmp/WASND8.5.5.13/
+    dest: /opt/IBM/WebSphere/AppServer
+    path: /opt/IBM/InstallationManager/eclipse/tools/imcl
+    name: com.ibm.websphere.ND.v85
+    shared_resource: /opt/IBM/IMShared
+    status_file: /tmp/ibm_imcl-update.json
+  async: 3600
+  poll: 0
+- name: STAGE FIXPACK 8.5.5.13 NEXT TO THE LIVE INSTALL
+  ibm_imcl:
+    state: update
+    update_mode: stage
+    src: /tmp/WASND8.5.5/,/tmp/WASND8.5.5.13/
+    dest: /opt/IBM/WebSphere/AppServer
+    staged_dest: /opt/IBM/WebSphere/AppServer_8.5.5013
+    path: /opt/IBM/InstallationManager/eclipse/tools/imcl
+    name: com.ibm.websphere.ND.v85_8.5.5013.20180112_1418
+    shared_resource: /opt/IBM/IMShared
+- name: SWITCH PROFILES TO THE STAGED INSTALL (servers stopped)
+  ibm_imcl:
+    state: update
+    update_mode: switch
+    path: /opt/IBM/InstallationManager/eclipse/tools/imcl
+    dest: /opt/IBM/WebSphere/AppServer
+    shared_resource: /opt/IBM/IMShared
+    staged_dest: /opt/IBM/WebSphere/AppServer_8.5.5013
+    profiles:
+      - /opt/IBM/WebSphere/profiles/Custom01
+- name: SWITCH PROFILES BACK TO THE PREVIOUS INSTALL
+  ibm_imcl:
+    state: update
+    update_mode: switch_back
+    path: /opt/IBM/InstallationManager/eclipse/tools/imcl
+    dest: /opt/IBM/WebSphere/AppServer
+    shared_resource: /opt/IBM/IMShared
+    profiles:
+      - /opt/IBM/WebSphere/profiles/Custom01
+- name: INSTALL FROM A THREE PART ZIPPED KIT
+  ibm_imcl:
+    state: present
+    kit: /was855/WAS_ND_V8.5.5_1of3.zip
+    dest: /opt/IBM/WebSphere/AppServer
+    path: /opt/IBM/InstallationManager/eclipse/tools/imcl
+    name: com.ibm.websphere.ND.v85
+    shared_resource: /opt/IBM/IMShared
+- name: INSTALL FROM A LOCAL MIRROR OF THE HTTP REPOSITORY
+  ibm_imcl:
+    state: present
+    src: http://repo.example.com/WASND8.5.5/
+    mirror_dir: /opt/IBM/repositories
+    dest: /opt/IBM/WebSphere/AppServer
+    path: /opt/IBM/InstallationManager/eclipse/tools/imcl
+    name: com.ibm.websphere.ND.v85
+    shared_resource: /opt/IBM/IMShared
+- name: ADD THE JAVA 7.1 SDK AND REMOVE THE SAMPLES FROM AN INSTALLED ND
+  ibm_imcl:
+    state: present
+    src: /tmp/WASND8.5.5/,/tmp/SDK71/
+    dest: /opt/IBM/WebSphere/AppServer
+    path: /opt/IBM/InstallationManager/eclipse/tools/imcl
+    name: com.ibm.websphere.ND.v85
+    features:
+      - com.ibm.sdk.7.1
+    remove_features:
+      - samples
+    shared_resource: /opt/IBM/IMShared
+- name: UPDATE WITH A SNAPSHOT TO FALL BACK ON
+  ibm_imcl:
+    state: update
+    snapshot: true
+    src: /tmp/WASND8.5.5/,/tmp/WASND8.5.5.13/
+    dest: /opt/IBM/WebSphere/AppServer
+    path: /opt/IBM/InstallationManager/eclipse/tools/imcl
+    name: com.ibm.websphere.ND.v85_8.5.5013.20180112_1418
+    shared_resource: /opt/IBM/IMShared
+- name: RESTORE THE SNAPSHOT TAKEN BEFORE THE LAST UPDATE
+  ibm_imcl:
+    state: rollback
+    snapshot: true
+    dest: /opt/IBM/WebSphere/AppServer
+    path: /opt/IBM/InstallationManager/eclipse/tools/imcl
+- name: PRUNE OLD ROLLBACK PAYLOADS AND LOGS FROM IMSHARED AND THE AGENT DATA
+  ibm_imcl:
+    state: prune
+    path: /opt/IBM/InstallationManager/eclipse/tools/imcl
+    shared_resource: /opt/IBM/IMShared
+    rollback_keep: 1
+    log_retention_days: 14
+    prune_shared: true
 - name: ROLLBACK LATEST FIXPACK
   ibm_imcl:
     state: rollback
@@ -149,144 +475,470 @@ absent:
     type: str
 message:
     description: Successfully removed package: <package_name> from cell.
+packages:
+    description: Per offering result, e.g. present, absent, installed, updated, removed, rolled back or failed.
+    type: dict
+error:
+    description: The fatal imcl output or log line that failed or aborted an install or update.
+    type: str
+queue:
+    description: Time spent waiting for and running imcl, and the offerings merged into the same imcl run.
+    type: dict
+profiles:
+    description: For update_mode switch/switch_back, the previous and new WAS_HOME and the repointed files per profile.
+    type: dict
+kit:
+    description: Kit cache key, whether it was a cache hit, extraction time and evicted kits, when kit was used.
+    type: dict
+verify:
+    description: Files verified, failed and taken from the digest cache, MB hashed and MB/s, when kit_manifest was used.
+    type: dict
+mirror:
+    description: >
+        Per mirrored repository, the artifacts fetched, removed and unchanged, the artifacts that could not be
+        verified against a SHA-256 (unverified), MB transferred and MB/s.
+    type: list
+preflight:
+    description: Required and available MB and the shortfall per filesystem, when the preflight failed.
+    type: list
+features:
+    description: The features added and removed per installed offering by imcl modify.
+    type: dict
+snapshot:
+    description: The snapshot taken before an update or restored by a rollback, with its id, method and duration.
+    type: dict
+prune:
+    description: >
+        For state prune, the agent data and shared resources size before and after in MB, the MB reclaimed
+        (or reclaimable in check mode), what was removed and why, how long pruning took, and how long an
+        imcl listInstalledPackages took afterwards.
+    type: dict
 '''
 
 
-def install_package_local(module):
-    """Function that takes care of installing new packages into the target environment."""
+def imcl_agent_data(module):
+    """Function that returns the IM agent data directory the imcl in path works on."""
+
+    if module.params['agent_data'] is not None:
+        return module.params['agent_data']
+    return agent_data_location(module.params['path'])
+
+
+def merge_key(module, operation, dest):
+    """Function that describes an imcl invocation apart from its offerings.
+    Queued tasks with the same key can share one imcl run.
+    """
+
+    return json.dumps([operation, module.params['path'], module.params['src'], dest,
+                       module.params['shared_resource'], module.params['properties'],
+                       module.params['secure_storage'], module.params['password_file'],
+                       module.params['snapshot'], module.params['features']])
+
+
+def queued_command(module, cmd):
+    """Function that runs a short imcl command (uninstall, rollback) through the IM queue."""
+
+    return queued_run(lambda merged: module.run_command(cmd, use_unsafe_shell=True),
+                      imcl_agent_data(module), queue_dir=module.params['queue_dir'],
+                      timeout=module.params['queue_timeout'])
+
+
+def run_package_cmd(module, build_cmd, packages, log_file, operation, dest=None, before=None, merge=True):
+    """Function that runs an install or update imcl command with streamed progress.
+    Progress goes to the status file and the run is aborted early on fatal errors.
+    The run waits its turn in the host-local IM queue, and queued tasks installing
+    from the same repository into the same location are merged into one imcl run,
+    so build_cmd(packages) may be called with more offerings than this task asked for.
+    before() runs once the IM lease is held, right before imcl first starts;
+    a retry after an IM lock held outside the queue does not run it again.
+    Without merge, the run is never shared with other queued tasks.
+    """
+
+    agent_data = imcl_agent_data(module)
+    status_file = module.params['status_file']
+    if status_file is None:
+        status_file = os.path.join(module.params['cache_dir'],
+                                   'imcl-status-{0}.json'.format(agent_data_key(agent_data)))
+
+    pending = [before] if before is not None else []
+
+    def run(merged):
+        if pending:
+            pending.pop()()
+        return run_imcl(build_cmd(merged), log_file=log_file, status_file=status_file,
+                        fail_patterns=module.params['fail_patterns'], operation=operation)
+
+    return queued_run(run, agent_data, queue_dir=module.params['queue_dir'],
+                      merge_key=merge_key(module, operation, dest) if merge else None, packages=packages,
+                      timeout=module.params['queue_timeout'])
+
+
+def install_package_local(module, packages, results, dest=None, mirror=None, kit=None, verify=None):
+    """Function that takes care of installing new packages into the target environment.
+    All missing packages are installed by a single imcl invocation, so the JVM start
+    and the repository resolution only happen once.
+    dest overrides module.params['dest'], e.g. for a staged blue/green update.
+    """
 
-    if module.params['properties'] is None:
-        lpackage_install_cmd = """{0} -acceptLicense -repositories {1} \
-                -installationDirectory {2} -log /tmp/IBM-Install.log \
-                -sharedResourcesDirectory {3} install {4}""".format(module.params['path'],
-                        module.params['src'], module.params['dest'], module.params['shared_resource'],
-                        module.params['name'])
-        lpackage_install = module.run_command(lpackage_install_cmd, use_unsafe_shell=True)
+    if dest is None:
+        dest = module.params['dest']
 
-    if module.params['properties'] is not None:
-        lpackage_install_cmd = """{0} -acceptLicense -repositories {1} \
-                -installationDirectory {2} -log /tmp/IBM-Install.log \
-                -sharedResourcesDirectory {3} install {4} -properties {5}""".format(module.params['path'],
-                        module.params['src'], module.params['dest'], module.params['shared_resource'],
-                        module.params['name'], module.params['properties'])
-        lpackage_install = module.run_command(lpackage_install_cmd, use_unsafe_shell=True)
+    def lpackage_install_cmd(merged):
+        cmd = """{0} -acceptLicense -repositories {1} \
+            -installationDirectory {2} -log /tmp/IBM-Install.log \
+            -sharedResourcesDirectory {3} install {4}""".format(module.params['path'],
+                    module.params['src'], dest, module.params['shared_resource'],
+                    ' '.join(with_features(module, merged)))
+
+        if module.params['properties'] is not None:
+            cmd += " -properties {0}".format(module.params['properties'])
+        return cmd
+
+    lpackage_install = run_package_cmd(module, lpackage_install_cmd, packages, '/tmp/IBM-Install.log', 'install', dest)
 
     if lpackage_install[0] != 0:
+        results.update(dict((package, 'failed') for package in packages))
         module.fail_json(
-            msg="Failed to install package: {0}. Please see log in /tmp for more details.".format(module.params['name']),
+            msg="Failed to install package(s): {0}. Please see log in /tmp for more details.".format(' '.join(packages)),
             changed=False,
-            stderr=lpackage_install[2]
+            packages=results,
+            queue=lpackage_install[3],
+            mirror=mirror,
+            kit=kit,
+            verify=verify,
+            error=lpackage_install[2],
+            stdout=lpackage_install[1]
         )
 
+    results.update(dict((package, 'installed') for package in packages))
     module.exit_json(
-        msg="Succesfully installed package: {0}to location: {1}. For installation details please see log in /tmp/. ".format(module.params['name'],
-            module.params['dest']),
-        changed=True
+        msg="Succesfully installed package(s): {0} to location: {1}. For installation details please see log in /tmp/. ".format(' '.join(packages),
+            dest),
+        changed=True,
+        packages=results,
+        queue=lpackage_install[3],
+        mirror=mirror,
+        kit=kit,
+        verify=verify
     )
 
 
-def install_package_remote(module):
+def install_package_remote(module, packages, results, dest=None, mirror=None, kit=None, verify=None):
     """
     Function that will install packages
     from a remote ibm repo
     """
 
-    if module.params['properties'] is None:
-        rpackage_install_cmd = """{0}/ -repositories {1} -installationDirectory {2} \
-                -log /tmp/IBM_install.log -sharedResourcesDirectory {3} \
-                install {4} -secureStorageFile {5} -masterPasswordFile {6} \
-                -acceptLicense""".format(module.params['path'],module.params['src'],
-                        module.params['dest'],module.params['shared_resources'],
-                        module.params['name'],module.params['secure_storage'],
-                        module.params['passwor_file'])
-        rpackage_install = module.run_command(rpackage_install_cmd, use_unsafe_shell=True)
-
-    if module.params['properties'] is not None:
-        rpackage_install_cmd = """{0}/ -repositories {1} -installationDirectory {2} \
-                -log /tmp/IBM_install.log -sharedResourcesDirectory {3} \
-                install {4} -secureStorageFile {5} -masterPasswordFile {6} \
-                -acceptLicense -properties {7}""".format(module.params['path'],module.params['src'],
-                        module.params['dest'],module.params['shared_resources'],
-                        module.params['name'],module.params['secure_storage'],
-                        module.params['password_file'],module.params['properties'])
-        rpackage_install = module.run_command(rpackage_install_cmd, use_unsafe_shell=True)
+    if dest is None:
+        dest = module.params['dest']
+
+    def rpackage_install_cmd(merged):
+        cmd = """{0} -repositories {1} -installationDirectory {2} \
+            -log /tmp/IBM_install.log -sharedResourcesDirectory {3} \
+            install {4} -secureStorageFile {5} -masterPasswordFile {6} \
+            -acceptLicense""".format(module.params['path'], module.params['src'],
+                    dest, module.params['shared_resource'],
+                    ' '.join(with_features(module, merged)), module.params['secure_storage'],
+                    module.params['password_file'])
+
+        if module.params['properties'] is not None:
+            cmd += " -properties {0}".format(module.params['properties'])
+        return cmd
+
+    rpackage_install = run_package_cmd(module, rpackage_install_cmd, packages, '/tmp/IBM_install.log', 'install', dest)
 
     if rpackage_install[0] != 0:
+        results.update(dict((package, 'failed') for package in packages))
         module.fail_json(
-            msg="Failed to install package(s) {0}".format(module.params['name']),
+            msg="Failed to install package(s) {0}".format(' '.join(packages)),
             changed=False,
-            stderr=rpackage_install[2],
+            packages=results,
+            queue=rpackage_install[3],
+            mirror=mirror,
+            kit=kit,
+            verify=verify,
+            error=rpackage_install[2],
             stdout=rpackage_install[1]
         )
+
+    results.update(dict((package, 'installed') for package in packages))
     module.exit_json(
-        msg="Successfully installed package(s) {0}".format(module.params['name']),
-        changed=True
+        msg="Successfully installed package(s) {0}".format(' '.join(packages)),
+        changed=True,
+        packages=results,
+        queue=rpackage_install[3],
+        mirror=mirror,
+        kit=kit,
+        verify=verify
     )
 
 
-def update_package_local(module):
+def update_package_local(module, packages, results, mirror=None, kit=None, verify=None):
     """Function that updates packages for target environment."""
     
 
-    lpackage_update_cmd = """{0} -acceptLicense -sharedResourcesDirectory {1} \
+    def lpackage_update_cmd(merged):
+        return """{0} -acceptLicense -sharedResourcesDirectory {1} \
 install {2} -repositories {3} -log /tmp/IBM-Update.log""".format(module.params['path'],
-                    module.params['shared_resource'], module.params['name'], module.params['src'])
+                    module.params['shared_resource'], ' '.join(merged), module.params['src'])
 
-    lpackage_update = module.run_command(lpackage_update_cmd, use_unsafe_shell=True)
+    before, taken = update_snapshot(module, packages)
+    lpackage_update = run_package_cmd(module, lpackage_update_cmd, packages, '/tmp/IBM-Update.log', 'update',
+                                      module.params['dest'], before)
     if lpackage_update[0] != 0:
+        results.update(dict((package, 'failed') for package in packages))
         module.fail_json(
-            msg="Failed to update package: {0}. Please see log in /tmp/ for more details.".format(module.params['name']),
+            msg="Failed to update package(s): {0}. Please see log in /tmp/ for more details.".format(' '.join(packages)),
             changed=False,
-            details=lpackage_update_cmd,
-            stderr=lpackage_update[2]
+            details=lpackage_update_cmd(packages),
+            packages=results,
+            queue=lpackage_update[3],
+            mirror=mirror,
+            kit=kit,
+            verify=verify,
+            snapshot=taken or None,
+            error=lpackage_update[2],
+            stdout=lpackage_update[1]
         )
+
+    results.update(dict((package, 'updated') for package in packages))
     module.exit_json(
-        msg="Succesfully updated package: {0}".format(module.params['name']),
-        changed=True
+        msg="Succesfully updated package(s): {0}".format(' '.join(packages)),
+        changed=True,
+        packages=results,
+        queue=lpackage_update[3],
+        mirror=mirror,
+        kit=kit,
+        verify=verify,
+        snapshot=taken or None
     )
 
-def update_package_remote(module):
+def update_package_remote(module, packages, results, mirror=None, kit=None, verify=None):
     """Function that updates packages for target environment."""
 
-    rpackage_update_cmd = """{0} -acceptLicense -sharedResourcesDirectory {1} \
+    def rpackage_update_cmd(merged):
+        return """{0} -acceptLicense -sharedResourcesDirectory {1} \
             install {2} -repositories {3} -log /tmp/IBM-Update.log \
             -secureStorageFile {4} -masterPasswordFile {5}""".format(module.params['path'],
-                    module.params['shared_resource'], module.params['name'], module.params['src'],
+                    module.params['shared_resource'], ' '.join(merged), module.params['src'],
                     module.params['secure_storage'], module.params['password_file'])
 
-    rpackage_update = module.run_command(rpackage_update_cmd, use_unsafe_shell=True)
+    before, taken = update_snapshot(module, packages)
+    rpackage_update = run_package_cmd(module, rpackage_update_cmd, packages, '/tmp/IBM-Update.log', 'update',
+                                      module.params['dest'], before)
 
     if rpackage_update[0] != 0:
+        results.update(dict((package, 'failed') for package in packages))
         module.fail_json(
-            msg="Failed to update package: {0}. Please see log in /tmp/ for more details.".format(module.params['name']),
+            msg="Failed to update package(s): {0}. Please see log in /tmp/ for more details.".format(' '.join(packages)),
             changed=False,
-            stderr=rpackage_update[2]
+            packages=results,
+            queue=rpackage_update[3],
+            mirror=mirror,
+            kit=kit,
+            verify=verify,
+            snapshot=taken or None,
+            error=rpackage_update[2],
+            stdout=rpackage_update[1]
+        )
+
+    results.update(dict((package, 'updated') for package in packages))
+    module.exit_json(
+        msg="Succesfully updated package(s): {0}".format(' '.join(packages)),
+        changed=True,
+        packages=results,
+        queue=rpackage_update[3],
+        mirror=mirror,
+        kit=kit,
+        verify=verify,
+        snapshot=taken or None
+    )
+
+def snapshot_directory(module):
+    """Function that returns the directory the snapshots of dest are kept in."""
+
+    if module.params['snapshot_dir'] is not None:
+        return module.params['snapshot_dir']
+    return default_snapshot_dir(module.params['dest'])
+
+
+def update_snapshot(module, packages):
+    """Function that prepares the pre-update snapshot of dest and the IM agent data.
+    Returns (before, taken). before() takes the snapshot and evicts the old ones
+    and is run once the IM lease is held, so no other imcl changes the agent data
+    meanwhile. taken holds the snapshot metadata once it was taken.
+    """
+
+    taken = {}
+    if not module.params['snapshot']:
+        return None, taken
+
+    def before():
+        snapshot_dir = snapshot_directory(module)
+        agent_data = imcl_agent_data(module)
+        taken.update(create_snapshot(snapshot_dir, [module.params['dest'], agent_data],
+                                     label=' '.join(packages), copied=[agent_data]))
+        taken['evicted'] = prune_snapshots(snapshot_dir, module.params['snapshot_keep'], module.params['dest'])
+
+    return before, taken
+
+
+def restore_package_snapshot(module):
+    """Function that rolls dest and the IM agent data back to a snapshot.
+    Unlike imcl rollback this neither needs the IM rollback files nor reruns the
+    update backwards, the snapshot tree is just swapped back in.
+    """
+
+    snapshots = list_snapshots(snapshot_directory(module), module.params['dest'])
+    if module.params['snapshot_id'] is not None:
+        snapshots = [s for s in snapshots if s['id'] == module.params['snapshot_id']]
+    if not snapshots:
+        module.fail_json(
+            msg="No snapshot {0}of {1} found in {2}".format(
+                module.params['snapshot_id'] + ' ' if module.params['snapshot_id'] else '',
+                module.params['dest'], snapshot_directory(module)),
+            changed=False
         )
+    snapshot = snapshots[-1]
+    restored = dict(id=snapshot['id'], label=snapshot['label'], created=snapshot['created'])
+
+    if module.check_mode:
+        module.exit_json(msg="Snapshot {0} of {1} will be restored".format(snapshot['id'], module.params['dest']),
+                         changed=True, snapshot=restored)
+
+    def run(merged):
+        restored['duration'] = restore_snapshot(snapshot)
+        return 0, '', None
+
+    restore = queued_run(run, imcl_agent_data(module), queue_dir=module.params['queue_dir'],
+                         timeout=module.params['queue_timeout'])
+    invalidate_inventory(module.params['path'], module.params['cache_dir'])
+
+    if restore[0] != 0:
+        module.fail_json(
+            msg="Failed to restore snapshot {0} of {1}".format(snapshot['id'], module.params['dest']),
+            changed=True,
+            snapshot=restored,
+            queue=restore[3],
+            stderr=restore[2]
+        )
+
     module.exit_json(
-        msg="Succesfully updated package: {0}".format(module.params['name']),
-        changed=True
+        msg="Successfully restored snapshot {0} of {1}".format(snapshot['id'], module.params['dest']),
+        changed=True,
+        snapshot=restored,
+        queue=restore[3]
     )
 
-def rollback_package(module):
+
+def prune_agent_data(module):
+    """Function that prunes old rollback payloads, logs and temporary files of IM.
+    The removal runs once the IM lease is held, so no imcl works on the agent data
+    or shared resources meanwhile. Sizes before and after and the time a
+    listInstalledPackages takes afterwards, still under the lease, are reported.
+    """
+
+    agent_data = imcl_agent_data(module)
+    try:
+        offerings = read_agent_data(agent_data)
+    except AgentDataFormatError as e:
+        module.fail_json(msg="Refusing to prune: {0}".format(e), changed=False)
+
+    shared_resource = module.params['shared_resource'] or shared_resource_location(agent_data)
+    workers = module.params['prune_workers']
+    candidates, before = plan_prune(agent_data, shared_resource, offerings,
+                                    rollback_keep=module.params['rollback_keep'],
+                                    log_days=module.params['log_retention_days'], workers=workers,
+                                    prune_shared=module.params['prune_shared'])
+
+    report = dict(
+        agent_data=agent_data,
+        shared_resource=shared_resource,
+        before_mb=dict((label, round(size / float(MB), 1)) for label, size in before.items()),
+        reclaimable_mb=round(sum(c['bytes'] for c in candidates) / float(MB), 1),
+        candidates=[dict(path=c['path'], kind=c['kind'], reason=c['reason'], mb=round(c['bytes'] / float(MB), 1))
+                    for c in candidates]
+    )
+
+    if module.check_mode or not candidates:
+        module.exit_json(
+            msg="{0} MB can be pruned from the IM agent data and shared resources".format(report['reclaimable_mb']),
+            changed=bool(candidates),
+            prune=report
+        )
+
+    removed = dict(paths=[], errors=[])
+
+    def run(merged):
+        started = time.time()
+        paths, errors = prune(candidates, workers)
+        removed.update(paths=paths, errors=errors, duration=round(time.time() - started, 1))
+
+        started = time.time()
+        rc, stdout, stderr = module.run_command("{0} listInstalledPackages".format(module.params['path']),
+                                                use_unsafe_shell=True)
+        removed['list_installed_seconds'] = round(time.time() - started, 2)
+        if rc != 0:
+            errors.append("listInstalledPackages failed after pruning: {0}".format(stderr.strip() or stdout.strip()))
+        return (1 if errors else 0), '', '\n'.join(errors)
+
+    pruned = queued_run(run, agent_data, queue_dir=module.params['queue_dir'], timeout=module.params['queue_timeout'])
+
+    after = dict(agent_data=tree_size(agent_data, workers))
+    if shared_resource is not None:
+        after['shared_resource'] = tree_size(shared_resource, workers)
+    report.update(
+        after_mb=dict((label, round(size / float(MB), 1)) for label, size in after.items()),
+        reclaimed_mb=round((sum(before.values()) - sum(after.values())) / float(MB), 1),
+        removed=len(removed['paths']),
+        duration=removed.get('duration'),
+        list_installed_seconds=removed.get('list_installed_seconds')
+    )
+
+    if pruned[0] != 0:
+        module.fail_json(
+            msg="Failed to prune part of the IM agent data and shared resources",
+            changed=bool(removed['paths']),
+            prune=report,
+            queue=pruned[3],
+            stderr=pruned[2]
+        )
+
+    module.exit_json(
+        msg="Pruned {0} MB from the IM agent data and shared resources".format(report['reclaimed_mb']),
+        changed=True,
+        prune=report,
+        queue=pruned[3]
+    )
+
+
+def rollback_package(module, packages, results):
     """Function to rollback to a previous package version."""
 
     rllbck_pckg_cmd = """{0} rollback {1}""".format(module.params['path'],
-            module.params['name'])
-    rllbck_pckg = module.run_command(rllbck_pckg_cmd, use_unsafe_shell=True)
+            ' '.join(packages))
+    rllbck_pckg = queued_command(module, rllbck_pckg_cmd)
 
     if rllbck_pckg[0] != 0:
+        results.update(dict((package, 'failed') for package in packages))
         module.fail_json(
-            msg="Failed to rollback package: {0} because the package was not previously installed".format(module.params['name']),
+            msg="Failed to rollback package(s): {0} because the package was not previously installed".format(' '.join(packages)),
             changed=False,
+            packages=results,
+            queue=rllbck_pckg[3],
             stderr=rllbck_pckg[2]
         )
+
+    results.update(dict((package, 'rolled back') for package in packages))
     module.exit_json(
-        msg="Successfully rolled back package: {0}".format(module.params['name']),
-        changed=True
+        msg="Successfully rolled back package(s): {0}".format(' '.join(packages)),
+        changed=True,
+        packages=results,
+        queue=rllbck_pckg[3]
     )
 
 
-def uninstall(module):
+def uninstall(module, packages=None, results=None):
     """ Function that will uninstall all a package
     or if all: yes is specified will uninstall all
     packages in the given WAS cell
@@ -294,76 +946,477 @@ def uninstall(module):
 
     if (module.params['remove_all'] == 'no'):
         uninstall_cmd = """{0} uninstall {1}""".format(module.params['path'],
-            module.params['name'])
-        uninstall = module.run_command(uninstall_cmd, use_unsafe_shell=True)
+            ' '.join(packages))
+        uninstall = queued_command(module, uninstall_cmd)
     
         if uninstall[0] != 0:
+            results.update(dict((package, 'failed') for package in packages))
             module.fail_json(
-                msg="Failed to uninstall package {0}".format(module.params['name']),
+                msg="Failed to uninstall package(s) {0}".format(' '.join(packages)),
                 changed=False,
+                packages=results,
+                queue=uninstall[3],
                 stderr=uninstall[2]
             )
+
+        results.update(dict((package, 'removed') for package in packages))
         module.exit_json(
-                msg="Succesfully uninstalled package {0}".format(module.params['name']),
-                changed=True
+                msg="Succesfully uninstalled package(s) {0}".format(' '.join(packages)),
+                changed=True,
+                packages=results,
+                queue=uninstall[3]
         )
 
     if (module.params['remove_all'] == 'yes'):
         uninstallAll_cmd = """{0} uninstallAll""".format(module.params['path'])
 
-        uninstallAll = module.run_command(uninstallAll_cmd, use_unsafe_shell=True)
+        uninstallAll = queued_command(module, uninstallAll_cmd)
 
         if uninstallAll[0] != 0:
             module.fail_json(
                 msg="Failed to uninstall all products. See stderr/stdout for details...",
                 changed=False,
+                queue=uninstallAll[3],
                 stderr=uninstallAll[2],
                 stdout=uninstallAll[1]
             )
 
         module.exit_json(
             msg="Succesfully removed all packages",
-            changed=True
+            changed=True,
+            queue=uninstallAll[3]
+        )
+
+
+def profile_was_home(profile):
+    """Function that reads the WAS_HOME a profile currently runs from.
+    The value comes from the profile's bin/setupCmdLine.sh.
+    """
+
+    setup = os.path.join(profile, 'bin', 'setupCmdLine.sh')
+    try:
+        with open(setup, 'r') as f_obj:
+            for line in f_obj:
+                match = re.match(r'\s*(?:export\s+)?WAS_HOME=["\']?([^"\'\s]+)', line)
+                if match:
+                    return os.path.normpath(match.group(1))
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def was_home_pointers(profile):
+    """Function that lists the profile files that point at the installation directory.
+    These are the profile bin scripts, the fsdb scripts and the WAS_INSTALL_ROOT
+    variables of every node in the profile's configuration.
+    """
+
+    pointers = glob.glob(os.path.join(profile, 'bin', '*.sh'))
+    for root, dirs, files in os.walk(os.path.join(profile, 'properties', 'fsdb')):
+        pointers.extend([os.path.join(root, f) for f in files if f.endswith('.sh')])
+    pointers.extend(glob.glob(os.path.join(profile, 'config', 'cells', '*', 'nodes', '*', 'variables.xml')))
+    return pointers
+
+
+def repoint_file(pointer, old, new):
+    """Function that replaces the installation directory old by new in one file.
+    Only whole path matches are replaced. Returns True when the file changed.
+    """
+
+    with open(pointer, 'r') as f_obj:
+        content = f_obj.read()
+    repointed = re.sub(re.escape(old) + r'(?=[/"\'\s:;<]|$)', new.replace('\\', r'\\'), content, flags=re.M)
+    if repointed == content:
+        return False
+
+    stat = os.stat(pointer)
+    tmp_file = pointer + '.ibm_imcl'
+    with open(tmp_file, 'w') as f_obj:
+        f_obj.write(repointed)
+    os.chmod(tmp_file, stat.st_mode)
+    os.rename(tmp_file, pointer)
+    return True
+
+
+def switch_profiles(module, target=None):
+    """Function that switches profiles over to another installation directory.
+    With target set, every profile is pointed at target (update_mode: switch).
+    Without it, every profile goes back to the directory it used before its last
+    switch (update_mode: switch_back). The previous directory is left untouched,
+    so switching back is as quick as switching over.
+    """
+
+    switched = {}
+    for profile in module.params['profiles']:
+        history_file = os.path.join(profile, 'properties', SWITCH_HISTORY)
+        current = profile_was_home(profile)
+        if current is None:
+            module.fail_json(msg="Could not read WAS_HOME of profile {0}".format(profile), changed=False)
+
+        new = target
+        if new is None:
+            try:
+                with open(history_file, 'r') as f_obj:
+                    new = json.load(f_obj)['previous']
+            except (IOError, OSError, ValueError, KeyError):
+                module.fail_json(msg="Profile {0} has no previous installation directory to switch back to.".format(profile),
+                                 changed=False)
+
+        new = os.path.normpath(new)
+        if new == current:
+            continue
+        if not os.path.isdir(os.path.join(new, 'bin')):
+            module.fail_json(msg="{0} is not an installation directory, not switching profile {1}.".format(new, profile),
+                             changed=False)
+
+        switched[profile] = dict(previous=current, was_home=new)
+        if module.check_mode:
+            continue
+
+        for name in ['profileRegistry.xml', 'fsdb']:
+            registry = os.path.join(current, 'properties', name)
+            staged_registry = os.path.join(new, 'properties', name)
+            if os.path.exists(registry) and not os.path.exists(staged_registry):
+                if os.path.isdir(registry):
+                    shutil.copytree(registry, staged_registry, symlinks=True)
+                else:
+                    shutil.copy2(registry, staged_registry)
+
+        switched[profile]['files'] = [p for p in was_home_pointers(profile) if repoint_file(p, current, new)]
+        with open(history_file, 'w') as f_obj:
+            json.dump(dict(was_home=new, previous=current, switched=time.time()), f_obj)
+
+    module.exit_json(
+        msg="Switched profile(s) {0}".format(' '.join(sorted(switched))) if switched
+            else "Profile(s) already use the requested installation directory.",
+        changed=bool(switched),
+        profiles=switched
+    )
+
+
+def staged_dest(module, packages):
+    """Function that returns the sibling directory an update is staged into.
+    Defaults to <dest>_<version> of the first offering being updated.
+    """
+
+    if module.params['staged_dest'] is not None:
+        return module.params['staged_dest']
+
+    offering_id, version = split_package(packages[0])
+    if version is None:
+        module.fail_json(msg="staged_dest is required when the update version of {0} is not known.".format(packages[0]),
+                         changed=False)
+    return '{0}_{1}'.format(module.params['dest'].rstrip('/'), version)
+
+
+def verify_manifest(module):
+    """Function that checks the kit against kit_manifest before anything is installed from it.
+    Returns the verification report.
+    """
+
+    try:
+        report = verify_kit(module.params['kit_manifest'],
+                            os.path.join(module.params['kit_cache_dir'], DIGEST_CACHE))
+    except (IOError, OSError) as e:
+        module.fail_json(msg="Failed to read kit manifest {0}: {1}".format(module.params['kit_manifest'], e),
+                         changed=False)
+
+    if report['failed']:
+        module.fail_json(
+            msg="Kit verification against {0} failed for: {1}".format(
+                module.params['kit_manifest'], ', '.join(sorted(report['failed']))),
+            changed=False,
+            verify=report
         )
+    return report
+
+
+def kit_repository(module):
+    """Function that extracts the kit through the shared kit cache and puts it in front of src.
+    Returns the kit cache info.
+    """
+
+    try:
+        path, info = cached_kit(module.params['kit'], module.params['kit_cache_dir'], module.params['kit_cache_mb'])
+    except (KitError, IOError, OSError) as e:
+        module.fail_json(msg="Failed to extract kit {0}: {1}".format(module.params['kit'], e), changed=False)
+
+    module.params['src'] = ','.join([path] + ([module.params['src']] if module.params['src'] else []))
+    return info
 
 
-def package_check(module):
+def sync_mirror(module):
+    """Function that mirrors every src repository into mirror_dir and points src at the mirrors.
+    Only artifacts that are missing or changed in the mirror are fetched, so every
+    host after the first one, and every later run, transfers little or nothing.
+    In check mode the mirrors are only compared, and src is left as it is. A remote
+    repository is not contacted in check mode, its mirror is reported from local state.
+    Returns the sync statistics per repository.
+    """
+
+    mirrored = []
+    stats = []
+    for repository in [r.strip() for r in module.params['src'].split(',') if r.strip()]:
+        if not is_remote(repository) and not os.path.isdir(repository):
+            # zipped repositories are already local
+            mirrored.append(repository)
+            continue
+        mirror = mirror_path(module.params['mirror_dir'], repository)
+        try:
+            stats.append(mirror_repository(repository, mirror, workers=module.params['mirror_workers'],
+                                           check_only=module.check_mode))
+        except (MirrorError, IOError, OSError) as e:
+            module.fail_json(msg="Failed to mirror repository {0} into {1}: {2}".format(repository, mirror, e),
+                             changed=bool([s for s in stats if s['changed']]), mirror=stats)
+        mirrored.append(mirror)
+
+    if not module.check_mode:
+        module.params['src'] = ','.join(mirrored)
+    return stats
+
+
+def package_names(module):
+    """Function that returns the requested offerings as a flat list.
+    name accepts a list or a string, and every item may still hold several space
+    separated offerings. Commas are never split on: imcl reads <offering>,<feature>
+    as a feature spec, which is rejected in favour of the features option.
+    """
+
+    value = module.params['name']
+    if value is None:
+        items = []
+    elif isinstance(value, list):
+        items = value
+    else:
+        items = [value]
+
+    names = []
+    for item in items:
+        for package in '{0}'.format(item).split():
+            if ',' in package:
+                module.fail_json(
+                    msg="Package {0} is an imcl feature spec. Give the offering in name and its features in "
+                        "features instead.".format(package),
+                    changed=False
+                )
+            if package not in names:
+                names.append(package)
+    return names
+
+
+def resolve_packages(module, names):
+    """Function that validates the requested offerings against the src repository index.
+    Typos fail fast here instead of after a long imcl run. For state update a bare offering
+    id is resolved to the latest fix pack in the repository. In check mode a remote
+    repository is never contacted, only its cached index is used.
+    When there is no readable repository metadata the names are returned untouched.
+    Returns a tuple of (names, index), index is None when there was nothing to index.
+    """
+
+    if module.params['src'] is None or module.params['state'] not in ['present', 'update']:
+        return names, None
+
+    index = repositories_index(module.params['src'], module.params['cache_dir'], offline=module.check_mode)
+    if index is None:
+        return names, None
+
+    resolved = []
+    for package in names:
+        offering = resolve_offering(index, package)
+        if offering is None:
+            module.fail_json(
+                msg="Package {0} is not available in repository {1}.".format(package, module.params['src']),
+                changed=False,
+                suggestions=suggest_offerings(index, package)
+            )
+        if module.params['state'] == 'update':
+            resolved.append(offering)
+        else:
+            resolved.append(package)
+    return resolved, index
+
+
+def package_check(module, names):
     """Function that will be checking target cell for package existance.
     This portion will be doing package lookups to ensure that the package being installed
     either exists in the cell, or doesn't for all module.params['state']
+    The installed inventory is read natively from the IM agent data, so presence checks and
+    check mode do not start an imcl JVM. imcl is only launched when the agent data format
+    is not recognized and the cached listing is stale.
+    Every requested offering is checked against the same inventory, and a dict of
+    package => installed (bool) is returned.
+    """
+
+    packages, source = installed_inventory(module, module.params['path'],
+            agent_data=module.params['agent_data'], cache_dir=module.params['cache_dir'],
+            offline=module.check_mode)
+
+    return dict((package, package_installed(package, packages)) for package in names)
+
+
+def with_features(module, packages):
+    """Function that appends the requested features to every offering of an install.
+    imcl installs <offering>,<feature>,<feature> with exactly those features plus the ones they require.
+    """
+
+    if not module.params['features']:
+        return list(packages)
+    return [','.join([package] + module.params['features']) for package in packages]
+
+
+def feature_deltas(module, packages):
+    """Function that computes the feature changes needed on installed offerings.
+    The installed features are read from the IM agent data, or a cached
+    imcl listInstalledPackages -features -long, and only the difference to
+    features/remove_features is kept. Returns {package: {location, add, remove}}
+    for the offerings that need an imcl modify.
+    """
+
+    installed, source = installed_features(module, module.params['path'],
+            agent_data=module.params['agent_data'], cache_dir=module.params['cache_dir'],
+            offline=module.check_mode)
+
+    deltas = {}
+    for package in packages:
+        for offering, info in sorted(installed.items()):
+            if not package_installed(package, [offering]):
+                continue
+            add = [f for f in module.params['features'] if f not in info['features']]
+            remove = [f for f in module.params['remove_features'] if f in info['features']]
+            if add or remove:
+                deltas[package] = dict(offering=offering, location=info['location'] or module.params['dest'],
+                                       add=add, remove=remove)
+    return deltas
+
+
+def modify_features(module, deltas, results):
+    """Function that applies feature deltas with imcl modify.
+    Adding or removing a feature only touches that feature's files, which takes
+    minutes instead of the uninstall and reinstall of the whole offering.
+    imcl modifies one offering per invocation.
     """
 
-    check_package_cmd = """{0} listInstalledPackages""".format(module.params['path'])
-    check_package = module.run_command(check_package_cmd, use_unsafe_shell=True)
+    for package, delta in sorted(deltas.items()):
+        offering_id = delta['offering'].split('_')[0]
+
+        def modify_cmd(merged):
+            cmd = """{0} modify {1} -installationDirectory {2} -log /tmp/IBM-Modify.log \
+            -acceptLicense""".format(module.params['path'], offering_id, delta['location'])
+            if delta['add']:
+                cmd += " -addFeatures {0}".format(','.join(delta['add']))
+            if delta['remove']:
+                cmd += " -removeFeatures {0}".format(','.join(delta['remove']))
+            if delta['add'] and module.params['src'] is not None:
+                cmd += " -repositories {0}".format(module.params['src'])
+            if delta['add'] and module.params['secure_storage'] is not None:
+                cmd += " -secureStorageFile {0} -masterPasswordFile {1}".format(
+                    module.params['secure_storage'], module.params['password_file'])
+            return cmd
 
-    name = module.params['name']
+        modify = run_package_cmd(module, modify_cmd, [package], '/tmp/IBM-Modify.log', 'modify',
+                                 delta['location'], merge=False)
 
-    name = name.split()
-    for package in name:
-      if package in check_package[1]:
-          return 1
-      else:
-          return 0
+        if modify[0] != 0:
+            results[package] = 'failed'
+            module.fail_json(
+                msg="Failed to modify the features of package {0}. Please see log in /tmp/ for more details.".format(package),
+                changed=bool([p for p in results.values() if p == 'modified']),
+                details=modify_cmd([package]),
+                packages=results,
+                features=deltas,
+                queue=modify[3],
+                error=modify[2],
+                stdout=modify[1]
+            )
+        results[package] = 'modified'
+
+
+def preflight(module, index, packages, dest):
+    """Function that rejects an install or update that can not succeed before imcl starts.
+    The space needed in dest, shared_resource and /tmp is estimated from the offering
+    sizes in the repository index and checked with a statvfs of every filesystem, and
+    imcl and the target directories are checked for access. Depending on the preflight
+    option a problem fails the task or only warns about it.
+    Returns the space report, one entry per filesystem.
+    """
+
+    if module.params['preflight'] == 'skip':
+        return []
+
+    sizes = [offering_size(index, package) for package in packages] if index is not None else []
+    total = sum([size for size in sizes if size])
+    report = []
+    if total:
+        report = space_report([
+            ('dest', dest, total * SPACE_FACTORS['dest']),
+            ('shared_resource', module.params['shared_resource'] or dest, total * SPACE_FACTORS['shared_resource']),
+            ('tmp', '/tmp', total * SPACE_FACTORS['tmp'])
+        ])
+
+    problems = prerequisite_problems(module.params['path'], [p for p in [dest, module.params['shared_resource']] if p])
+    for entry in report:
+        if entry['shortfall_mb']:
+            problems.append("{0} needs {1} MB more for {2}: {3} MB required, {4} MB available".format(
+                entry['filesystem'], entry['shortfall_mb'], ', '.join(entry['targets']),
+                entry['required_mb'], entry['available_mb']))
+
+    if problems and module.params['preflight'] == 'fail':
+        module.fail_json(
+            msg="Preflight failed for package(s) {0}: {1}".format(' '.join(packages), '; '.join(problems)),
+            changed=False,
+            preflight=report
+        )
+    for problem in problems:
+        module.warn(problem)
+    return report
 
 
 def main():
     """Function that does all the main logic for the module.
     This portion will be doing package lookups to ensure that the package being installed
     either exists in the cell, or doesn't for all module.params['state']
+    Only the offerings that still need work are handed to imcl, in a single invocation.
     """
 
     module = AnsibleModule(
         argument_spec=dict(
             remove_all=dict(type='str', required=False, choices=['yes', 'no'], default='no'),
-            state=dict(type='str', required=True, choices=['present', 'absent', 'update', 'rollback']),
+            state=dict(type='str', required=True, choices=['present', 'absent', 'update', 'rollback', 'prune']),
             src=dict(type='str', required=False),
             dest=dict(type='str', required=False),
             path=dict(type='str', required=True),
-            name=dict(type='str', required=False),
+            name=dict(type='raw', required=False),
             shared_resource=dict(type='str', required=False),
             secure_storage=dict(type='str', required=False, default=None),
             password_file=dict(type='str', required=False, default=None),
-            properties=dict(type='str', required=False, default=None)
+            properties=dict(type='str', required=False, default=None),
+            agent_data=dict(type='path', required=False, default=None),
+            cache_dir=dict(type='path', required=False, default=DEFAULT_CACHE_DIR),
+            status_file=dict(type='path', required=False, default=None),
+            fail_patterns=dict(type='list', required=False, default=[]),
+            queue_dir=dict(type='path', required=False, default=DEFAULT_QUEUE_DIR),
+            queue_timeout=dict(type='int', required=False, default=7200),
+            update_mode=dict(type='str', required=False, default='in_place',
+                             choices=['in_place', 'stage', 'switch', 'switch_back']),
+            staged_dest=dict(type='path', required=False, default=None),
+            profiles=dict(type='list', required=False, default=[]),
+            snapshot=dict(type='bool', required=False, default=False),
+            snapshot_dir=dict(type='path', required=False, default=None),
+            snapshot_keep=dict(type='int', required=False, default=3),
+            snapshot_id=dict(type='str', required=False, default=None),
+            features=dict(type='list', required=False, default=[]),
+            remove_features=dict(type='list', required=False, default=[]),
+            preflight=dict(type='str', required=False, default='fail', choices=['fail', 'warn', 'skip']),
+            mirror_dir=dict(type='path', required=False, default=None),
+            mirror_workers=dict(type='int', required=False, default=4),
+            kit=dict(type='path', required=False, default=None),
+            kit_cache_dir=dict(type='path', required=False, default=DEFAULT_KIT_CACHE_DIR),
+            kit_cache_mb=dict(type='int', required=False, default=DEFAULT_KIT_CACHE_MB),
+            kit_manifest=dict(type='path', required=False, default=None),
+            rollback_keep=dict(type='int', required=False, default=1),
+            log_retention_days=dict(type='int', required=False, default=30),
+            prune_workers=dict(type='int', required=False, default=8),
+            prune_shared=dict(type='bool', required=False, default=False)
         ),
         supports_check_mode = True,
         required_if=[
@@ -377,52 +1430,133 @@ def main():
     src = module.params['src']
     dest = module.params['dest']
     path = module.params['path']
-    name = module.params['name']
     shared_resource = module.params['shared_resource']
     secure_storage = module.params['secure_storage']
     password_file =  module.params['password_file']
     properties = module.params['properties']
+    update_mode = module.params['update_mode']
+
+    if state == 'update' and update_mode in ['switch', 'switch_back']:
+        if not module.params['profiles']:
+            module.fail_json(msg="profiles is required for update_mode {0}".format(update_mode), changed=False)
+        if update_mode == 'switch' and module.params['staged_dest'] is None:
+            module.fail_json(msg="staged_dest is required for update_mode switch", changed=False)
+        switch_profiles(module, module.params['staged_dest'] if update_mode == 'switch' else None)
 
-    if remove_all == 'yes':
+    if state == 'rollback' and module.params['snapshot']:
+        if dest is None:
+            module.fail_json(msg="dest is required to restore a snapshot", changed=False)
+        restore_package_snapshot(module)
+
+    if state == 'prune':
+        prune_agent_data(module)
+
+    if remove_all == 'yes' and not module.check_mode:
         uninstall(module)
+    if remove_all == 'yes' and module.check_mode:
+        module.exit_json(msg="All packages will be removed", changed=True)
 
-    pckg_check = package_check(module)
+    # Mirroring, kit verification and kit extraction only run once the presence check found
+    # something to do, so an idempotent rerun costs neither network nor hashing. Only an
+    # update from a kit alone needs the kit first, to resolve offering ids to its fix packs.
+    mirror = None
+    verify = None
+    kit = None
+    kit_first = module.params['kit'] is not None and src is None and state == 'update' and not module.check_mode
+    if kit_first:
+        verify = verify_manifest(module) if module.params['kit_manifest'] is not None else None
+        kit = kit_repository(module)
 
+    names, index = resolve_packages(module, package_names(module))
+    pckg_check = package_check(module, names)
 
-    if pckg_check != 1:
-        if (state == 'present') and not (module.check_mode):
-            install_package_local(module)
-        if (state == 'present') and (secure_storage is not None) and not (module.check_mode):
-            install_package_remote(module)
-        if (state == 'update') and (secure_storage is None) and not (module.check_mode):
-            update_package_local(module)
-        if (state == 'update') and (secure_storage is not None) and not (module.check_mode):
-            update_package_remote(module)
-        if (state == 'rollback') and not (module.check_mode):
-            rollback_package(module)
-        if module.check_mode:
-            if state == 'present':
-                module.exit_json(msg="Package: {0} will be installed to location {1}".format(name,dest),change=True)
-            if state == 'update':
-                module.exit_json(msg="Package: {0} will be updated".format(name),changed=True)
-            if state == 'absent':
-                module.exit_json(msg="Package: {0} is not present in cell. Nothing to remove.".format(name),changed=False)
-            if (state == 'rollback'):
-                module.exit_json(msg="Package {0} is not present to rollback".format(name),changed=False)
-    elif pckg_check != 0:
-        if (state == 'present'):
-            module.exit_json(msg="Package {0} is already present.".format(name),changed=False)
-        if (state == 'absent') and not (module.check_mode):
-            uninstall_package(module)
-        if (state == 'update') and not (module.check_mode):
-            module.exit_json(msg="Package {0} is already present.".format(name),changed=False)
-        if (state == 'rollback') and not (module.check_mode):
-            module.exit_json(msg="Package {0} not is not present to rollback.".format(name), changed=False)
-        if module.check_mode:
-            if (state == 'absent'):
-                module.exit_json(msg="Package {0} will be removed.".format(name),changed=True)
-            if (state == 'rollback'):
-                module.exit_json(msg="Package {0} will be rolled back".format(name),changed=True)
+    present = [package for package in names if pckg_check[package]]
+    missing = [package for package in names if not pckg_check[package]]
+    results = dict((package, 'present' if installed else 'absent') for package, installed in pckg_check.items())
+
+    deltas = {}
+    if state == 'present' and (module.params['features'] or module.params['remove_features']):
+        deltas = feature_deltas(module, present)
+
+    if state in ['present', 'update', 'rollback'] and not missing and not deltas:
+        module.exit_json(
+            msg="Package(s) {0} already present.".format(' '.join(present)),
+            changed=False,
+            packages=results,
+            mirror=mirror,
+            kit=kit,
+            verify=verify
+        )
+    if state == 'absent' and not present:
+        module.exit_json(
+            msg="Package(s) {0} not present in cell. Nothing to remove.".format(' '.join(missing)),
+            changed=False,
+            packages=results
+        )
+
+    if state in ['present', 'update'] and not kit_first:
+        if module.params['mirror_dir'] is not None and src is not None:
+            mirror = sync_mirror(module)
+        if module.params['kit_manifest'] is not None:
+            verify = verify_manifest(module)
+        if module.params['kit'] is not None and not module.check_mode:
+            kit = kit_repository(module)
+            missing, index = resolve_packages(module, missing)
+
+    if state in ['present', 'update'] and missing:
+        preflight(module, index, missing, staged_dest(module, missing) if update_mode == 'stage' else dest)
+
+    if module.check_mode:
+        if state == 'present' and deltas and not missing:
+            module.exit_json(msg="Features of package(s) {0} will be modified".format(' '.join(sorted(deltas))),
+                             changed=True, packages=results, features=deltas)
+        if state == 'present':
+            module.exit_json(msg="Package(s): {0} will be installed to location {1}".format(' '.join(missing), dest),
+                             changed=True, packages=results)
+        if state == 'update' and update_mode == 'stage':
+            module.exit_json(msg="Package(s): {0} will be staged into {1}".format(' '.join(missing),
+                             staged_dest(module, missing)), changed=True, packages=results)
+        if state == 'update':
+            module.exit_json(msg="Package(s): {0} will be updated".format(' '.join(missing)),
+                             changed=True, packages=results)
+        if state == 'absent':
+            module.exit_json(msg="Package(s) {0} will be removed.".format(' '.join(present)),
+                             changed=True, packages=results)
+        if state == 'rollback':
+            module.exit_json(msg="Package(s) {0} will be rolled back".format(' '.join(missing)),
+                             changed=True, packages=results)
+
+    if (state == 'present') and deltas:
+        modify_features(module, deltas, results)
+    if (state == 'present') and not missing:
+        module.exit_json(
+            msg="Successfully modified the features of package(s): {0}".format(' '.join(sorted(deltas))),
+            changed=True,
+            packages=results,
+            features=deltas
+        )
+    if (state == 'present') and (secure_storage is None):
+        install_package_local(module, missing, results, mirror=mirror, kit=kit,
+                              verify=verify)
+    if (state == 'present') and (secure_storage is not None):
+        install_package_remote(module, missing, results, mirror=mirror, kit=kit,
+                              verify=verify)
+    if (state == 'update') and (update_mode == 'stage') and (secure_storage is None):
+        install_package_local(module, missing, results, dest=staged_dest(module, missing), mirror=mirror, kit=kit,
+                              verify=verify)
+    if (state == 'update') and (update_mode == 'stage') and (secure_storage is not None):
+        install_package_remote(module, missing, results, dest=staged_dest(module, missing), mirror=mirror, kit=kit,
+                              verify=verify)
+    if (state == 'update') and (secure_storage is None):
+        update_package_local(module, missing, results, mirror=mirror, kit=kit,
+                              verify=verify)
+    if (state == 'update') and (secure_storage is not None):
+        update_package_remote(module, missing, results, mirror=mirror, kit=kit,
+                              verify=verify)
+    if (state == 'rollback'):
+        rollback_package(module, missing, results)
+    if (state == 'absent'):
+        uninstall(module, present, results)
 
 
 if __name__ == '__main__':
@@ -1,8 +1,9 @@
 #!/usr/bin/python
 
 
-import os
 from ansible.module_utils.basic import *
+from ansible.module_utils.ibm_was_server import LaunchError, launch_config_files, launch_script, start_with_script
+from ansible.module_utils.ibm_was_proc import process_table
 
 
 ANSIBLE_METADATA = {
@@ -41,6 +42,23 @@ options:
         description:
             - Name of IBM Profile that the node agent belongs to.
         required: true
+    launch:
+        description:
+            - How the Deployment Manager is started.
+            - wrapper runs startManager.sh, which first spins up a launcher JVM to build the dmgr command line.
+            - script has startManager.sh -script write that command line to a launch script once, caches it in
+            - <profile>/logs/ansible_launch keyed by a digest of the dmgr configuration, and starts the JVM
+            - straight from it until the configuration changes.
+        required: false
+        default: wrapper
+        choices:
+          - wrapper
+          - script
+    timeout:
+        description:
+            - Seconds to wait for the dmgr to write its pid file with launch script.
+        required: false
+        default: 600
 
 
 author:
@@ -72,21 +90,29 @@ message:
 '''
 
 
+def manager_running(path,profile):
+    """Function that tells if the Deployment Manager JVM is running.
+    The JVM is looked up in /proc, so a dmgr.pid left behind by a killed dmgr does not count as running.
+    """
+
+    profile_root = path+'/profiles/'+profile
+    return process_table().check(profile_root+'/logs/dmgr/dmgr.pid', profile_root, 'dmgr')['running']
+
+
 def stop_manager(module,path,profile,state):
     """Function to send IBM Deployment Manager into a stopped state.
     This function is idempotent, meaning it will only stop the dmgr profile
-    if it is up and running. Function will do a filesystem check for a .pid file
-    in the WAS_ROOT/profiles/logs/dmgr/ directory. If a .pid file exists, it is assumed
-    that the deployment manager is running.
+    if it is up and running. Function looks the dmgr JVM up in /proc with manager_running,
+    cross-checked with the .pid file in the WAS_ROOT/profiles/logs/dmgr/ directory.
     """
 
-    if  os.path.exists(path+"/profiles/"+profile+"/logs/dmgr/dmgr.pid"):
+    if manager_running(path, profile):
         stop_dmgr  = module.run_command(path+'/profiles/'+profile+'/bin/stopManager.sh', use_unsafe_shell=True)
         if stop_dmgr[0] != 0:
             module.fail_json(
                 msg='Failed to send Deployment Manager into %s for profile %s' % (state, profile),
                 changed=False,
-                stderr=start_dmgr[2]
+                stderr=stop_dmgr[2]
             )
         module.exit_json(
             msg='Succesfully sent Deployment Manager into % state for profile %s' % (state, profile),
@@ -101,10 +127,13 @@ def stop_manager(module,path,profile,state):
 def start_manager(module,path,profile,state):
     """Function that will send IBM Deployment Manager into a started state.
     This function is idempotent. Meaning that it will only start the deploymment manager if it is not running.
-    Function does a filesystem check to see if a .pid file exists. If file exits, module will return a OK run call.
+    Function checks for a running dmgr JVM with manager_running. If it runs, module will return a OK run call.
     """
 
-    if not os.path.exists(path+"/profiles/"+profile+"/logs/dmgr/dmgr.pid"):
+    if not manager_running(path, profile) and module.params['launch'] == 'script':
+        start_manager_script(module, path, profile, state)
+
+    if not manager_running(path, profile):
         start_dmgr = module.run_command(path+'/profiles/'+profile+'/bin/startManager.sh', use_unsafe_shell=True)
         if start_dmgr[0] != 0:
             module.fail_json(
@@ -122,6 +151,36 @@ def start_manager(module,path,profile,state):
         )
 
 
+def start_manager_script(module, path, profile, state):
+    """Function that starts the Deployment Manager JVM straight from its cached launch script.
+    The script is generated with startManager.sh -script, and regenerated only when the dmgr configuration changed.
+    """
+
+    profile_root = path+'/profiles/'+profile
+    try:
+        script, launch = launch_script(profile_root+'/bin/startManager.sh', profile_root, 'dmgr',
+                                       launch_config_files(path, profile_root, 'dmgr'))
+    except (LaunchError, IOError, OSError) as e:
+        module.fail_json(
+            msg='Failed to generate the Deployment Manager launch script for profile %s: %s' % (profile, e),
+            changed=False
+        )
+
+    rc, error = start_with_script(script, profile_root+'/logs/dmgr/dmgr.pid',
+                                  profile_root+'/logs/dmgr/ansible_startManager.out', module.params['timeout'])
+    if rc != 0:
+        module.fail_json(
+            msg='Failed to send Deployment Manager %s for profile %s: %s' % (state, profile, error),
+            changed=False,
+            launch=launch
+        )
+    module.exit_json(
+        msg='Succesfully sent Deployment Manager into %s state for profile %s' % (state, profile),
+        changed=True,
+        launch=launch
+    )
+
+
 def main():
     """
 	Main Module logic.
@@ -132,7 +191,9 @@ def main():
         argument_spec=dict(
             state=dict(type='str', required=True, choices=['start', 'stop']),
             profile=dict(type='str', required=True),
-            path=dict(type='str', required=True)
+            path=dict(type='str', required=True),
+            launch=dict(type='str', required=False, default='wrapper', choices=['wrapper', 'script']),
+            timeout=dict(type='int', required=False, default=600)
         ),
         supports_check_mode = True
     )
@@ -150,7 +211,7 @@ def main():
 
     if module.check_mode:
         if state == 'stop':
-            if  os.path.exists(path+"/profiles/"+profile+"/logs/dmgr/dmgr.pid"):
+            if manager_running(path, profile):
                 module.exit_json(
                     msg='>>>>>>>> Profile:  %s will be stopped <<<<<<<<' % (profile),
                     changed=True
@@ -161,7 +222,7 @@ def main():
                     changed=False
                 )
         if state == 'start':
-            if  os.path.exists(path+"/profiles/"+profile+"/logs/dmgr/dmgr.pid"):
+            if manager_running(path, profile):
                 module.exit_json(
                     msg='>>>>>>>> Profile: %s is already running <<<<<<<<' %(profile),
                     changed=False
@@ -1,7 +1,8 @@
 #!/usr/bin/python
 
-import os
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.ibm_was_server import LaunchError, launch_config_files, launch_script, start_with_script
+from ansible.module_utils.ibm_was_proc import process_table
 
 ANSIBLE_METADATA = {
     'metadata_version': '1.1',
@@ -37,6 +38,23 @@ options:
         description:
             - Name of IBM Profile that the node agent belongs to.
         required: true
+    launch:
+        description:
+            - How the node agent is started.
+            - wrapper runs startNode.sh, which first spins up a launcher JVM to build the node agent command line.
+            - script has startNode.sh -script write that command line to a launch script once, caches it in
+            - <profile>/logs/ansible_launch keyed by a digest of the node agent configuration, and starts the JVM
+            - straight from it until the configuration changes.
+        required: false
+        default: wrapper
+        choices:
+          - wrapper
+          - script
+    timeout:
+        description:
+            - Seconds to wait for the node agent to write its pid file with launch script.
+        required: false
+        default: 600
 
 
 author:
@@ -65,14 +83,22 @@ message:
 
 '''
 
+def node_running(path,profile):
+    """Function that tells if the node agent JVM is running.
+    The JVM is looked up in /proc, so a nodeagent.pid left behind by a killed node agent does not count as running.
+    """
+
+    profile_root = path+'/profiles/'+profile
+    return process_table().check(profile_root+'/logs/nodeagent/nodeagent.pid', profile_root, 'nodeagent')['running']
+
 def stop_node(module,state,path,profile):
     """Function that will stop IBM Node agent.
     Function is idempotent and will only stop if running.
-    To determine running state, we will check for the default .pid
-    location to determine state. Below are the return results:
+    To determine running state, we look the node agent JVM up in /proc
+    with node_running, cross-checked with the default .pid location.
     """
 
-    if state == 'stop' and os.path.exists(path+'/profiles/'+profile+'/logs/nodeagent/nodeagent.pid'):
+    if state == 'stop' and node_running(path,profile):
         stop_node =  module.run_command(path+'/profiles/'+profile+'/bin/stopNode.sh', use_unsafe_shell=True)
 
         if stop_node[0] != 0:
@@ -94,11 +120,14 @@ def stop_node(module,state,path,profile):
 def start_node(module,state,path,profile):
     """Function that will start Node Agent if stopped.
     Function is idempotent and will only start if stopped.
-    To determine running state we will check for the default .pid
-    location to determine state.
+    To determine running state we look the node agent JVM up in /proc
+    with node_running, cross-checked with the default .pid location.
     """
 
-    if not os.path.exists(path+'/profiles/'+profile+'/logs/nodeagent/nodeagent.pid'):
+    if not node_running(path,profile) and module.params['launch'] == 'script':
+        start_node_script(module,state,path,profile)
+
+    if not node_running(path,profile):
         start_node = module.run_command(path+'/profiles/'+profile+'/bin/startNode.sh', use_unsafe_shell=True)
         if start_node[0] != 0:
             module.fail_json(
@@ -115,6 +144,35 @@ def start_node(module,state,path,profile):
             msg='>>>>>>>> Node agent is already running <<<<<<<<'
         )
 
+def start_node_script(module,state,path,profile):
+    """Function that starts the node agent JVM straight from its cached launch script.
+    The script is generated with startNode.sh -script, and regenerated only when the node agent configuration changed.
+    """
+
+    profile_root = path+'/profiles/'+profile
+    try:
+        script, launch = launch_script(profile_root+'/bin/startNode.sh', profile_root, 'nodeagent',
+                                       launch_config_files(path, profile_root, 'nodeagent'))
+    except (LaunchError, IOError, OSError) as e:
+        module.fail_json(
+            msg='Failed to generate the node agent launch script for profile %s: %s' % (profile, e),
+            changed=False
+        )
+
+    rc, error = start_with_script(script, profile_root+'/logs/nodeagent/nodeagent.pid',
+                                  profile_root+'/logs/nodeagent/ansible_startNode.out', module.params['timeout'])
+    if rc != 0:
+        module.fail_json(
+            msg='Failed to send node agent into %s for profile %s: %s' % (state, profile, error),
+            changed=False,
+            launch=launch
+        )
+    module.exit_json(
+        msg='Succesfully sent node agent into %s state for profile %s' % (state, profile),
+        changed=True,
+        launch=launch
+    )
+
 def main():
     """Main Function of the module.
     Function will import other modules into main body to run the main logic"""
@@ -123,7 +181,9 @@ def main():
         argument_spec=dict(
             state=dict(type='str', required=True),
             path=dict(type='str', required=True),
-            profile=dict(type='str', required=True)
+            profile=dict(type='str', required=True),
+            launch=dict(type='str', required=False, default='wrapper', choices=['wrapper', 'script']),
+            timeout=dict(type='int', required=False, default=600)
         ),
         supports_check_mode = True
     )
@@ -140,7 +200,7 @@ def main():
 
     if module.check_mode:
         if state == 'stop':
-            if os.path.exists("%s/profiles/%s/logs/nodeagent/nodeagent.pid"):
+            if node_running(path,profile):
                 module.exit_json(
                     msg="Sending Nodeagent into %s state" % (state),
                     changed=True
@@ -152,7 +212,7 @@ def main():
                 )
 
         if state == 'start':
-            if not os.path.exists("%s/profiles/%s/logs/nodeagent/nodeagent.pid"):
+            if not node_running(path,profile):
                 module.exit_json(
                     msg="Sending node agent into %s state." % (state),
                     changed=True
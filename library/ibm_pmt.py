@@ -1,7 +1,12 @@
 #!/usr/bin/python
 
 import os
+import socket
+import time
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.ibm_was_inventory import existing_profiles
+from ansible.module_utils.ibm_was_pmt import DEFAULT_LOCK_DIR, DEFAULT_PORT_BLOCK, DEFAULT_PORTS_DIR, \
+    DEFAULT_STARTING_PORT, PMT_JVM_MB, create_profiles, plan_ports, port_args, release_ports
 
 
 ANSIBLE_METADATA = {
@@ -47,6 +52,17 @@ options:
         description:
             - HostName or IP Address of server where deployment manager resides
         required: false
+    existence_check:
+        description:
+            - How the module finds out whether the profile already exists.
+            - registry reads the exact profile names from <path>/properties/profileRegistry.xml, without a JVM,
+            - so check mode never starts one.
+            - manageprofiles runs manageprofiles.sh -listProfiles instead, e.g. when the registry can not be read.
+        required: false
+        default: registry
+        choices:
+            - registry
+            - manageprofiles
     module.params[path]:
         description:
             - Path of IBM Install root. E.g /opt/IBM/WebSphere/AppServer.
@@ -54,11 +70,71 @@ options:
     profile:
         description:
             - The name of the profile that will be created
-        required: true
+        required: true, unless profiles is given
+    profiles:
+        description:
+            - List of profiles to create with state present, instead of the single profile.
+            - Every entry takes profile, profile_path and profile_type, and optionally template_path,
+            - cell_name, node_name, dmgr_host, admin_user, admin_password and security; the last four
+            - default to the module options of the same name. A management profile with security enabled
+            - (the default) needs admin_user and admin_password; every entry is checked before any is created.
+            - Profiles that already exist are skipped. The others are created in a worker pool.
+            - Nothing is started between creates, so a custom profile can not federate (dmgr_host) into a
+            - management profile created on this host in the same run; such a list fails before anything is
+            - created. Create and start the dmgr first, then the custom profiles federating into it.
+        required: false
+    jvm_mb:
+        description:
+            - Memory in MB one manageprofiles JVM needs. The worker pool for profiles is limited to the
+            - available memory divided by jvm_mb.
+        required: false
+        default: 512
+    max_workers:
+        description:
+            - Upper limit for the number of profiles created at the same time.
+        required: false
+    template_slots:
+        description:
+            - Number of profiles created from the same template path at the same time. Creates from one
+            - template take turns on a lock in lock_dir, which also holds against other tasks on the host.
+        required: false
+        default: 1
+    lock_dir:
+        description:
+            - Directory of the template path locks.
+        required: false
+        default: /tmp/ibm_pmt_locks
+    plan_ports:
+        description:
+            - Work out the ports of new profiles up front instead of letting manageprofiles probe for them.
+            - The ports in the serverindex.xml of every existing profile and the ports listening on the host
+            - are indexed, and every new profile gets its own block of ports from starting_port on.
+            - The block is written to a -portsFile in ports_dir, named after the template's ports as an
+            - existing profile of the same template (or the shipped management/managed template) defines
+            - them; otherwise the block is passed as -startingPort. Profiles created together never clash.
+            - The blocks are reserved in ports_dir until the creates finished, so other tasks on the host
+            - planning at the same time skip them.
+        required: false
+        default: false
+    starting_port:
+        description:
+            - First port plan_ports hands out.
+        required: false
+        default: 20000
+    port_block:
+        description:
+            - Distance between the port blocks of plan_ports. Raised to the number of ports of a template.
+        required: false
+        default: 20
+    ports_dir:
+        description:
+            - Directory plan_ports writes the ports files and its port block reservations to.
+        required: false
+        default: /tmp/ibm_pmt_ports
     profile_module.params[path]:
         description:
             - Path of newly created profile. E.g /opt/IBM/WebSphere/AppServer/profiles/Custom01
-        required: true
+        required: true, unless profiles is given
     profile_type:
         description:
             - Type of profile to be created.
@@ -93,6 +169,25 @@ EXAMPLES = '''
     profile: Custom01
     profile_type: custom
     dmgr_host: localhost
+- name: create a dmgr and unfederated custom profiles in parallel
+  ibm_pmt:
+    state: present
+    admin_user: MyAdmin
+    admin_password: MyPassword
+    path: /opt/IBM/WebSphere/AppServer
+    profiles:
+      - profile: Dmgr01
+        profile_path: /opt/IBM/WebSphere/AppServer/profiles/Dmgr01
+        profile_type: management
+        cell_name: Cell01
+      - profile: Custom01
+        profile_path: /opt/IBM/WebSphere/AppServer/profiles/Custom01
+        profile_type: custom
+      - profile: Custom02
+        profile_path: /opt/IBM/WebSphere/AppServer/profiles/Custom02
+        profile_type: custom
+    template_slots: 2
+    plan_ports: true
 - name: backup profile
   ibm_pmt:
     state: backup
@@ -110,6 +205,46 @@ EXAMPLES = '''
 '''
     
 
+def planned_ports(module, definitions):
+    """
+    Function that plans the ports of the profiles about to be created,
+    when plan_ports is set. Outside check mode the blocks stay reserved
+    until release_planned. Returns {profile: {start, ports}}.
+    """
+
+    if not module.params['plan_ports']:
+        return {}
+    try:
+        return plan_ports(module.params['path'], [(d['profile'], profile_template(module, d)) for d in definitions],
+                          module.params['starting_port'], module.params['port_block'],
+                          None if module.check_mode else module.params['ports_dir'])
+    except ValueError as e:
+        module.fail_json(msg=str(e), changed=False)
+
+
+def release_planned(module, profiles):
+    """
+    Function that releases the port blocks planned_ports reserved,
+    once the creates of the profiles finished.
+    """
+
+    if module.params['plan_ports'] and not module.check_mode:
+        release_ports(module.params['ports_dir'], profiles)
+
+
+def single_port_args(module):
+    """
+    Function that returns the port arguments for the single profile
+    of make_managerProfile and make_customProfile.
+    """
+
+    definition = dict(profile=module.params['profile'], profile_type=module.params['profile_type'])
+    plan = planned_ports(module, [definition])
+    if not plan:
+        return ""
+    return " " + " ".join(port_args(plan, module.params['ports_dir'], module.params['profile']))
+
+
 def make_managerProfile(module):
     """
     Function that creates an Deployment manager profile
@@ -131,6 +266,7 @@ def make_managerProfile(module):
         module.params['admin_password'],module.params['cell_name'],
         module.params['security'] ,module.params['profile_path'], 
         module.params['profile'])
+        create_dmgr_account += single_port_args(module)
 
         mngr_acct_create = module.run_command(create_dmgr_account, use_unsafe_shell=True)
 
@@ -143,9 +279,11 @@ def make_managerProfile(module):
 -profileName {5}""".format(module.params[path], module.parmas['admin_user'], 
         module.params['admin_password,'], module.params['security'],
         module.params['path'], module.params['profile'])
+        create_dmgr_account += single_port_args(module)
 
         mngr_acct_create = module.run_command(create_dmgr_account, use_unsafe_shell=True)
 
+    release_planned(module, [module.params['profile']])
     if mngr_acct_create[0] != 0:
         module.fail_json(
             msg="Failed to create account: {0}. Review errors and try again.".format(module.params['profile']),
@@ -170,8 +308,10 @@ def make_customProfile(module):
 -profileRoot {3} -profileName {4} -dmgrHost {5}".format(module.params['path'],
 module.params['admin_user'], module.params['admin_password'],
 module.params['path'], module.params['profile'], module.params['dmgr_host'])
+    create_custom_profile += single_port_args(module)
 
     cstm_account_create = module.run_command(create_custom_profile, use_unsafe_shell=True)
+    release_planned(module, [module.params['profile']])
     if cstm_account_create[0] != 0:
         module.fail_json(
                 msg="Failed to create account {0}".format(module.params['profile']),
@@ -185,21 +325,187 @@ module.params['path'], module.params['profile'], module.params['dmgr_host'])
     )
 
 
+def profile_template(module, definition):
+    """
+    Function that returns the template path a profile is created from.
+    """
+
+    if definition.get('template_path'):
+        return definition['template_path']
+    return "{0}/profileTemplates/{1}/".format(
+        module.params['path'], 'management' if definition['profile_type'] == 'management' else 'managed')
+
+
+def profile_setting(module, definition, key):
+    """
+    Function that returns a setting of one entry of profiles, or the
+    module option of the same name when the entry does not set it.
+    """
+
+    if definition.get(key) is not None:
+        return definition[key]
+    return module.params.get(key)
+
+
+def check_definition(module, definition):
+    """
+    Function that fails the module when an entry of profiles can not be
+    turned into a manageprofiles.sh -create command.
+    """
+
+    for key in ['profile', 'profile_path', 'profile_type']:
+        if not definition.get(key):
+            module.fail_json(
+                msg="Every entry of profiles needs {0}: {1}".format(key, definition.get('profile')),
+                changed=False
+            )
+    if definition['profile_type'] not in ['management', 'custom']:
+        module.fail_json(
+            msg="profile_type of {0} must be management or custom, not {1}".format(
+                definition['profile'], definition['profile_type']),
+            changed=False
+        )
+
+    credentials = [profile_setting(module, definition, key) for key in ['admin_user', 'admin_password']]
+    if definition['profile_type'] == 'management':
+        needed = profile_setting(module, definition, 'security') != 'disabled'
+        reason = "security is enabled"
+    else:
+        needed = bool(profile_setting(module, definition, 'dmgr_host')) and any(credentials)
+        reason = "dmgr admin credentials are given"
+    if needed and not all(credentials):
+        module.fail_json(
+            msg="Profile {0} needs admin_user and admin_password, as {1}".format(definition['profile'], reason),
+            changed=False
+        )
+
+
+def local_host(host):
+    """
+    Function that tells whether host names this host.
+    """
+
+    names = set(['localhost', socket.gethostname(), socket.gethostname().split('.')[0], socket.getfqdn()])
+    return host in names or host.startswith('127.') or host == '::1'
+
+
+def check_federation(module, missing):
+    """
+    Function that fails the module when a custom profile of the list
+    federates into a dmgr on this host that is only created in this run.
+    """
+
+    if not [d for d in missing if d['profile_type'] == 'management']:
+        return
+    federating = sorted(d['profile'] for d in missing if d['profile_type'] == 'custom'
+                        and profile_setting(module, d, 'dmgr_host')
+                        and local_host(profile_setting(module, d, 'dmgr_host')))
+    if federating:
+        module.fail_json(
+            msg="Profiles {0} federate into a dmgr on this host, but the dmgr is created in the same run and "
+                "not started. Create and start the dmgr first".format(', '.join(federating)),
+            changed=False
+        )
+
+
+def profile_create_cmd(module, definition, plan=None):
+    """
+    Function that builds the manageprofiles.sh -create command for one
+    entry of profiles, with its planned ports if any. Returns the command
+    and the template path.
+    """
+
+    def setting(key):
+        return profile_setting(module, definition, key)
+
+    management = definition['profile_type'] == 'management'
+    template = profile_template(module, definition)
+    cmd = ["{0}/bin/manageprofiles.sh".format(module.params['path']), '-create', '-templatePath', template,
+           '-profileName', definition['profile'], '-profileRoot', definition['profile_path']]
+    if definition.get('cell_name'):
+        cmd.extend(['-cellName', definition['cell_name']])
+    if definition.get('node_name'):
+        cmd.extend(['-nodeName', definition['node_name']])
+
+    if management:
+        security = 'false' if setting('security') == 'disabled' else 'true'
+        cmd.extend(['-serverType', 'DEPLOYMENT_MANAGER', '-enableAdminSecurity', security,
+                    '-personalCertValidityPeriod', '15', '-signingCertValidityPeriod', '20'])
+        if security == 'true':
+            cmd.extend(['-adminUserName', setting('admin_user'), '-adminPassword', setting('admin_password')])
+    elif setting('dmgr_host'):
+        cmd.extend(['-dmgrHost', setting('dmgr_host')])
+        if setting('admin_user'):
+            cmd.extend(['-dmgrAdminUserName', setting('admin_user'),
+                        '-dmgrAdminPassword', setting('admin_password')])
+    if plan:
+        cmd.extend(port_args(plan, module.params['ports_dir'], definition['profile']))
+    return cmd, template
+
+
+def make_profiles(module):
+    """
+    Function that creates every profile of the profiles list that does
+    not exist yet, several at a time.
+    """
+
+    started = time.time()
+    existing = existing_profiles(module, module.params['path'], module.params['existence_check'])
+    results = dict((d['profile'], dict(status='exists', changed=False))
+                   for d in module.params['profiles'] if d['profile'] in existing)
+    missing = [d for d in module.params['profiles'] if d['profile'] not in existing]
+
+    for definition in missing:
+        check_definition(module, definition)
+    check_federation(module, missing)
+
+    plan = planned_ports(module, missing)
+
+    if module.check_mode:
+        results.update((d['profile'], dict(status='would be created', changed=True, ports=plan.get(d['profile'])))
+                       for d in missing)
+        module.exit_json(
+            msg="Profiles {0} will be created on run".format(', '.join(d['profile'] for d in missing)),
+            changed=bool(missing),
+            profiles=results
+        )
+
+    jobs = [(d['profile'],) + tuple(profile_create_cmd(module, d, plan)) for d in missing]
+    created, workers = create_profiles(jobs, module.params['jvm_mb'], module.params['max_workers'],
+                                       module.params['lock_dir'], module.params['template_slots'])
+    release_planned(module, [d['profile'] for d in missing])
+    for result in created:
+        if result['profile'] in plan:
+            result['ports'] = plan[result['profile']]
+        results[result.pop('profile')] = result
+
+    failed = sorted(name for name, result in results.items() if result['status'] == 'failed')
+    outcome = dict(
+        changed=any(result['changed'] for result in results.values()),
+        profiles=results,
+        workers=workers,
+        duration=round(time.time() - started, 1)
+    )
+    if failed:
+        module.fail_json(msg="Failed to create profiles: {0}".format(', '.join(failed)), **outcome)
+    module.exit_json(msg="Profiles are present", **outcome)
+
+
 def check_accountExistance(module):
     """
     Function that checks to see if specified profile
     exists in current IBM WebSphere cell.
+    Profile names are matched exactly, so Custom01 does not match Custom011.
     """
 
-    check_profile_cmd = "{0}/bin/manageprofiles.sh -listProfiles".format(module.params['path'])
-    profile_check = module.run_command(check_profile_cmd, use_unsafe_shell=True)
+    profiles = existing_profiles(module, module.params['path'], module.params['existence_check'])
 
-    if module.params['profile'] in profile_check[1] and module.params['state'] == 'present':
+    if module.params['profile'] in profiles and module.params['state'] == 'present':
         module.exit_json(
             msg = "Profile {0} already exists in cell".format(module.params['profile']),
         changed=False)
 
-    if module.params['profile'] not in profile_check[1] and module.params['state'] == 'absent':
+    if module.params['profile'] not in profiles and module.params['state'] == 'absent':
         module.exit_json(
             msg = "Profile {0} does not exist in cell ".format(module.params['profile']),
             changed=False
@@ -288,15 +594,27 @@ def main():
                 cell_name=dict(type='str', required=False, defaults=None),
                 dest=dict(type='str', required=False),
                 dmgr_host=dict(type='str', required=False),
+                existence_check=dict(type='str', required=False, default='registry',
+                    choices=['registry', 'manageprofiles']),
                 path=dict(type='str', required=False),
-                profile=dict(type='str', required=True),
-                profile_path=dict(type='str', required=True),
+                jvm_mb=dict(type='int', required=False, default=PMT_JVM_MB),
+                lock_dir=dict(type='path', required=False, default=DEFAULT_LOCK_DIR),
+                max_workers=dict(type='int', required=False),
+                plan_ports=dict(type='bool', required=False, default=False),
+                port_block=dict(type='int', required=False, default=DEFAULT_PORT_BLOCK),
+                ports_dir=dict(type='path', required=False, default=DEFAULT_PORTS_DIR),
+                profile=dict(type='str', required=False),
+                profiles=dict(type='list', required=False),
+                profile_path=dict(type='str', required=False),
                 profile_type=dict(type='str', required=False, choices=['management', 'custom']),
                 security=dict(type='str', required=False, choices=['enabled','disabled'], defaults='enabled'),
                 state=dict(type='str', required=True, choices=['absent', 'augment',
-                    'backup', 'present', 'restore'])
+                    'backup', 'present', 'restore']),
+                starting_port=dict(type='int', required=False, default=DEFAULT_STARTING_PORT),
+                template_slots=dict(type='int', required=False, default=1)
             ),
             supports_check_mode = True,
+            required_one_of=[['profile', 'profiles']],
             required_if=[
                 ["security",True, ["admin_user", "admin_password"],
                 ["security",True, ["profile_type", "management"],
@@ -319,6 +637,8 @@ def main():
     state = module.params['state']
 
 
+    if module.params['profiles'] and state == 'present':
+        make_profiles(module)
     if profile_type == 'management' and state == 'present' and not module.check_mode:
         check_accountExistance(module)  
         make_managerProfile(module)
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.ibm_was_inventory import DEFAULT_FACT_CACHE, DEFAULT_ROOTS, DEFAULT_WORKERS, inventory
+
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'}
+
+DOCUMENTATION = '''
+---
+module: ibm_was_facts
+
+short_description: Module that gathers the WAS installations, profiles and servers of a host as facts.
+
+version_added: "2.3"
+
+description:
+    - Module that walks the known WAS installation roots once and returns what they hold as ansible_facts.
+    - Products and versions come from properties/version/*.product, profiles from properties/profileRegistry.xml,
+    - and the servers and ports of every profile's node from its serverindex.xml. No WAS script or JVM is started.
+    - Roots and profiles are read in parallel.
+    - The live state of every server comes from one scan of /proc, cross-checked with its pid file.
+    - What was read from disk is kept in a fact cache, which is reused for as long as the mtimes of every file
+    - and directory it was read from are unchanged.
+
+options:
+    roots:
+        description:
+            - Installation roots to look at. Roots that do not exist are skipped.
+        required: false
+        default:
+          - /opt/IBM/WebSphere/AppServer
+          - /opt/WebSphere/AppServer
+          - /opt/WebSphere85/AppServer
+          - /opt/WebSphere/AppServer8.5.5
+          - /opt/IBM/ProcessServer
+          - /opt/IBM/HTTPServer
+          - /opt/IBM/WebSphere/Plugins
+    fact_cache:
+        description:
+            - JSON file the gathered installations are cached in.
+        required: false
+        default: ~/.ansible/ibm_was_facts.json
+    use_cache:
+        description:
+            - Whether to use and write the fact cache. When false, everything is read from disk again.
+        required: false
+        default: true
+    processes:
+        description:
+            - Whether to add the live state, pid and stale pid file flag of every server.
+        required: false
+        default: true
+    workers:
+        description:
+            - Number of roots or profiles read at the same time.
+        required: false
+        default: 8
+
+author:
+    - Tom Davison (@tntdavison784)
+'''
+
+EXAMPLES = '''
+- name: Gather WAS facts
+  ibm_was_facts:
+
+- name: Gather WAS facts of one installation, without process state
+  ibm_was_facts:
+    roots:
+      - /opt/IBM/WebSphere/AppServer
+    processes: false
+
+- name: Start the stopped application servers of AppSrv01
+  server:
+    state: start
+    was_root: /opt/IBM/WebSphere/AppServer
+    profile_name: AppSrv01
+    server_name: "{{ item.key }}"
+  with_dict: "{{ ibm_was['/opt/IBM/WebSphere/AppServer'].profiles.AppSrv01.servers }}"
+  when: item.value.type == 'APPLICATION_SERVER' and item.value.state == 'STOPPED'
+'''
+
+RETURN = '''
+ansible_facts:
+    description: >
+        ibm_was, keyed by installation root. Every root has products ({id: {name, version, build_level}}) and
+        profiles ({name: {path, template, default, cell, node, servers}}). servers maps every server of the
+        profile's node to its type, node, ports ({endpoint name: port}), state, pid and stale_pid.
+    returned: always
+    type: dict
+fact_cache:
+    description: The fact cache file, whether it was used and how long gathering took in seconds.
+    returned: always
+    type: dict
+    sample: {"cache": "/root/.ansible/ibm_was_facts.json", "hit": true, "duration": 0.004}
+'''
+
+
+def main():
+
+    module = AnsibleModule(
+        argument_spec=dict(
+            roots=dict(type='list', required=False, default=DEFAULT_ROOTS),
+            fact_cache=dict(type='path', required=False, default=DEFAULT_FACT_CACHE),
+            use_cache=dict(type='bool', required=False, default=True),
+            processes=dict(type='bool', required=False, default=True),
+            workers=dict(type='int', required=False, default=DEFAULT_WORKERS)
+        ),
+        supports_check_mode=True
+    )
+
+    try:
+        installs, info = inventory(module.params['roots'], module.params['fact_cache'], module.params['use_cache'],
+                                   module.params['processes'], module.params['workers'])
+    except (IOError, OSError) as e:
+        module.fail_json(
+            msg="Failed to gather WAS facts: {0}".format(e),
+            changed=False
+        )
+
+    module.exit_json(
+        changed=False,
+        ansible_facts=dict(ibm_was=installs),
+        fact_cache=info
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 #!/usr/bin/python
 import os
 import subprocess
+from ansible.module_utils.ibm_kit_cache import DEFAULT_KIT_CACHE_DIR, DEFAULT_KIT_CACHE_MB, KitError, cached_kit
 
 ANSIBLE_METADATA = {
     'metadata_version': '1.1',
@@ -17,29 +18,47 @@ short_description: Module to install IBM IM
 version_added: 1.0
 
 description:
-	- Module to install IBM IM
-	- Module assumes default installation directory 
-	- Module skips over install if /eclipse/tools/imcl is present
+        - Module to install IBM IM
+        - Module assumes default installation directory 
+        - Module skips over install if /eclipse/tools/imcl is present
 
 options:
 
-	state:
+        state:
 
-		description:
-			- Determines whether or not to install or uninstall IBM IM
-			- present will install
-			- absent will uninstall
+                description:
+                        - Determines whether or not to install or uninstall IBM IM
+                        - present will install
+                        - absent will uninstall
 
-	src:
+        src:
 
-		description:
-			- Local repo of IBM IM installation binaries
+                description:
+                        - Local repo of IBM IM installation binaries
 
-	dest:
+        dest:
 
-		description:
-			- Installation directory for IBM IM
-			- Assumes path of /opt/WebSphere/InstallationManager
+                description:
+                        - Installation directory for IBM IM
+                        - Assumes path of /opt/WebSphere/InstallationManager
+
+        kit:
+
+                description:
+                        - Zip or tar IBM IM kit to install from instead of src
+                        - Extracted once per content hash into kit_cache_dir and reused by later runs
+
+        kit_cache_dir:
+
+                description:
+                        - Directory of the extracted kit cache shared by the installer modules
+                        - Assumes path of ~/.ansible/ibm_kits
+
+        kit_cache_mb:
+
+                description:
+                        - Disk budget of kit_cache_dir in MB, least recently used kits are evicted beyond it
+                        - Assumes 20480
 
 author: Tommy Davison (pwtwd35)
 '''
@@ -70,73 +89,105 @@ EXAMPLES='''
         src: /was855/IM188/
         dest: /opt/WebSphere/InstallationManager/
 -------------------------
+---
+-
+  hosts: dev
+  become: true
+  become_method: sudo
+  become_user: wsadmin
+  tasks:
+    -
+      name: Install IBM IM from a zipped kit
+      ibmim:
+        kit: /was855/agent.installer.linux.gtk.x86_64_1.8.8000.zip
+-------------------------
 ''' 
 
 class IBM_IM_Installer():
 
-	Module = None
-
-
-	def __init__(self):
-		"""Function to init all needed args"""
-		self.module = AnsibleModule(
-			argument_spec = dict(
-				state = dict(required=True, choices=['present', 'absent']),
-				src = dict(required=False),
-				dest = dict(required=False, default='/opt/WebSphere/InstallationManager'),
-			),
-			supports_check_mode = True
-		)
-
-	def check_existence(self):
-		result = os.path.exists(dest+"/eclipse/tools/imcl")
-		if result:
-			self.module.fail_json(
-				msg="IBM IM is already installed",
-				changed=False
-			)
-
-	def main(self):
-		"""Function that will be doing all the work"""
-		state = self.module.params['state']
-		src = self.module.params['src']
-		dest = self.module.params['dest']
-	
-
-		if state == 'present' and os.path.exists(dest+"/eclipse/tools/imcl") == False:
-
-			child = subprocess.Popen(
-				[src + "/userinstc "
-				"-acceptLicense "
-				"-installationDirectory " + dest],
-				shell=True,
-				stdout=subprocess.PIPE,
-				stderr=subprocess.PIPE
-			)
-			stdout_value, stderr_value = child.communicate()
-
-			if child.returncode != 0:
-				self.module.fail_json(
-					msg="IBM IM failed to install",
-					changed=False,
-					stderr=stderr_value,
-					stdout=stdout_value
-				)
-			self.module.exit_json(
-					msg="IBM IM installed successfully",
-					changed=True,
-					stdout=stdout_value,
-					stderr=stderr_value
-			
-			)
-		else:
-			self.module.exit_json(
-				msg="IBM IM is already installed.",
-				changed=False,
-			)
-
-		if state == 'absent':
-			uninstall_dir = "/opt/WebSphere/InstallationManager/uninstall/uninstallc"
+        Module = None
+
+
+        def __init__(self):
+                """Function to init all needed args"""
+                self.module = AnsibleModule(
+                        argument_spec = dict(
+                                state = dict(required=True, choices=['present', 'absent']),
+                                src = dict(required=False),
+                                dest = dict(required=False, default='/opt/WebSphere/InstallationManager'),
+                                kit = dict(required=False, type='path'),
+                                kit_cache_dir = dict(required=False, type='path', default=DEFAULT_KIT_CACHE_DIR),
+                                kit_cache_mb = dict(required=False, type='int', default=DEFAULT_KIT_CACHE_MB),
+                        ),
+                        supports_check_mode = True
+                )
+
+        def check_existence(self):
+                result = os.path.exists(dest+"/eclipse/tools/imcl")
+                if result:
+                        self.module.fail_json(
+                                msg="IBM IM is already installed",
+                                changed=False
+                        )
+
+        def kit_src(self):
+                """Function that returns the extracted kit directory from the shared kit cache"""
+                try:
+                        return cached_kit(self.module.params['kit'], self.module.params['kit_cache_dir'],
+                                self.module.params['kit_cache_mb'])
+                except (KitError, IOError, OSError) as e:
+                        self.module.fail_json(
+                                msg="Failed to extract kit %s: %s" % (self.module.params['kit'], e),
+                                changed=False
+                        )
+
+        def main(self):
+                """Function that will be doing all the work"""
+                state = self.module.params['state']
+                src = self.module.params['src']
+                dest = self.module.params['dest']
+        
+
+                if state == 'present' and os.path.exists(dest+"/eclipse/tools/imcl") == False:
+
+                        kit = None
+                        if self.module.params['kit'] is not None:
+                                src, kit = self.kit_src()
+
+                        child = subprocess.Popen(
+                                [src + "/userinstc "
+                                "-acceptLicense "
+                                "-installationDirectory " + dest],
+                                shell=True,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE
+                        )
+                        stdout_value, stderr_value = child.communicate()
+
+                        if child.returncode != 0:
+                                self.module.fail_json(
+                                        msg="IBM IM failed to install",
+                                        changed=False,
+                                        stderr=stderr_value,
+                                        stdout=stdout_value,
+                                        kit=kit
+                                )
+                        self.module.exit_json(
+                                        msg="IBM IM installed successfully",
+                                        changed=True,
+                                        stdout=stdout_value,
+                                        stderr=stderr_value,
+                                        kit=kit
+                        
+                        )
+                else:
+                        self.module.exit_json(
+                                msg="IBM IM is already installed.",
+                                changed=False,
+                        )
+
+                if state == 'absent':
+                        uninstall_dir = "/opt/WebSphere/InstallationManager/uninstall/uninstallc"
                         child = subprocess.Popen(
                                 [uninstall_dir],
                                 shell=True,
@@ -164,5 +215,5 @@ class IBM_IM_Installer():
 from ansible.module_utils.basic import *
 
 if __name__ == "__main__":
-	im = IBM_IM_Installer()
-	im.main()
+        im = IBM_IM_Installer()
+        im.main()
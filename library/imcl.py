@@ -4,6 +4,8 @@ import subprocess as sp
 import os
 import datetime
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.ibm_im_agent import agent_data_location, installed_inventory, package_installed
+from ansible.module_utils.ibm_im_lock import DEFAULT_QUEUE_DIR, queued_run
 import xml.etree.ElementTree as ET
 
 
@@ -62,6 +64,23 @@ options:
         - Only requried when response_loc is not specified
         - Choices: absent, present, update
 
+    agent_data:
+        description:
+          - Type: string
+          - Required: False
+          - Path to the IBM IM agent data directory (appDataLocation)
+          - Defaults to cic.appDataLocation from the IM config.ini next to imcl_path
+          - Package presence is read from the agent data without starting imcl,
+          - imcl listInstalledPackages is only used when the format is not recognized
+
+    queue_dir:
+        description:
+          - Type: string
+          - Required: False
+          - Host-local queue shared with ibm_imcl. imcl runs against the same agent data
+          - wait their turn here instead of failing on the IM lock
+          - Default: /tmp/ibm_imcl_queue
+
 '''
 
 EXAMPLE='''
@@ -89,6 +108,30 @@ EXAMPLE='''
 '''
 
 
+def queued_imcl(module, cmd):
+    """Function that runs an imcl command line through the host-local IM queue.
+    The queue is shared with ibm_imcl, so concurrent tasks on one host run imcl
+    one at a time instead of failing on the IM lock.
+    Returns returncode, stdout, stderr and the queue wait/run times.
+    """
+
+    def run(merged):
+        child = sp.Popen(
+            [cmd],
+            shell=True,
+            stdout = sp.PIPE,
+            stderr = sp.PIPE
+        )
+        stdout_value, stderr_value = child.communicate()
+        return child.returncode, stdout_value, stderr_value
+
+    agent_data = module.params['agent_data']
+    if agent_data is None:
+        agent_data = agent_data_location(module.params['imcl_path'])
+
+    return queued_run(run, agent_data, queue_dir=module.params['queue_dir'])
+
+
 def imcl_run():
     module_args = dict(
         response_loc=dict(type='str', required=False),
@@ -97,12 +140,15 @@ def imcl_run():
         src=dict(required=False),
         dest=dict(required=False),
         package=dict(required=False),
-        imcl_path=dict(type='str', required=True)
+        imcl_path=dict(type='str', required=True),
+        agent_data=dict(type='path', required=False),
+        queue_dir=dict(type='path', required=False, default=DEFAULT_QUEUE_DIR)
     )
     
 
     module = AnsibleModule(
-        argument_spec=module_args
+        argument_spec=module_args,
+        supports_check_mode=True
     )
 
     response_loc = module.params['response_loc']
@@ -112,6 +158,7 @@ def imcl_run():
     dest = module.params['dest']
     package = module.params['package']
     imcl_path = module.params['imcl_path']
+    agent_data = module.params['agent_data']
 
     date = datetime.datetime.now()
     date_format = date.strftime("%Y%M%D%H%M")
@@ -133,135 +180,128 @@ def imcl_run():
         for inst_loc in rsp_file_root.getiterator('profile'):
             loc = inst_loc.attrib
             if os.path.exists(loc['installLocation']) == False:
-                child = sp.Popen(
-                    [
-                        imcl_path + ' -acceptLicense ' +
-                        '-log /tmp/WAS_ND_Install-'+date_format+'.log ' +
-                        '-input ' + response_loc
-                    ],
-                    shell=True,
-                    stdout = sp.PIPE,
-                    stderr = sp.PIPE
+                if module.check_mode:
+                    module.exit_json(
+                        msg='WAS ND will be installed.',
+                        changed=True
+                    )
+                returncode, stdout_value, stderr_value, queue = queued_imcl(
+                    module,
+                    imcl_path + ' -acceptLicense ' +
+                    '-log /tmp/WAS_ND_Install-'+date_format+'.log ' +
+                    '-input ' + response_loc
                 )
-                stdout_value, stderr_value = child.communicate()
-                if child.returncode != 0:
+                if returncode != 0:
                     module.fail_json(
                         msg='Failed to install WAS. For more details check log in /tmp/',
                         changed=False,
+                        queue=queue,
                         stderr=stderr_value,
                         stdout=stdout_value
                     )
                 module.exit_json(
                     msg='Succesfully installed WAS ND.',
-                    changed=True
+                    changed=True,
+                    queue=queue
                 )
 
-    if state == 'present' and os.path.exists(dest+'/bin/versionInfo.sh') == False:
-        child = sp.Popen(
-            [
-                imcl_path + ' -acceptLicense ' +
-                '-log /tmp/WAS_ND_Install-'+date_format+'.log ' +
-                '-repositories ' + src + ' -installationDirectory ' +
-                dest + ' install ' + package +
-                ' -sharedResourcesDirectory /opt/WebSphere/IMShared'
-            ],
-            shell=True,
-            stdout = sp.PIPE,
-            stderr = sp.PIPE
+    if state is not None:
+        packages, source = installed_inventory(module, imcl_path, agent_data=agent_data,
+                                               offline=module.check_mode)
+        installed = package_installed(package, packages)
+
+    if module.check_mode and state is not None:
+        if state in ['present', 'update'] and not installed:
+            module.exit_json(
+                msg='Package ' + package + ' will be installed.',
+                changed=True
+            )
+        if state == 'absent' and installed:
+            module.exit_json(
+                msg='Package ' + package + ' will be uninstalled from cell.',
+                changed=True
+            )
+        module.exit_json(
+            msg='Package ' + package + ' is already in ' + state + ' state.',
+            changed=False
         )
-        stdout_value, stderr_value = child.communicate()
-        if child.returncode != 0:
+
+    if state == 'present' and not installed:
+        returncode, stdout_value, stderr_value, queue = queued_imcl(
+            module,
+            imcl_path + ' -acceptLicense ' +
+            '-log /tmp/WAS_ND_Install-'+date_format+'.log ' +
+            '-repositories ' + src + ' -installationDirectory ' +
+            dest + ' install ' + package +
+            ' -sharedResourcesDirectory /opt/WebSphere/IMShared'
+        )
+        if returncode != 0:
             module.fail_json(
                 msg='Failed to install WAS. For more details see log in /tmp/',
                 changed=False,
+                queue=queue,
                 stderr = stderr_value,
                 stdout = stdout_value
             )
         module.exit_json(
             msg='Succesfully installed package ' + package,
-            changed=True
+            changed=True,
+            queue=queue
         )
-    elif state == 'present' and os.path.exists(dest+'/bin/versionInfo.sh'):
+    elif state == 'present' and installed:
         module.exit_json(
-            msg='WAS ND is already installed',
+            msg='Package ' + package + ' is already installed.',
             changed=False
         )
         
     if state == 'update':
-        child = sp.Popen(
-            [
-                imcl_path + ' listInstalledPackages'
-            ],
-            shell=True,
-            stdout = sp.PIPE,
-            stderr = sp.PIPE
-        )
-        stdout_value, stderr_value = child.communicate()
-        packages = stdout_value.splitlines()
-        if package in packages:
+        if installed:
             module.exit_json(
                 msg='Package ' + package + ' is already installed.',
                 changed=False
             )
-        if package not in packages:
-            child = sp.Popen(
-                [
-                    imcl_path + ' -acceptLicense ' +
-                    '-log /tmp/WAS_ND_Update-'+date_format+'.log ' +
-                    '-sharedResourcesDirectory /opt/WebSphere/IMShared ' +
-                    '-repositories ' + src + ' install ' + package
-                ],
-                shell=True,
-                stdout = sp.PIPE,
-                stderr = sp.PIPE
+        if not installed:
+            returncode, stdout_value, stderr_value, queue = queued_imcl(
+                module,
+                imcl_path + ' -acceptLicense ' +
+                '-log /tmp/WAS_ND_Update-'+date_format+'.log ' +
+                '-sharedResourcesDirectory /opt/WebSphere/IMShared ' +
+                '-repositories ' + src + ' install ' + package
             )
-            stdout_value, stderr_value = child.communicate()
-            if child.returncode != 0:
+            if returncode != 0:
                 module.fail_json(
                     msg='Failed to update package ' + package + ' into cell.',
                     changed=False,
+                    queue=queue,
                     stderr = stderr_value,
                     stdout = stdout_value
                 )
             module.exit_json(
                 msg='Succesfully updated package ' + package + ' into cell',
-                changed=True
+                changed=True,
+                queue=queue
             )
 
     if state == 'absent':
-        child = sp.Popen(
-            [
-                imcl_path + ' listInstalledPackages'
-            ],
-            shell=True,
-            stdout = sp.PIPE,
-            stderr = sp.PIPE
-        )
-        stdout_value, stderr_value = child.communicate()
-        packages = stdout_value.splitlines()
-
-        if package in packages:
-            child = sp.Popen(
-                [
-                    imcl_path + ' uninstall ' + package
-                ],
-                shell=True,
-                stdout = sp.PIPE,
-                stderr = sp.PIPE
+        if installed:
+            returncode, stdout_value, stderr_value, queue = queued_imcl(
+                module,
+                imcl_path + ' uninstall ' + package
             )
-            stdout_value, stderr_value = child.communicate()
-            if child.returncode != 0:
+            if returncode != 0:
                 module.fail_json(
                     msg='Failed to uninstall package ' + package + ' from cell.',
                     changed=False,
+                    queue=queue,
                     stderr = stderr_value,
                     stdout = stdout_value
                 )
             module.exit_json(
                 msg='Succesfully uninstalled package ' + package + ' from cell.',
-                changed=True
+                changed=True,
+                queue=queue
             )
-        if package not in packages:
+        if not installed:
             module.exit_json(
                 msg='Package ' + package + ' is not installed in this cell.',
                 changed=False
@@ -1,132 +1,512 @@
-#!/usr/bin/python
-
-
-from ansible.module_utils.basic import AnsibleModule
-DOCUMENTAION='''
-Class that mocks the real IBM IMCL CLI tool
-This class will create two files:
-    1. repository.config
-    2. internal.config
-The repository.config file is the file that we would normally point to to install IBM products.
-This file will have a entries that are the products install names. Ie. com.ibm.websphere.ND.v90_9.0.9.20180906_1004
-The internal.config is where the installed products will end up, so that we can query if they exist or not.
-
-author: Tom Davison @tntdavison784
-'''
-
-
-def get_home():
-    """Function that gets users home dir and returns value"""
-    import os
-    home = os.path.expanduser("~")
-    return home
-
-
-def check_files():
-    """Function that checks for two files:
-    1. repositroy.config
-    2. internal.config
-    if these files do not exist, it will create them.
-    Base file creation goes to users home folder: /home/user/.internal.config
-    """
-
-    import os
-
-    try:
-        home = get_home()
-        files = ['.repository.config', '.internal.config']
-        for file in files:
-            if os.path.exists(home+"/"+file):
-                print("Repository files already exist.")
-                break
-            else:
-                with open(home+"/"+file, "w+") as f_obj:
-                    f_obj.close()
-        return home
-    except IOError:
-        print("Permission denied, cannot create file in %s directory.") % home
-
-
-def install_pckg(dest, name):
-    """Function that will do a mock install of a package.
-    This will first query the internal.config to see if anything exists.
-    It will place all packages into an array to be compared to packages to be installed.
-    This function will also be used for testing updates as logic is same.
-    """
-
-    usrhome = get_home()
-
-    src = usrhome+"/.repository.config"
-
-    with open(src, 'r') as f_obj:
-        packages = f_obj.readlines()
-        f_obj.close()
-        for package in packages:
-            if name in package:
-                with open(usrhome + "/.internal.config", "r") as f_obj:
-                    inst_packages = f_obj.readlines()
-                    f_obj.close()
-                    if len(inst_packages) == 0:
-                        with open(usrhome + "/.internal.config", "w") as f:
-                            new_pckg = name
-                            f.writelines(new_pckg)
-                            f.close()
-                            print("Package " + name + " was successfully installed to " + dest + ".")
-                    else:
-                        for inst_package in inst_packages:
-                            if name in inst_package:
-                                print("Package " + name +" is already installed.")
-                                break
-            else:
-                print("Package: " + name + " not found. Check .repository config to ensure correct spelling.")
-                break
-
-
-def remove_pckg(dest, name):
-    """Function that will remove package or packages from the .internal.config"""
-
-    usrhome = get_home()
-
-    src = usrhome+"/.internal.config"
-
-    with open(src, "r") as f_obj:
-        inst_packages = f_obj.readlines()
-        f_obj.close()
-        for inst_pckg in inst_packages:
-            if name in inst_pckg:
-                inst_packages.remove(inst_pckg)
-                with open(src, "w") as f:
-                    f.writelines(inst_packages)
-                    f.close()
-                print("Package " + name + " has been removed from " + dest)
-            else:
-                print("Package: " + name + " is not installed. Nothing to remove.")
-
-
-#remove_pckg("/opt/WebSphere/AppServer", "com.ibm.websphere.ND.v90_9.0.9.20180906_1004")
-#install_pckg("/opt/WebSphere/AppServer", "com.ibm.websphere.ND.v90_9.0.9.20180906_1004")
-
-
-from ibm_imcl import install_package
-
-def imcl_pckg_inst():
-
-#    create_files = check_files()
-    module = AnsibleModule(
-        argument_spec=dict(
-            state=dict(type='str', required=True, choices=['present', 'absent', 'update', 'rollback']),
-            src=dict(type='str', required=True),
-            dest=dict(type='str', required=False),
-            path=dict(type='str', required=True),
-            name=dict(type='str', required=False),
-            shared_resource=dict(type='str', required=False)
-        ))
-    dest = "/opt/WebSphere/AppServer"
-    name = "com.ibm.websphere.ND.v90_9.0.9.20180906_1004"
-   # path = install_pckg(dest, name)
-    usrhome = get_home()
-    src = usrhome+"/.repository.config"
-    shared_resource = "/home/TEST"
-    install_package(module,install_pckg(dest, name),src,shared_resource,dest,name)
-
-imcl_pckg_inst()
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+DOCUMENTATION = '''
+Fake IBM imcl CLI tool, to exercise ibm_imcl, imcl.py and friends end to end without IBM binaries.
+
+Copy or symlink this file to <root>/eclipse/tools/imcl and point the modules at it:
+    path: <root>/eclipse/tools/imcl          (ibm_imcl)
+    imcl_path: <root>/eclipse/tools/imcl     (imcl.py)
+
+Supported commands:
+    install, uninstall, uninstallAll, updateAll, rollback, modify, listInstalledPackages,
+    listAvailablePackages, version, plus generateRepository <dir> <count> to create a
+    repository with <count> offerings for benchmarks.
+
+State lives in an indexed sqlite store (fake_imcl.db) in the agent data directory, which is
+FAKE_IMCL_DATA, else cic.appDataLocation of <root>/eclipse/configuration/config.ini, else the
+IM default. Every change rewrites installRegistry.xml there, like IM does, so the modules'
+agent data readers see it. Repositories are indexed from repository.xml, Offerings/*.jar and
+<id>_<version> lines of repository.config once per change of their metadata.
+
+Behaviour is tuned with environment variables (or the same keys in fake_imcl.json in the agent data):
+    FAKE_IMCL_LATENCY   seconds a command takes, e.g. "install=3,uninstall=1,*=0.1"
+    FAKE_IMCL_FAIL      failures to inject, per command a probability or an offering id,
+                        e.g. "install=0.2,uninstall=com.ibm.websphere.IHS.v85"
+    FAKE_IMCL_LOCK      0 to disable the agent data lock. By default a second imcl changing
+                        the same agent data fails with IM's "Another instance" error.
+
+author: Tom Davison @tntdavison784
+'''
+
+import fcntl
+import json
+import os
+import random
+import re
+import sqlite3
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+
+STORE = 'fake_imcl.db'
+SETTINGS = 'fake_imcl.json'
+LOCK_FILE = '.fake_imcl.lock'
+PROGRESS_WIDTH = 50
+FLAGS = ['-acceptLicense', '-showProgress', '-showVerboseProgress', '-long', '-features', '-silent',
+         '-stopBlockingProcesses', '-verbose']
+MUTATING = ['install', 'uninstall', 'uninstallAll', 'updateAll', 'rollback', 'modify']
+OFFERING_JAR = re.compile(r'^([^_]+)_(.+)\.jar$')
+PACKAGE = re.compile(r'^([A-Za-z][\w.-]*?)_(\d[\w.-]*)$')
+
+
+class ImclError(Exception):
+    """Raised with the message and exit code imcl reports on failure."""
+
+    def __init__(self, message, rc=1):
+        Exception.__init__(self, message)
+        self.rc = rc
+
+
+def agent_data():
+    """Function that locates the agent data the same way IM does for this imcl."""
+
+    if os.environ.get('FAKE_IMCL_DATA'):
+        return os.path.expanduser(os.environ['FAKE_IMCL_DATA'])
+
+    eclipse = os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0])))
+    try:
+        with open(os.path.join(eclipse, 'configuration', 'config.ini'), 'r') as f_obj:
+            for line in f_obj:
+                key, sep, value = line.partition('=')
+                if sep and key.strip() == 'cic.appDataLocation':
+                    value = value.strip().replace('\\:', ':').replace('@osgi.install.area', eclipse)
+                    return os.path.normpath(os.path.expanduser(value))
+    except (IOError, OSError):
+        pass
+
+    if os.geteuid() == 0:
+        return '/var/ibm/InstallationManager'
+    return os.path.expanduser('~/var/ibm/InstallationManager')
+
+
+def parse_args(argv):
+    """Function that splits an imcl command line into (command, packages, options)."""
+
+    command = None
+    packages = []
+    options = {}
+    args = list(argv)
+    while args:
+        arg = args.pop(0)
+        if arg in FLAGS:
+            options[arg[1:]] = True
+        elif arg.startswith('-'):
+            options[arg[1:]] = args.pop(0) if args else ''
+        elif command is None:
+            command = arg
+        else:
+            packages.append(arg)
+    return command, packages, options
+
+
+def load_settings(data):
+    """Function that reads latency, failure and lock settings, environment first."""
+
+    try:
+        with open(os.path.join(data, SETTINGS), 'r') as f_obj:
+            settings = json.load(f_obj)
+    except (IOError, OSError, ValueError):
+        settings = {}
+
+    for key in ['latency', 'fail']:
+        value = os.environ.get('FAKE_IMCL_' + key.upper())
+        if value is not None:
+            settings[key] = dict(item.split('=', 1) for item in value.split(',') if '=' in item)
+    if os.environ.get('FAKE_IMCL_LOCK') is not None:
+        settings['lock'] = os.environ['FAKE_IMCL_LOCK'] not in ['0', 'false', 'no']
+    settings.setdefault('latency', {})
+    settings.setdefault('fail', {})
+    settings.setdefault('lock', True)
+    return settings
+
+
+def version_key(version):
+    return [(0, int(part)) if part.isdigit() else (1, part) for part in re.split(r'[._-]', version)]
+
+
+class Store(object):
+    """Indexed on-disk state of the fake IM: repositories, installed offerings and their history."""
+
+    def __init__(self, data):
+        if not os.path.isdir(data):
+            try:
+                os.makedirs(data)
+            except OSError:
+                if not os.path.isdir(data):
+                    raise
+        self.data = data
+        self.db = sqlite3.connect(os.path.join(data, STORE), timeout=60)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS repositories (path TEXT PRIMARY KEY, digest TEXT);
+            CREATE TABLE IF NOT EXISTS available (
+                repository TEXT, id TEXT, version TEXT, features TEXT, size INTEGER,
+                PRIMARY KEY (repository, id, version));
+            CREATE INDEX IF NOT EXISTS available_id ON available (id);
+            CREATE TABLE IF NOT EXISTS installed (
+                id TEXT PRIMARY KEY, version TEXT, location TEXT, features TEXT, installed REAL);
+            CREATE TABLE IF NOT EXISTS history (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT, version TEXT, location TEXT, features TEXT);
+            CREATE INDEX IF NOT EXISTS history_id ON history (id);
+        ''')
+
+    def index_repository(self, repository):
+        """Function that (re)indexes a directory repository when its metadata changed."""
+
+        repository = os.path.abspath(os.path.expanduser(repository))
+        if not os.path.isfile(os.path.join(repository, 'repository.config')):
+            raise ImclError("ERROR: CRIMA1052E Repository {0} could not be found or is not a repository.".format(
+                repository))
+
+        stamps = []
+        for name in ['repository.config', 'repository.xml', 'Offerings']:
+            try:
+                stat = os.stat(os.path.join(repository, name))
+                stamps.append('{0}:{1}:{2}'.format(name, stat.st_mtime, stat.st_size))
+            except OSError:
+                pass
+        digest = ';'.join(stamps)
+        known = self.db.execute('SELECT digest FROM repositories WHERE path = ?', (repository,)).fetchone()
+        if known and known[0] == digest:
+            return repository
+
+        found = {}
+        with open(os.path.join(repository, 'repository.config'), 'r') as f_obj:
+            for line in f_obj:
+                match = PACKAGE.match(line.strip())
+                if match:
+                    found[match.groups()] = ('', None)
+        try:
+            for element in ET.parse(os.path.join(repository, 'repository.xml')).getroot().iter():
+                if element.tag.split('}')[-1] == 'offering' and element.get('id') and element.get('version'):
+                    size = element.get('size')
+                    found[(element.get('id'), element.get('version'))] = (
+                        element.get('features') or '', int(size) if size and size.isdigit() else None)
+        except (ET.ParseError, IOError, OSError):
+            pass
+        try:
+            for jar in os.listdir(os.path.join(repository, 'Offerings')):
+                match = OFFERING_JAR.match(jar)
+                if match and match.groups() not in found:
+                    found[match.groups()] = ('', None)
+        except OSError:
+            pass
+
+        with self.db:
+            self.db.execute('DELETE FROM available WHERE repository = ?', (repository,))
+            self.db.executemany('INSERT INTO available VALUES (?, ?, ?, ?, ?)',
+                                [(repository, i, v, f, s) for (i, v), (f, s) in found.items()])
+            self.db.execute('INSERT OR REPLACE INTO repositories VALUES (?, ?)', (repository, digest))
+        return repository
+
+    def available(self, repositories, offering_id=None):
+        """Function that returns [(repository, id, version, features)] of the repositories, oldest first."""
+
+        if not repositories:
+            return []
+        query = 'SELECT repository, id, version, features FROM available WHERE repository IN ({0})'.format(
+            ','.join('?' * len(repositories)))
+        args = list(repositories)
+        if offering_id is not None:
+            query += ' AND id = ?'
+            args.append(offering_id)
+        return sorted(self.db.execute(query, args).fetchall(), key=lambda row: (row[1], version_key(row[2])))
+
+    def installed(self, offering_id=None):
+        if offering_id is not None:
+            return self.db.execute('SELECT id, version, location, features FROM installed WHERE id = ?',
+                                   (offering_id,)).fetchone()
+        return self.db.execute('SELECT id, version, location, features FROM installed ORDER BY id').fetchall()
+
+    def write_registry(self):
+        """Function that rewrites installRegistry.xml from the store, one profile per location."""
+
+        root = ET.Element('installRegistry')
+        profiles = {}
+        for offering_id, version, location, features in self.installed():
+            profile = profiles.get(location)
+            if profile is None:
+                profile = profiles[location] = ET.SubElement(
+                    root, 'profile', id='Fake IM profile {0}'.format(len(profiles) + 1), kind='product')
+                ET.SubElement(profile, 'property', name='installLocation', value=location)
+            ET.SubElement(profile, 'offering', id=offering_id, version=version, profile=profile.get('id'),
+                          features=features)
+
+        registry = os.path.join(self.data, 'installRegistry.xml')
+        tmp_file = '{0}.{1}'.format(registry, os.getpid())
+        ET.ElementTree(root).write(tmp_file)
+        os.rename(tmp_file, registry)
+
+
+def split_package(package):
+    """Function that splits <id>[_<version>][,<feature>...] into (id, version, features)."""
+
+    parts = package.split(',')
+    match = PACKAGE.match(parts[0])
+    if match:
+        return match.group(1), match.group(2), parts[1:]
+    return parts[0], None, parts[1:]
+
+
+def repositories(store, options):
+    paths = [path for path in options.get('repositories', '').split(',') if path]
+    return [store.index_repository(path) for path in paths]
+
+
+def install(store, packages, options):
+    repos = repositories(store, options)
+    if not repos:
+        raise ImclError("ERROR: CRIMA1029E No repositories are specified for the install command.")
+
+    changes = []
+    for package in packages:
+        offering_id, version, features = split_package(package)
+        available = store.available(repos, offering_id)
+        if version is not None:
+            available = [row for row in available if row[2] == version]
+        if not available:
+            raise ImclError("ERROR: CRIMA1070E Package {0} is not found in the repositories {1}.".format(
+                package, ','.join(repos)))
+        repository, offering_id, version, default_features = available[-1]
+        changes.append((offering_id, version, features or [f for f in default_features.split(',') if f]))
+
+    messages = []
+    with store.db:
+        for offering_id, version, features in changes:
+            current = store.installed(offering_id)
+            location = options.get('installationDirectory') or (current[2] if current else None)
+            if location is None:
+                raise ImclError("ERROR: CRIMA1085E -installationDirectory is required to install {0}.".format(
+                    offering_id))
+            if current and current[1] == version:
+                messages.append("{0}_{1} is already installed in {2}.".format(offering_id, version, current[2]))
+                continue
+            if current:
+                store.db.execute('INSERT INTO history (id, version, location, features) VALUES (?, ?, ?, ?)',
+                                 current)
+            store.db.execute('INSERT OR REPLACE INTO installed VALUES (?, ?, ?, ?, ?)',
+                             (offering_id, version, location, ','.join(features), time.time()))
+            messages.append("{0} package {1}_{2} to the installation directory {3}.".format(
+                'Updated' if current else 'Installed', offering_id, version, location))
+    return messages
+
+
+def update_all(store, packages, options):
+    repos = repositories(store, options)
+    latest = {}
+    for repository, offering_id, version, features in store.available(repos):
+        latest[offering_id] = version
+    updates = ['{0}_{1}'.format(row[0], latest[row[0]]) for row in store.installed()
+               if row[0] in latest and version_key(latest[row[0]]) > version_key(row[1])]
+    if not updates:
+        return ["No updates found for the installed packages."]
+    return install(store, updates, options)
+
+
+def uninstall(store, packages, options):
+    messages = []
+    with store.db:
+        for package in packages:
+            offering_id, version, features = split_package(package)
+            current = store.installed(offering_id)
+            if current is None or (version is not None and current[1] != version):
+                raise ImclError("ERROR: CRIMA1076E Package {0} is not installed.".format(package))
+            store.db.execute('DELETE FROM installed WHERE id = ?', (offering_id,))
+            store.db.execute('DELETE FROM history WHERE id = ?', (offering_id,))
+            messages.append("Uninstalled package {0}_{1} from the installation directory {2}.".format(
+                offering_id, current[1], current[2]))
+    return messages
+
+
+def uninstall_all(store, packages, options):
+    return uninstall(store, [row[0] for row in store.installed()], options)
+
+
+def rollback(store, packages, options):
+    """Function that rolls offerings back to the given, or else the previous, version."""
+
+    messages = []
+    with store.db:
+        for package in packages:
+            offering_id, version, features = split_package(package)
+            current = store.installed(offering_id)
+            if current is None:
+                raise ImclError("ERROR: CRIMA1076E Package {0} is not installed.".format(package))
+            query = 'SELECT seq, id, version, location, features FROM history WHERE id = ?'
+            args = [offering_id]
+            if version is not None and version != current[1]:
+                query += ' AND version = ?'
+                args.append(version)
+            previous = store.db.execute(query + ' ORDER BY seq DESC LIMIT 1', args).fetchone()
+            if previous is None:
+                raise ImclError("ERROR: CRIMA1217E No previous version of {0} to roll back to.".format(package))
+            store.db.execute('DELETE FROM history WHERE id = ? AND seq >= ?', (offering_id, previous[0]))
+            store.db.execute('INSERT OR REPLACE INTO installed VALUES (?, ?, ?, ?, ?)',
+                             tuple(previous[1:]) + (time.time(),))
+            messages.append("Rolled back package {0} from {1} to {2}.".format(offering_id, current[1], previous[2]))
+    return messages
+
+
+def modify(store, packages, options):
+    add = [f for f in options.get('addFeatures', '').split(',') if f]
+    remove = [f for f in options.get('removeFeatures', '').split(',') if f]
+    messages = []
+    with store.db:
+        for package in packages:
+            offering_id, version, features = split_package(package)
+            current = store.installed(offering_id)
+            if current is None:
+                raise ImclError("ERROR: CRIMA1076E Package {0} is not installed.".format(package))
+            features = [f for f in current[3].split(',') if f and f not in remove]
+            features.extend(f for f in add if f not in features)
+            store.db.execute('UPDATE installed SET features = ? WHERE id = ?', (','.join(features), offering_id))
+            messages.append("Modified package {0}_{1}.".format(offering_id, current[1]))
+    return messages
+
+
+def list_installed(store, packages, options):
+    lines = []
+    for offering_id, version, location, features in store.installed():
+        if options.get('long'):
+            fields = [location, '{0}_{1}'.format(offering_id, version), offering_id, version]
+            if options.get('features'):
+                fields.append(features)
+            lines.append(' : '.join(fields))
+        else:
+            lines.append('{0}_{1}'.format(offering_id, version))
+    return lines
+
+
+def list_available(store, packages, options):
+    lines = []
+    for repository, offering_id, version, features in store.available(repositories(store, options)):
+        if options.get('long'):
+            lines.append(' : '.join([repository, '{0}_{1}'.format(offering_id, version), offering_id, version]))
+        else:
+            lines.append('{0}_{1}'.format(offering_id, version))
+    return lines
+
+
+def generate_repository(store, packages, options):
+    """Function that writes a repository of packages[1] offerings, three versions each, into packages[0]."""
+
+    if len(packages) != 2 or not packages[1].isdigit():
+        raise ImclError("Usage: imcl generateRepository <directory> <offering count>")
+    directory, count = packages[0], int(packages[1])
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    root = ET.Element('repository')
+    for number in range(count):
+        for fixpack in range(3):
+            ET.SubElement(root, 'offering', id='com.example.offering{0}.v85'.format(number),
+                          version='8.5.{0}.20180101_0000'.format(5000 + fixpack), size=str(1024 * 1024),
+                          features='core.feature')
+    ET.ElementTree(root).write(os.path.join(directory, 'repository.xml'))
+    with open(os.path.join(directory, 'repository.config'), 'w') as f_obj:
+        f_obj.write('LayoutPolicy=Composite\nLayoutPolicyVersion=0.0.0.1\n')
+    return ["Generated {0} offerings in {1}.".format(count * 3, directory)]
+
+
+def version(store, packages, options):
+    return ["Installation Manager (install)", "Version: 1.8.5 (fake)", "Internal Version: 1.8.5000.fake"]
+
+
+COMMANDS = {
+    'install': install,
+    'updateAll': update_all,
+    'uninstall': uninstall,
+    'uninstallAll': uninstall_all,
+    'rollback': rollback,
+    'modify': modify,
+    'listInstalledPackages': list_installed,
+    'listAvailablePackages': list_available,
+    'generateRepository': generate_repository,
+    'version': version,
+}
+
+
+def inject(settings, command, packages, options):
+    """Function that sleeps the configured latency and raises the configured failures."""
+
+    latency = float(settings['latency'].get(command, settings['latency'].get('*', 0)))
+    if options.get('showProgress') or options.get('showVerboseProgress'):
+        sys.stdout.write('{0}\n{1}\n'.format('0%'.ljust(PROGRESS_WIDTH - 4) + '100%', '-' * PROGRESS_WIDTH))
+        for step in range(PROGRESS_WIDTH):
+            time.sleep(latency / PROGRESS_WIDTH)
+            sys.stdout.write('.')
+            sys.stdout.flush()
+        sys.stdout.write('\n')
+    elif latency:
+        time.sleep(latency)
+
+    failure = settings['fail'].get(command, settings['fail'].get('*'))
+    if failure is None:
+        return
+    try:
+        failed = random.random() < float(failure)
+    except ValueError:
+        failed = [p for p in packages if split_package(p)[0] == failure or p == failure] != []
+    if failed:
+        raise ImclError("ERROR: CRIMA1217E A problem occurred during the execution of the {0} command "
+                        "(injected failure).".format(command))
+
+
+def log(options, lines):
+    if options.get('log'):
+        try:
+            with open(options['log'], 'a') as f_obj:
+                f_obj.write('\n'.join(lines) + '\n')
+        except (IOError, OSError):
+            pass
+
+
+def main(argv):
+    command, packages, options = parse_args(argv)
+    if command is None and options.get('input'):
+        command = 'install'
+        response = ET.parse(options['input']).getroot()
+        options.setdefault('repositories', ','.join(r.get('location') for r in response.iter('repository')))
+        for profile in response.iter('profile'):
+            options.setdefault('installationDirectory', profile.get('installLocation'))
+        packages = ['{0}_{1}'.format(o.get('id'), o.get('version')) if o.get('version') else o.get('id')
+                    for o in response.iter('offering')]
+    if command not in COMMANDS:
+        sys.stderr.write("ERROR: CRIMA1000E Unknown command {0}. Commands: {1}\n".format(
+            command, ', '.join(sorted(COMMANDS))))
+        return 2
+
+    data = agent_data()
+    settings = load_settings(data)
+    store = Store(data)
+    lock = None
+    try:
+        if command in MUTATING and settings['lock']:
+            lock = open(os.path.join(data, LOCK_FILE), 'a')
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                raise ImclError("ERROR: Another instance of IBM Installation Manager is already running "
+                                "against {0}.".format(data))
+
+        inject(settings, command, packages, options)
+        lines = COMMANDS[command](store, packages, options)
+        if command in MUTATING:
+            store.write_registry()
+    except ImclError as e:
+        log(options, [str(e)])
+        sys.stdout.write(str(e) + '\n')
+        sys.stderr.write(str(e) + '\n')
+        return e.rc
+    finally:
+        if lock is not None:
+            lock.close()
+        store.db.close()
+
+    log(options, lines)
+    sys.stdout.write('\n'.join(lines) + '\n' if lines else '')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,6 +1,108 @@
 #!/usr/bin/python
 import subprocess as sp
+import time
+from multiprocessing.pool import ThreadPool
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.ibm_was_server import DEFAULT_JVM_MB, worker_limit
+from ansible.module_utils.ibm_was_proc import process_table
+
+
+DOCUMENTATION='''
+---
+module: new_server.py
+
+short_description: Module that starts or stops several IBM Application servers of a profile at once
+
+description:
+    - "Runs startServer.sh/stopServer.sh for every server in server_name in a bounded worker pool,"
+    - "so starting 12 servers takes about as long as the slowest one instead of the sum."
+    - "Servers already in the requested state are skipped."
+
+options:
+    profile_name:
+        description:
+            - The profile name the Application servers belong to.
+            - Required: True
+
+    server_name:
+        description:
+            - List of servers to start or stop.
+            - Required: True
+
+    state:
+        description:
+            - Choices: ['start', 'stop']
+            - Required: True
+
+    was_root:
+        description:
+            - The current used WAS installation root. Ie. /opt/WebSphere/AppServer
+            - Required: True
+
+    jvm_mb:
+        description:
+            - Memory in MB one server JVM needs. The number of servers handled at the same time is capped
+            - by the CPU count and by how many such JVMs the available memory holds.
+            - Required: False
+            - Default: 1024
+
+    max_workers:
+        description:
+            - Number of servers handled at the same time, overriding the CPU and memory based cap.
+            - Required: False
+
+author: Tommy Davison <tommyboy784@gmail.com>
+'''
+
+EXAMPLES='''
+-
+  name: START ALL SERVERS OF THE NODE
+  new_server:
+    state: start
+    profile_name: AppSrv01
+    server_name:
+      - Server01
+      - Server02
+      - Server03
+    was_root: /opt/WebSphere/AppServer
+'''
+
+
+def server_running(was_root, profile_name, server):
+    """Function that tells if a server is running from its JVM in /proc, cross-checked with its pid file."""
+
+    profile_root = was_root + '/profiles/' + profile_name
+    return process_table().check(profile_root + '/logs/' + server + '/' + server + '.pid', profile_root,
+                                 server)['running']
+
+
+def control_server(was_root, profile_name, server, state):
+    """Function that runs startServer.sh or stopServer.sh for one server.
+    Returns a dict with the server's status, duration and, on failure, the script output.
+    """
+
+    if (state == 'start') == server_running(was_root, profile_name, server):
+        return dict(server=server, status='already ' + ('started' if state == 'start' else 'stopped'),
+                    changed=False, duration=0.0)
+
+    started = time.time()
+    child = sp.Popen(
+        [
+            was_root + '/profiles/' + profile_name + '/bin/' + state + 'Server.sh ' + server
+        ],
+        shell=True,
+        stdout=sp.PIPE,
+        stderr=sp.PIPE
+    )
+    stdout_value, stderr_value = child.communicate()
+
+    result = dict(server=server, changed=child.returncode == 0, rc=child.returncode,
+                  duration=round(time.time() - started, 1))
+    if child.returncode != 0:
+        result.update(status='failed', stdout=stdout_value, stderr=stderr_value)
+    else:
+        result['status'] = 'started' if state == 'start' else 'stopped'
+    return result
 
 
 def run_server():
@@ -9,8 +111,10 @@ def run_server():
         argument_spec = dict(
             profile_name = dict(type='str', required=True),
             server_name = dict(type='list', required=True),
-            state = dict(type='str', required=True),
-            was_root = dict(type='str', required=True)
+            state = dict(type='str', required=True, choices=['start', 'stop']),
+            was_root = dict(type='str', required=True),
+            jvm_mb = dict(type='int', required=False, default=DEFAULT_JVM_MB),
+            max_workers = dict(type='int', required=False, default=None)
         )
     )
 
@@ -19,29 +123,37 @@ def run_server():
     state = module.params['state']
     was_root = module.params['was_root']
 
-    if state == 'start':
-        for server in server_name:
-            child = sp.Popen(
-                [
-                    was_root + '/profiles/' + profile_name + '/bin/startServer.sh ' + server
-                ],
-                shell=True,
-                stdout=sp.PIPE,
-                stderr=sp.PIPE
-            )
-            stdout_value, stderr_value = child.communicate()
-
-            if child.returncode != 0:
-                module.fail_json(
-                    msg='Failed to start server ' + str(server_name),
-                    changed=False,
-	            stdout=stdout_value,
-		    stderr=stderr_value
-                )
-            module.exit_json(
-                msg='Succesfully started server ' + str(server_name),
-                changed=True
-            )
+    started = time.time()
+    pending = [server for server in server_name
+               if (state == 'start') != server_running(was_root, profile_name, server)]
+    workers = worker_limit(len(pending), module.params['jvm_mb'], module.params['max_workers'])
+    pool = ThreadPool(workers)
+    try:
+        results = pool.map(lambda server: control_server(was_root, profile_name, server, state), server_name)
+    finally:
+        pool.close()
+
+    servers = dict((result.pop('server'), result) for result in results)
+    failed = [server for server in server_name if servers[server]['status'] == 'failed']
+    changed = [server for server in server_name if servers[server]['changed']]
+    duration = round(time.time() - started, 1)
+
+    if failed:
+        module.fail_json(
+            msg='Failed to ' + state + ' server(s) ' + ', '.join(failed),
+            changed=bool(changed),
+            servers=servers,
+            workers=workers,
+            duration=duration
+        )
+    module.exit_json(
+        msg='Succesfully ' + ('started' if state == 'start' else 'stopped') + ' server(s) ' +
+        (', '.join(changed) or 'none, all already ' + ('started' if state == 'start' else 'stopped')),
+        changed=bool(changed),
+        servers=servers,
+        workers=workers,
+        duration=duration
+    )
 
 def main():
     run_server()
@@ -2,6 +2,7 @@
 
 import subprocess as sp
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.ibm_was_inventory import existing_profiles
 import datetime
 
 
@@ -55,6 +56,14 @@ options:
 	    description:
 		    - Type: String
 			- Required: False, only needed when federating node into dmgr cell.
+
+	existence_check:
+	    description:
+		    - Type: String
+			- Required: False, how to tell whether profile_name exists. Default: registry
+			- registry reads the exact names from was_root/properties/profileRegistry.xml, without a JVM.
+			- manageprofiles runs manageprofiles.sh -listProfiles instead.
+			- Choices: registry, manageprofiles
 	
 	profile_name:
 	    description:
@@ -98,6 +107,7 @@ def pmt_run():
         augment = dict(type='bool', required=False),
         backup = dict(tpye='bool', requried=False),
         dmgr_host = dict(type='str', required=False),
+        existence_check = dict(type='str', required=False, default='registry', choices=['registry', 'manageprofiles']),
         profile_name = dict(type='str', required=True),
         profile_root = dict(type='str', required=False),
         restore = dict(type='bool', required=False),
@@ -265,16 +275,7 @@ def pmt_run():
             )
 
     if state == 'present':
-        child = sp.Popen(
-            [
-                was_root+'/bin/manageprofiles.sh -listProfiles'
-            ],
-            shell=True,
-            stdout = sp.PIPE,
-            stderr = sp.PIPE
-        )
-        stdout_value, stderr_value = child.communicate()
-        profiles = stdout_value
+        profiles = existing_profiles(module, was_root, module.params['existence_check'])
         if profile_name in profiles:
             module.exit_json(
                 msg='Profile ' + profile_name + ' already exists in this cell.',
@@ -340,16 +341,7 @@ def pmt_run():
                 changed=True
             )
     if state == 'absent':
-        child = sp.Popen(
-            [
-                was_root+'/bin/manageprofiles.sh -listProfiles'
-            ],
-            shell=True,
-            stdout = sp.PIPE,
-            stderr = sp.PIPE
-        )
-        stdout_value, stderr_value = child.communicate()
-        profiles = stdout_value
+        profiles = existing_profiles(module, was_root, module.params['existence_check'])
         if profile_name not in profiles:
             module.exit_json(
                 msg='Profile ' + profile_name + ' does not exist in this cell',
@@ -1,6 +1,11 @@
 #!/usr/bin/python
 
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.ibm_was_server import STATUS_FILE, SYSTEM_OUT, LaunchError, current_status, \
+    forget_status_all, launch_config_files, launch_detached, launch_script, log_position, start_with_script, \
+    status_all, wait_for, wait_ready
+from ansible.module_utils.ibm_was_proc import process_table
+import time
 import subprocess as sp
 import os
 
@@ -8,7 +13,6 @@ import os
 TODO='''
 List of TODO items for this module:
 1. Change server_name type from str => list
-2. Look into multi-process Server starts, or nowait option added
 '''
 
 ANSIBLE_METADATA = {
@@ -41,12 +45,16 @@ options:
     server_name:
         description:
             - Name of server in WAS cell to be started, stopped, or have status check
-            - Required: True
+            - Required: True, except with state check_all
 
     state:
         description:
             - Determines the state to send the Application server
-            - Choices: ['check', 'start', 'stop']
+            - wait blocks until a start or stop launched with nowait has finished, up to timeout
+            - check_all returns the status of every server of the profile's node at once, see status_source
+            - start and stop tell a running server from its JVM in /proc, not from its pid file alone, so a
+            - pid file left behind by a killed server does not make start skip it.
+            - Choices: ['check', 'check_all', 'start', 'stop', 'wait']
             - Required: True
 
     was_root:
@@ -56,9 +64,72 @@ options:
 
     nowait:
         description:
-            - Tells the JMX call not to wait for initilization.
-            - Return control to prompt
+            - Launch startServer.sh/stopServer.sh detached in its own process group and return right away.
+            - The launch is tracked in status_file (pid, phase, timestamps, exit code), which state wait polls.
+            - Lets one play start or stop dozens of servers at the same time.
+            - Required: False
+            - Default: False
+
+    status_file:
+        description:
+            - JSON status file of a nowait start or stop.
+            - Default: <was_root>/profiles/<profile_name>/logs/<server_name>/ansible_server_status.json
+            - Required: False
+
+    timeout:
+        description:
+            - Seconds state wait waits for a nowait start or stop to finish, and readiness log waits for
+            - the server to be ready, before failing.
+            - Required: False
+            - Default: 600
+
+    readiness:
+        description:
+            - When a started server counts as up.
+            - script trusts startServer.sh returning 0, while applications may still be starting.
+            - log follows logs/<server_name>/SystemOut.log from where it ended at launch (across a log
+            - rotation) until the "open for e-business" WSVR0001I marker shows up, and fails as soon as a
+            - startup error code (WSVR0009E, WSVR0040E) or one of fail_patterns does. time_to_ready is returned.
+            - With nowait, state wait does the following, and also fails fast when startServer.sh fails.
+            - Choices: ['script', 'log']
+            - Required: False
+            - Default: script
+
+    fail_patterns:
+        description:
+            - Extra regular expressions that fail readiness log as soon as they show up in SystemOut.log.
+            - Required: False
+
+    launch:
+        description:
+            - How a server is started.
+            - wrapper runs startServer.sh, which first spins up a launcher JVM that reads the whole
+            - configuration to build the server's command line.
+            - script has startServer.sh <server> -script write that command line to a launch script once,
+            - caches it in <profile>/logs/ansible_launch keyed by a digest of the server, node and cell
+            - configuration, setupCmdLine.sh and the WAS level, and starts the JVM straight from it.
+            - The script is only regenerated when that digest changes. A start is done once the server
+            - writes a fresh pid file; with nowait, state wait reports the JVM spawned, so use readiness log.
+            - Choices: ['wrapper', 'script']
+            - Required: False
+            - Default: wrapper
+
+    status_source:
+        description:
+            - Where state check_all gets the server status from.
+            - native reads every server's pid file and checks the process in /proc, no JVM is started.
+            - script runs serverStatus.sh -all once for the whole profile; pids and uptimes are still added natively.
+            - The servers are those in the serverindex.xml of the node named in setupCmdLine.sh.
+            - Choices: ['native', 'script']
+            - Required: False
+            - Default: native
+
+    cache_ttl:
+        description:
+            - Seconds the result of check_all is cached in <profile>/logs/ansible_status_all.json, so the
+            - tasks of one play share it. Starting, stopping or waiting on a server drops the cache.
             - Required: False
+            - Default: 30
 
 author: Tommy Davison <tommyboy784@gmail.com>
 
@@ -86,6 +157,29 @@ EXAMPLES='''
     was_root: /opt/WebSphere/AppServer
     nowait: True
 
+#start many servers at once, then wait for all of them
+---
+-
+  name: START SERVERS
+  server:
+    state: start
+    profile_name: AppSrv01
+    server_name: "{{ item }}"
+    was_root: /opt/WebSphere/AppServer
+    nowait: True
+  with_items: "{{ servers }}"
+
+-
+  name: WAIT FOR SERVERS
+  server:
+    state: wait
+    profile_name: AppSrv01
+    server_name: "{{ item }}"
+    was_root: /opt/WebSphere/AppServer
+    timeout: 900
+    readiness: log
+  with_items: "{{ servers }}"
+
 
 #stop server
 ---
@@ -107,8 +201,159 @@ EXAMPLES='''
     server_name: Server01
     was_root: /opt/WebSphere/AppServer
 
+#status of every server of the profile
+---
+-
+  name: CHECK ALL SERVERS
+  server:
+    state: check_all
+    profile_name: AppSrv01
+    was_root: /opt/WebSphere/AppServer
+  register: was_status
+
 '''
 
+RETURN='''
+servers:
+    description: Status of every server of the profile, with state check_all.
+    returned: state check_all
+    type: dict
+    sample: {"server1": {"state": "STARTED", "type": "APPLICATION_SERVER", "pid": 4242, "uptime": 3600,
+             "stale_pid": false, "missing_pid": false}, "nodeagent": {"state": "STOPPED", "type": "NODE_AGENT",
+             "pid": null, "uptime": null, "stale_pid": true, "missing_pid": false}}
+status_cache:
+    description: Where the check_all status came from, whether it was cached and how old it is in seconds.
+    returned: state check_all
+    type: dict
+    sample: {"source": "native", "cached": true, "age": 4.2}
+'''
+
+
+def cached_launch_script(module, was_root, profile_name, server_name):
+    """Function that returns the cached launch script of a server and its cache info.
+    The script is regenerated with startServer.sh -script only when the server's configuration changed.
+    """
+
+    profile_root = was_root + '/profiles/' + profile_name
+    try:
+        return launch_script(profile_root + '/bin/startServer.sh ' + server_name, profile_root, server_name,
+                             launch_config_files(was_root, profile_root, server_name))
+    except (LaunchError, IOError, OSError) as e:
+        module.fail_json(
+            msg='Failed to generate the launch script of server ' + server_name + ': ' + str(e),
+            changed=False
+        )
+
+
+def launch_server(module, action, cmd, server_name, status_file, extra=None):
+    """Function that launches a start or stop detached and exits without waiting for it.
+    The script's output goes to ansible_<action>Server.out next to the status file.
+    """
+
+    status_dir = os.path.dirname(status_file)
+    if not os.path.isdir(status_dir):
+        try:
+            os.makedirs(status_dir)
+        except OSError:
+            if not os.path.isdir(status_dir):
+                raise
+
+    status = launch_detached(cmd, status_file, status_dir + '/ansible_' + action + 'Server.out', action=action,
+                             extra=extra)
+    module.exit_json(
+        msg='Launched ' + action + ' of server ' + server_name + ', follow it with state wait',
+        changed=True,
+        status=status,
+        status_file=status_file
+    )
+
+
+def report_ready(module, server_name, ready, started, **result):
+    """Function that fails unless SystemOut.log showed the server ready, and reports time_to_ready otherwise."""
+
+    if ready['timed_out']:
+        module.fail_json(
+            msg='Server ' + server_name + ' was not open for e-business after ' + str(module.params['timeout']) + 's',
+            **result
+        )
+    if not ready['ready']:
+        module.fail_json(
+            msg='Server ' + server_name + ' failed to start: ' + ready['error'],
+            **result
+        )
+    module.exit_json(
+        msg='Server ' + server_name + ' is open for e-business',
+        time_to_ready=round(time.time() - started, 1),
+        ready_line=ready['line'],
+        **result
+    )
+
+
+def wait_server(module, server_name, status_file, system_out):
+    """Function that waits for a start or stop launched with nowait to finish.
+    With readiness log, a start is done once SystemOut.log shows the server open for e-business.
+    """
+
+    status = current_status(status_file)
+    if status is not None and status['action'] == 'start' and module.params['readiness'] == 'log':
+        def abort():
+            current = current_status(status_file)
+            if current is None:
+                # Missing or being rewritten, look again on the next poll.
+                return None
+            if current['phase'] in ['failed', 'lost']:
+                return 'startServer.sh ' + current['phase'] + ', see ' + current['output']
+            return None
+
+        ready = wait_ready(system_out, status.get('log_position'), module.params['timeout'],
+                           module.params['fail_patterns'], abort)
+        report_ready(module, server_name, ready, status['launched'], changed=False,
+                     status=current_status(status_file))
+
+    status = wait_for(status_file, module.params['timeout'])
+    if status is None:
+        module.fail_json(
+            msg='No nowait start or stop of server ' + server_name + ' to wait for, ' + status_file +
+            ' does not exist',
+            changed=False
+        )
+    if status.get('timed_out'):
+        module.fail_json(
+            msg='Timed out after ' + str(module.params['timeout']) + 's waiting for ' + status['action'] +
+            ' of server ' + server_name,
+            changed=False,
+            status=status
+        )
+    if status['phase'] != 'succeeded':
+        module.fail_json(
+            msg='Failed to ' + status['action'] + ' server ' + server_name + '. See output for details ---> ' +
+            status['output'],
+            changed=False,
+            status=status
+        )
+    module.exit_json(
+        msg='Server ' + server_name + ' finished ' + status['action'],
+        changed=False,
+        status=status
+    )
+
+
+def check_all(module, profile_root):
+    """Function that reports the status of every server of a profile in one call."""
+
+    try:
+        servers, info = status_all(profile_root, module.params['status_source'], module.params['cache_ttl'])
+    except (LaunchError, IOError, OSError) as e:
+        module.fail_json(
+            msg='Failed to check the status of the servers of ' + profile_root + ': ' + str(e),
+            changed=False
+        )
+    module.exit_json(
+        changed=False,
+        servers=servers,
+        status_cache=info
+    )
+
 
 def run_server():
     """Function that will control all JMX IBM Application server calls
@@ -117,14 +362,27 @@ def run_server():
 
     module_args=dict(
         profile_name=dict(type='str', required=True),
-        state=dict(type='str', required=True, choices=['check', 'start', 'stop']),
-        server_name=dict(type='str', required=True),
+        state=dict(type='str', required=True, choices=['check', 'check_all', 'start', 'stop', 'wait']),
+        server_name=dict(type='str', required=False),
         was_root=dict(type='str', required=True),
-        nowait=dict(type='bool', required=False)
+        nowait=dict(type='bool', required=False, default=False),
+        status_file=dict(type='path', required=False, default=None),
+        timeout=dict(type='int', required=False, default=600),
+        readiness=dict(type='str', required=False, default='script', choices=['script', 'log']),
+        fail_patterns=dict(type='list', required=False, default=[]),
+        launch=dict(type='str', required=False, default='wrapper', choices=['wrapper', 'script']),
+        status_source=dict(type='str', required=False, default='native', choices=['native', 'script']),
+        cache_ttl=dict(type='int', required=False, default=30)
     )
 
     module = AnsibleModule(
-        argument_spec=module_args
+        argument_spec=module_args,
+        required_if=[
+            ['state', 'check', ['server_name']],
+            ['state', 'start', ['server_name']],
+            ['state', 'stop', ['server_name']],
+            ['state', 'wait', ['server_name']]
+        ]
     )
 
     profile_name = module.params['profile_name']
@@ -132,47 +390,88 @@ def run_server():
     server_name = module.params['server_name']
     was_root = module.params['was_root']
     nowait = module.params['nowait']
+    profile_root = was_root + '/profiles/' + profile_name
+
+    if state == 'check_all':
+        check_all(module, profile_root)
+
+    server_logs = profile_root + '/logs/' + server_name
+    status_file = module.params['status_file'] or server_logs + '/' + STATUS_FILE
+    system_out = server_logs + '/' + SYSTEM_OUT
+
+    if state in ['start', 'stop', 'wait']:
+        forget_status_all(profile_root)
+    running = process_table().check(server_logs + '/' + server_name + '.pid', profile_root, server_name)['running']
 
+    if state == 'wait':
+        wait_server(module, server_name, status_file, system_out)
 
     if state == 'start':
-        if os.path.exists(was_root + '/profiles/' + profile_name +
-        '/logs/' + server_name + '/' + server_name + '.pid'):
+        if running:
             module.exit_json(
                 msg='Server is already running',
                 changed=False
             )
-        elif state == 'start':
-            child = sp.Popen(
-                [
-                    was_root + '/profiles/' + profile_name +
-                    '/bin/startServer.sh ' + server_name 
-                ],
-                shell=True,
-                stdout=sp.PIPE,
-                stderr=sp.PIPE
-            )
-            stdout_value, stderr_value = child.communicate()
 
+        launch = None
+        start_cmd = was_root + '/profiles/' + profile_name + '/bin/startServer.sh ' + server_name
+        if module.params['launch'] == 'script':
+            script, launch = cached_launch_script(module, was_root, profile_name, server_name)
+            start_cmd = '/bin/sh ' + script
 
-            if child.returncode != 0:
-                module.fail_json(
-                    msg='Failed to start server. See log for details ---> ' +
-                    was_root + '/profiles/' + profile_name + '/logs/' + server_name +
-                    '/startServer.log',
-                    changed=False
+        if nowait:
+            launch_server(module, 'start', start_cmd, server_name, status_file,
+                          dict(log_position=log_position(system_out), launch=launch))
+        else:
+            position = log_position(system_out)
+            started = time.time()
+            if launch is not None:
+                returncode, error = start_with_script(script, server_logs + '/' + server_name + '.pid',
+                                                      server_logs + '/ansible_startServer.out',
+                                                      module.params['timeout'])
+                if returncode != 0:
+                    module.fail_json(
+                        msg='Failed to start server ' + server_name + ': ' + error,
+                        changed=False,
+                        launch=launch
+                    )
+            else:
+                child = sp.Popen(
+                    [
+                        start_cmd
+                    ],
+                    shell=True,
+                    stdout=sp.PIPE,
+                    stderr=sp.PIPE
                 )
+                stdout_value, stderr_value = child.communicate()
+
+                if child.returncode != 0:
+                    module.fail_json(
+                        msg='Failed to start server. See log for details ---> ' +
+                        was_root + '/profiles/' + profile_name + '/logs/' + server_name +
+                        '/startServer.log',
+                        changed=False
+                    )
+            if module.params['readiness'] == 'log':
+                report_ready(module, server_name, wait_ready(system_out, position, module.params['timeout'],
+                                                             module.params['fail_patterns']),
+                             started, changed=True, launch=launch)
             module.exit_json(
                 msg='Succesfully started server ' + server_name,
-                changed=True
+                changed=True,
+                launch=launch
             )
 
     if state == 'stop':
-        if os.path.exists(was_root + '/profiles/' + profile_name +
-        '/logs/' + server_name + '/' + server_name + '.pid') == False:
+        if not running:
             module.exit_json(
                 msg='Server is not started ' + server_name,
                 changed=False
             )
+        elif nowait:
+            launch_server(module, 'stop', was_root + '/profiles/' + profile_name +
+                          '/bin/stopServer.sh ' + server_name, server_name, status_file)
         else:
             child =  sp.Popen(
                 [
@@ -28,92 +28,158 @@ options:
             - Required: False.
             - Choices: absent, present
 
+    kit:
+        description:
+            - Type: String.
+            - Required: False.
+            - Zip or tar TX kit to install from, instead of the extracted kit under /was855.
+            - Extracted once per content hash into kit_cache_dir and reused by later runs.
+
+    kit_cache_dir:
+        description:
+            - Type: String.
+            - Required: False.
+            - Directory of the extracted kit cache shared by the installer modules. Default ~/.ansible/ibm_kits
+
+    kit_cache_mb:
+        description:
+            - Type: Int.
+            - Required: False.
+            - Disk budget of kit_cache_dir in MB, least recently used kits are evicted beyond it. Default 20480
+
+    kit_manifest:
+        description:
+            - Type: String.
+            - Required: False.
+            - sha256sum style manifest of the TX kit, checked before the install starts.
+            - Paths are relative to the manifest's directory. Digests are cached by path, size and mtime in kit_cache_dir.
+
 author: Tommy Davison | <tommy.davison@state.mn.us>
 '''
 import subprocess as sp
 import os
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.ibm_kit_cache import DEFAULT_KIT_CACHE_DIR, DEFAULT_KIT_CACHE_MB, DIGEST_CACHE, KitError, \
+        cached_kit, find_in_kit
+from ansible.module_utils.ibm_kit_verify import verify_kit
 
 def install_tx():
-	"""Module to set all arguments
-	   And the logic that will execute
-	   During module runtime """
+        """Module to set all arguments
+           And the logic that will execute
+           During module runtime """
 
-	module_args = dict(
-		response_loc = dict(type='str', required=False),
-		state = dict(type='str', required=False, choices=['absent', 'present'])
-	)
+        module_args = dict(
+                response_loc = dict(type='str', required=False),
+                state = dict(type='str', required=False, choices=['absent', 'present']),
+                kit = dict(type='path', required=False),
+                kit_cache_dir = dict(type='path', required=False, default=DEFAULT_KIT_CACHE_DIR),
+                kit_cache_mb = dict(type='int', required=False, default=DEFAULT_KIT_CACHE_MB),
+                kit_manifest = dict(type='path', required=False)
+        )
 
-	module = AnsibleModule(
-		argument_spec = module_args
-	)
+        module = AnsibleModule(
+                argument_spec = module_args
+        )
 
-	response_loc = module.params['response_loc']
-	state = module.params['state']
+        response_loc = module.params['response_loc']
+        state = module.params['state']
 
-	dtxinfo = '/opt/wtx/tx4is/bin/dtxinfo'
+        dtxinfo = '/opt/wtx/tx4is/bin/dtxinfo'
+        dtxinst = '/was855/ITX_INTEG_SVRS_V9.0_LINUX_X86_ML/9.0.0.2-ITX-wsdtxis-linux/DTXINST'
 
 
         if state == 'absent':
-		child = sp.Popen(
-			['/opt/wtx/tx4is/dtx_install/IBM_WebSphere_Transformation_Extender_for_Integration_Servers.uninstall'],
-			shell = True,
-			stdout = sp.PIPE,
-			stderr = sp.PIPE
-		)
-		stdout_value, stderr_value = child.communicate()
-
-		if child.returncode != 0:
-			module.fail_json(
-				msg = "Failed to uninstall TX...",
-				changed = False,
-				stderr = stderr_value,
-				stdout = stdout_value
-			)
-		module.exit_json(
-			msg = "Succesfully uninstalled TX...",
-			changed = True
-		)
-
-	elif os.path.exists(dtxinfo) == False and state == 'present':
-		child = sp.Popen(
-			['/was855/ITX_INTEG_SVRS_V9.0_LINUX_X86_ML/9.0.0.2-ITX-wsdtxis-linux/DTXINST -s' +
-			response_loc + ' -I /opt/wtx/temp/install_TX.log ' +
+                child = sp.Popen(
+                        ['/opt/wtx/tx4is/dtx_install/IBM_WebSphere_Transformation_Extender_for_Integration_Servers.uninstall'],
+                        shell = True,
+                        stdout = sp.PIPE,
+                        stderr = sp.PIPE
+                )
+                stdout_value, stderr_value = child.communicate()
+
+                if child.returncode != 0:
+                        module.fail_json(
+                                msg = "Failed to uninstall TX...",
+                                changed = False,
+                                stderr = stderr_value,
+                                stdout = stdout_value
+                        )
+                module.exit_json(
+                        msg = "Succesfully uninstalled TX...",
+                        changed = True
+                )
+
+        elif os.path.exists(dtxinfo) == False and state == 'present':
+                if module.params['kit_manifest'] is not None:
+                        try:
+                                verify = verify_kit(module.params['kit_manifest'],
+                                        os.path.join(os.path.expanduser(module.params['kit_cache_dir']), DIGEST_CACHE))
+                        except (IOError, OSError) as e:
+                                module.fail_json(
+                                        msg = "Failed to read TX kit manifest %s: %s" % (module.params['kit_manifest'], e),
+                                        changed = False
+                                )
+                        if verify['failed']:
+                                module.fail_json(
+                                        msg = "TX kit verification failed for: %s" % (', '.join(sorted(verify['failed']))),
+                                        changed = False,
+                                        verify = verify
+                                )
+
+                if module.params['kit'] is not None:
+                        try:
+                                kit_dir, kit = cached_kit(module.params['kit'], module.params['kit_cache_dir'],
+                                        module.params['kit_cache_mb'])
+                        except (KitError, IOError, OSError) as e:
+                                module.fail_json(
+                                        msg = "Failed to extract TX kit %s: %s" % (module.params['kit'], e),
+                                        changed = False
+                                )
+                        dtxinst = find_in_kit(kit_dir, 'DTXINST')
+                        if dtxinst is None:
+                                module.fail_json(
+                                        msg = "No DTXINST found in TX kit %s" % (module.params['kit']),
+                                        changed = False
+                                )
+
+                child = sp.Popen(
+                        [dtxinst + ' -s' +
+                        response_loc + ' -I /opt/wtx/temp/install_TX.log ' +
                         '&& /opt/wtx/tx4is/OSGi/deploy/wtxDeployOSGi.sh /opt/IBM/ProcessServer'
                         ],
-			shell = True,
-			stdout = sp.PIPE,
-			stderr = sp.PIPE
-		)
-		stdout_value, stderr_value = child.communicate()
+                        shell = True,
+                        stdout = sp.PIPE,
+                        stderr = sp.PIPE
+                )
+                stdout_value, stderr_value = child.communicate()
 
                 if child.returncode != 0:
-			module.fail_json(
-				msg = "Failed to install TX... Check /opt/wtx/temp/install_TX.log for details",
-				changed = False,
-				stderr = stderr_value,
-				stdout = stdout_value
-			)
-
-		module.exit_json(
-			msg = "Succesfully installed TX and deployed WTX OSGI",
-			changed = True
-		)
-		module.fail_json(
-		    msg = "Failed to deploy WTX OSGI...",
-		    changed = False,
-		    stderr = stderr_value,
-		    stdout = stdout_value
+                        module.fail_json(
+                                msg = "Failed to install TX... Check /opt/wtx/temp/install_TX.log for details",
+                                changed = False,
+                                stderr = stderr_value,
+                                stdout = stdout_value
+                        )
+
+                module.exit_json(
+                        msg = "Succesfully installed TX and deployed WTX OSGI",
+                        changed = True
+                )
+                module.fail_json(
+                    msg = "Failed to deploy WTX OSGI...",
+                    changed = False,
+                    stderr = stderr_value,
+                    stdout = stdout_value
+                )
+        else:
+                module.exit_json(
+                        msg = "TX not installed on server",
+                        changed = False
                 )
-	else:
-		module.exit_json(
-			msg = "TX not installed on server",
-			changed = False
-		)
 
 
 def main():
-	install_tx()
+        install_tx()
 
 if __name__ == "__main__":
-	main()
+        main()
@@ -4,6 +4,8 @@
 import os
 import subprocess as sp
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.ibm_kit_cache import DEFAULT_KIT_CACHE_DIR, DEFAULT_KIT_CACHE_MB, KitError, cached_kit, \
+    find_in_kit
 import time
 
 
@@ -15,10 +17,14 @@ def set_params():
     global module 
     global ora_inst
     global response_loc
+    global run_installer
 
     module_args=dict(
         ora_inst=dict(type='str', required=True),
-        response_loc=dict(type='str', required=True)
+        response_loc=dict(type='str', required=True),
+        kit=dict(type='path', required=False),
+        kit_cache_dir=dict(type='path', required=False, default=DEFAULT_KIT_CACHE_DIR),
+        kit_cache_mb=dict(type='int', required=False, default=DEFAULT_KIT_CACHE_MB)
     )
 
     module=AnsibleModule(
@@ -27,6 +33,7 @@ def set_params():
 
     ora_inst = module.params['ora_inst']
     response_loc = module.params['response_loc']
+    run_installer = '/was855/OAM-11g/Disk1/runInstaller'
 
     
 def check_for_ofm():
@@ -72,12 +79,29 @@ def check_for_java():
         return False
 
 
+def kit_installer():
+    """Function to locate runInstaller in the WebGate kit
+    The kit is extracted through the shared kit cache, so it is
+    only unzipped once per content hash
+    """
+
+    try:
+        kit_dir, kit = cached_kit(module.params['kit'], module.params['kit_cache_dir'], module.params['kit_cache_mb'])
+    except (KitError, IOError, OSError) as e:
+        module.fail_json(msg='Failed to extract WebGate kit %s: %s' % (module.params['kit'], e), changed=False)
+
+    installer = find_in_kit(kit_dir, 'runInstaller')
+    if installer is None:
+        module.fail_json(msg='No runInstaller found in WebGate kit %s' % (module.params['kit']), changed=False)
+    return installer
+
+
 def install_webgate():
     """Function to install webgate"""
 
     t = sp.Popen(
         [
-            '/was855/OAM-11g/Disk1/runInstaller -silent -response ' +
+            run_installer + ' -silent -response ' +
             response_loc + ' -jreLoc /usr/ -invPtrLoc ' + ora_inst +
             ' -ignoreSysPrereqs'
         ],
@@ -133,6 +157,7 @@ def edit_httpdConf():
 
 def main():
     """Function to put all the peices together"""
+    global run_installer
     set_params()
 
     if check_for_java() == False:
@@ -147,6 +172,9 @@ def main():
             changed=False
         )
 
+    if module.params['kit'] is not None:
+        run_installer = kit_installer()
+
     if install_webgate():
         if create_webgate():
             module.exit_json(msg='Succesfully created IHS Oracle Webgate instance',changed=True)
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""Shared helpers for IBM Installation Manager agent data.
+
+IBM IM keeps the record of everything it has installed in its agent data
+directory (appDataLocation). The helpers here locate that directory for a given
+imcl binary and read installRegistry.xml/installed.xml natively, so presence
+checks never need to start an imcl JVM. When the registry format is not
+recognized, a host-local cache of imcl listInstalledPackages is used instead,
+which only starts imcl again once the agent data changed.
+
+author: Tom Davison (@tntdavison784)
+"""
+
+import os
+import time
+import xml.etree.ElementTree as ET
+
+from ansible.module_utils.ibm_json_file import read_json, write_cache
+
+
+AGENT_DATA_FILES = ['installed.xml', 'installRegistry.xml']
+DEFAULT_CACHE_DIR = '~/.ansible/ibm_imcl'
+INVENTORY_CACHE = 'inventory.json'
+
+
+def agent_data_location(imcl_path):
+    """Function that locates the IM agent data directory for an imcl binary.
+    The location is read from cic.appDataLocation in the IM config.ini, and
+    falls back to the IM defaults for admin and non-admin installs.
+    """
+
+    eclipse = os.path.dirname(os.path.dirname(os.path.abspath(imcl_path)))
+    config_ini = os.path.join(eclipse, 'configuration', 'config.ini')
+
+    try:
+        with open(config_ini, 'r') as f_obj:
+            for line in f_obj:
+                key, sep, value = line.partition('=')
+                if sep and key.strip() == 'cic.appDataLocation':
+                    value = value.strip().replace('\\:', ':')
+                    value = value.replace('@osgi.install.area', eclipse)
+                    return os.path.normpath(os.path.expanduser(value))
+    except (IOError, OSError):
+        pass
+
+    if os.geteuid() == 0:
+        return '/var/ibm/InstallationManager'
+    return os.path.expanduser('~/var/ibm/InstallationManager')
+
+
+def agent_data_fingerprint(agent_data):
+    """Function that returns the mtime/size of the IM agent data files.
+    IM rewrites these files on every install, update, rollback and uninstall,
+    so the fingerprint only changes when IM state actually changed.
+    Returns None when no agent data could be found.
+    """
+
+    fingerprint = []
+    for name in AGENT_DATA_FILES:
+        try:
+            stat = os.stat(os.path.join(agent_data, name))
+        except OSError:
+            continue
+        fingerprint.append([name, stat.st_mtime, stat.st_size])
+
+    if not fingerprint:
+        return None
+    return fingerprint
+
+
+class AgentDataFormatError(Exception):
+    """Raised when the IM agent data is missing or in a format we do not know."""
+    pass
+
+
+def _registry_offerings(root):
+    """Function that reads offerings from an installRegistry.xml tree.
+    Each <profile> carries its installLocation as a property and one <offering>
+    element per installed offering with its comma separated features.
+    """
+
+    offerings = []
+    for profile in root.findall('profile'):
+        location = None
+        for prop in profile.findall('property'):
+            if prop.get('name') == 'installLocation':
+                location = prop.get('value')
+        for offering in profile.findall('offering'):
+            features = offering.get('features') or ''
+            offerings.append(dict(
+                id=offering.get('id'),
+                version=offering.get('version'),
+                profile=profile.get('id'),
+                location=location,
+                features=[f for f in features.split(',') if f]
+            ))
+    return offerings
+
+
+def _installed_offerings(root):
+    """Function that reads offerings from an installed.xml tree.
+    Each <location> carries its path and one <package> element per installed
+    offering with a <feature> child per installed feature.
+    """
+
+    offerings = []
+    for location in root.findall('location'):
+        for package in location.findall('package'):
+            offerings.append(dict(
+                id=package.get('id'),
+                version=package.get('version'),
+                profile=location.get('id'),
+                location=location.get('path'),
+                features=[f.get('id') for f in package.findall('feature') if f.get('id')]
+            ))
+    return offerings
+
+
+def read_agent_data(agent_data):
+    """Function that returns the installed offerings recorded in the IM agent data.
+    installRegistry.xml is preferred, installed.xml is used when the registry is missing.
+    Every offering is a dict with id, version, package (<id>_<version>), profile,
+    location and features.
+    Raises AgentDataFormatError when neither file exists or can be understood.
+    """
+
+    readers = [('installRegistry.xml', 'installRegistry', _registry_offerings),
+               ('installed.xml', 'installInfo', _installed_offerings)]
+
+    for name, root_tag, reader in readers:
+        xml_file = os.path.join(agent_data, name)
+        if not os.path.isfile(xml_file):
+            continue
+        try:
+            root = ET.parse(xml_file).getroot()
+        except (ET.ParseError, IOError, OSError):
+            continue
+        if root.tag != root_tag:
+            continue
+        offerings = reader(root)
+        if [o for o in offerings if not (o['id'] and o['version'])]:
+            continue
+        for offering in offerings:
+            offering['package'] = '{0}_{1}'.format(offering['id'], offering['version'])
+        return offerings
+
+    raise AgentDataFormatError(
+        "No recognized IM agent data (installRegistry.xml, installed.xml) in {0}".format(agent_data))
+
+
+def package_installed(package, packages):
+    """Function that matches a package against the installed inventory.
+    A package matches either its full <id>_<version> entry or its bare offering id.
+    """
+
+    for installed in packages:
+        if installed == package or installed.startswith(package + '_'):
+            return True
+    return False
+
+
+def list_installed_packages(module, imcl_path, options=''):
+    """Function that runs imcl listInstalledPackages and returns its non empty output lines."""
+
+    cmd = """{0} listInstalledPackages {1}""".format(imcl_path, options).strip()
+    rc, stdout, stderr = module.run_command(cmd, use_unsafe_shell=True)
+
+    if rc != 0:
+        module.fail_json(
+            msg="Failed to list installed packages with {0}".format(imcl_path),
+            changed=False,
+            stderr=stderr,
+            stdout=stdout
+        )
+    return [line.strip() for line in stdout.splitlines() if line.strip()]
+
+
+def parse_installed_features(lines):
+    """Function that parses imcl listInstalledPackages -features -long output.
+    Every line reads <location> : <package> : <name> : <version> : <features>, where
+    features is comma separated. Returns {package: {location, features}}.
+    """
+
+    installed = {}
+    for line in lines:
+        fields = [field.strip() for field in line.split(' : ')]
+        if len(fields) < 5:
+            continue
+        installed[fields[1]] = dict(location=fields[0], features=[f for f in fields[-1].split(',') if f])
+    return installed
+
+
+def _cached_listing(module, imcl_path, agent_data, cache_dir, offline, key, produce):
+    """Function that returns the output of produce() cached against the agent data fingerprint.
+    Returns a tuple of (data, source) where source is 'cache' or 'imcl'.
+    """
+
+    cache_file = os.path.join(os.path.expanduser(cache_dir), INVENTORY_CACHE)
+    fingerprint = agent_data_fingerprint(agent_data)
+
+    cache = read_json(cache_file, {})
+    entry = cache.get(key)
+    if fingerprint is not None and entry and entry.get('fingerprint') == fingerprint:
+        return entry['packages'], 'cache'
+
+    if offline:
+        if entry:
+            return entry['packages'], 'cache'
+        module.fail_json(
+            msg="IM agent data in {0} is not recognized and no cached inventory exists, "
+                "refusing to start imcl in check mode.".format(agent_data),
+            changed=False
+        )
+
+    data = produce()
+
+    if fingerprint is not None:
+        cache[key] = dict(
+            agent_data=agent_data,
+            fingerprint=fingerprint,
+            packages=data,
+            updated=time.time()
+        )
+        write_cache(cache_file, cache)
+
+    return data, 'imcl'
+
+
+def installed_inventory(module, imcl_path, agent_data=None, cache_dir=DEFAULT_CACHE_DIR, offline=False):
+    """Function that returns the installed package inventory for imcl_path.
+    The agent data is read natively first. Only when its format is not recognized
+    is imcl listInstalledPackages used, and its output is cached for as long as
+    the agent data fingerprint matches. With offline set (check mode), imcl is never
+    started and the last cached listing is used even if it is stale.
+    Returns a tuple of (packages, source) where source is 'agent_data', 'cache' or 'imcl'.
+    """
+
+    if agent_data is None:
+        agent_data = agent_data_location(imcl_path)
+
+    try:
+        offerings = read_agent_data(agent_data)
+    except AgentDataFormatError:
+        pass
+    else:
+        return [o['package'] for o in offerings], 'agent_data'
+
+    return _cached_listing(module, imcl_path, agent_data, cache_dir, offline, imcl_path,
+                           lambda: list_installed_packages(module, imcl_path))
+
+
+def installed_features(module, imcl_path, agent_data=None, cache_dir=DEFAULT_CACHE_DIR, offline=False):
+    """Function that returns the installed features of every offering for imcl_path.
+    Read natively from the agent data like installed_inventory, with a cached
+    imcl listInstalledPackages -features -long as fallback.
+    Returns a tuple of ({package: {location, features}}, source).
+    """
+
+    if agent_data is None:
+        agent_data = agent_data_location(imcl_path)
+
+    try:
+        offerings = read_agent_data(agent_data)
+    except AgentDataFormatError:
+        pass
+    else:
+        return dict((o['package'], dict(location=o['location'], features=o['features']))
+                    for o in offerings), 'agent_data'
+
+    return _cached_listing(module, imcl_path, agent_data, cache_dir, offline, imcl_path + ' -features',
+                           lambda: parse_installed_features(
+                               list_installed_packages(module, imcl_path, '-features -long')))
+
+
+def invalidate_inventory(imcl_path, cache_dir=DEFAULT_CACHE_DIR):
+    """Function that drops the cached inventory for imcl_path."""
+
+    cache_file = os.path.join(os.path.expanduser(cache_dir), INVENTORY_CACHE)
+    cache = read_json(cache_file, {})
+    if [cache.pop(key, None) for key in [imcl_path, imcl_path + ' -features']] != [None, None]:
+        write_cache(cache_file, cache)
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""Shared host-local queue in front of imcl invocations.
+
+Installation Manager takes a global lock on its agent data, so two imcl runs
+against the same agent data on one host make the second one fail. Every
+mutating imcl invocation of the installer modules goes through queued_run,
+which hands out a lease per agent data directory in strict arrival order,
+merges queued installs that only differ in their offerings into the lease
+holder's invocation, and reports how long a task waited versus ran.
+
+author: Tom Davison (@tntdavison784)
+"""
+
+import fcntl
+import hashlib
+import os
+import re
+import time
+
+from ansible.module_utils.ibm_json_file import read_json, write_json
+
+
+DEFAULT_QUEUE_DIR = '/tmp/ibm_imcl_queue'
+POLL_INTERVAL = 0.5
+LOCK_RETRIES = 5
+LOCK_RETRY_DELAY = 30
+LOCK_PATTERNS = [
+    r'[Aa]nother instance of .*(Installation Manager|imcl|IBM Installation)',
+    r'Installation Manager is (already )?running',
+    r'[Cc]ould not (acquire|obtain) .*lock',
+    r'is locked by another process',
+]
+
+
+def _pid_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def agent_data_key(agent_data):
+    """Function that returns the short key naming per agent data files, such as its queue directory."""
+
+    return hashlib.sha1(os.path.abspath(agent_data).encode('utf-8')).hexdigest()[:12]
+
+
+class ImclQueue(object):
+    """FIFO queue of imcl invocations for one IM agent data directory.
+    Every waiter drops a ticket file named by its arrival time. Only the oldest
+    live ticket may take the flock on the lease file, so access is granted in
+    arrival order and a crashed holder releases the lease with its process.
+    """
+
+    def __init__(self, queue_dir, agent_data):
+        self.queue_dir = os.path.join(os.path.expanduser(queue_dir), agent_data_key(agent_data))
+        if not os.path.isdir(self.queue_dir):
+            try:
+                os.makedirs(self.queue_dir)
+            except OSError:
+                if not os.path.isdir(self.queue_dir):
+                    raise
+        self.lease_file = os.path.join(self.queue_dir, 'lease')
+        self.lease = None
+        self.ticket = None
+
+    def _tickets(self):
+        return sorted(name for name in os.listdir(self.queue_dir)
+                      if name.startswith('ticket-') and name.endswith('.json'))
+
+    def _path(self, ticket):
+        return os.path.join(self.queue_dir, ticket)
+
+    def _result_path(self, ticket):
+        return os.path.join(self.queue_dir, 'result-' + ticket[len('ticket-'):])
+
+    def enqueue(self, merge_key=None, packages=None):
+        self.ticket = 'ticket-{0:.6f}-{1}.json'.format(time.time(), os.getpid())
+        write_json(self._path(self.ticket), dict(
+            pid=os.getpid(), created=time.time(), merge_key=merge_key,
+            packages=list(packages or [])))
+
+    def dequeue(self):
+        if self.ticket is not None:
+            _remove(self._path(self.ticket))
+            self.ticket = None
+
+    def _live_tickets(self):
+        """Returns the ordered tickets, dropping those whose process died."""
+
+        live = []
+        for ticket in self._tickets():
+            data = read_json(self._path(ticket))
+            if data is None:
+                continue
+            if not _pid_running(data['pid']):
+                _remove(self._path(ticket))
+                continue
+            live.append((ticket, data))
+        return live
+
+    def wait_turn(self, timeout):
+        """Blocks until this ticket holds the lease, or another holder claimed it.
+        Returns None once the lease is held, or the result the claiming holder
+        left behind for this ticket.
+        """
+
+        deadline = time.time() + timeout
+        while True:
+            own = read_json(self._path(self.ticket))
+            if own is not None and own.get('claimed_by'):
+                result = read_json(self._result_path(self.ticket))
+                if result is not None:
+                    _remove(self._result_path(self.ticket))
+                    return result
+                if not _pid_running(own['claimed_by_pid']):
+                    # The holder died before reporting back, queue up again.
+                    own.pop('claimed_by')
+                    write_json(self._path(self.ticket), own)
+            else:
+                live = self._live_tickets()
+                if live and live[0][0] == self.ticket:
+                    self.lease = open(self.lease_file, 'a')
+                    try:
+                        fcntl.flock(self.lease, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        return None
+                    except (IOError, OSError):
+                        self.lease.close()
+                        self.lease = None
+
+            if time.time() > deadline:
+                raise QueueTimeout(
+                    "Timed out after {0}s waiting for the IM lock in {1}".format(timeout, self.queue_dir))
+            time.sleep(POLL_INTERVAL)
+
+    def claim(self, merge_key):
+        """Claims the waiting tickets that can share the holder's invocation.
+        Returns a list of (ticket, packages) that were claimed.
+        """
+
+        claimed = []
+        if merge_key is None:
+            return claimed
+        for ticket, data in self._live_tickets():
+            if ticket == self.ticket or data.get('claimed_by') or data.get('merge_key') != merge_key:
+                continue
+            data['claimed_by'] = self.ticket
+            data['claimed_by_pid'] = os.getpid()
+            write_json(self._path(ticket), data)
+            claimed.append((ticket, data['packages']))
+        return claimed
+
+    def report(self, ticket, result):
+        write_json(self._result_path(ticket), result)
+
+    def release(self):
+        if self.lease is not None:
+            fcntl.flock(self.lease, fcntl.LOCK_UN)
+            self.lease.close()
+            self.lease = None
+
+
+class QueueTimeout(Exception):
+    """Raised when a task waited longer than its timeout for the IM lock."""
+    pass
+
+
+def _lock_contention(*outputs):
+    """Function that tells whether imcl's stdout or stderr reports an IM lock held elsewhere."""
+
+    for output in outputs:
+        if isinstance(output, bytes):
+            output = output.decode('utf-8', 'replace')
+        if re.search('|'.join(LOCK_PATTERNS), output or '') is not None:
+            return True
+    return False
+
+
+def queued_run(run, agent_data, queue_dir=DEFAULT_QUEUE_DIR, merge_key=None, packages=None, timeout=7200):
+    """Function that runs an imcl invocation through the host-local queue.
+    run(packages) starts imcl and returns (rc, output, error). Waiting installs
+    with the same merge_key are merged into the lease holder's packages and
+    receive its result without starting imcl themselves. Should imcl still hit an
+    IM lock held outside the queue, the run is retried while the lease is kept.
+    Returns (rc, output, error, queue) where queue reports wait_time, run_time
+    and which tickets were merged.
+    """
+
+    queue = ImclQueue(queue_dir, agent_data)
+    packages = list(packages or [])
+    stats = dict(wait_time=0.0, run_time=0.0, merged=[], served_by=None, lock_retries=0)
+    started = time.time()
+
+    queue.enqueue(merge_key, packages)
+    try:
+        try:
+            result = queue.wait_turn(timeout)
+        except QueueTimeout as e:
+            stats['wait_time'] = round(time.time() - started, 1)
+            return 1, '', str(e), stats
+        stats['wait_time'] = round(time.time() - started, 1)
+        if result is not None:
+            stats['run_time'] = result['run_time']
+            stats['served_by'] = result['served_by']
+            stats['merged'] = result['packages']
+            return result['rc'], result['output'], result['error'], stats
+
+        claimed = queue.claim(merge_key)
+        merged = list(packages)
+        for ticket, ticket_packages in claimed:
+            merged.extend([p for p in ticket_packages if p not in merged])
+        stats['merged'] = merged if claimed else []
+
+        run_started = time.time()
+        try:
+            while True:
+                rc, output, error = run(merged)
+                if rc == 0 or not _lock_contention(output, error) or stats['lock_retries'] >= LOCK_RETRIES:
+                    break
+                stats['lock_retries'] += 1
+                time.sleep(LOCK_RETRY_DELAY)
+        except Exception as e:
+            rc, output, error = 1, '', str(e)
+        stats['run_time'] = round(time.time() - run_started, 1)
+
+        for ticket, ticket_packages in claimed:
+            queue.report(ticket, dict(rc=rc, output=output, error=error, run_time=stats['run_time'],
+                                      served_by=queue.ticket, packages=merged))
+        return rc, output, error, stats
+    finally:
+        queue.release()
+        queue.dequeue()
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""Shared helpers for mirroring IBM IM repositories to a host-local directory.
+
+Every host installing from a remote repository downloads the same gigabytes
+on every run. mirror_repository keeps a local copy of a repository (HTTP(S)
+or a directory, e.g. an NFS share) up to date instead: only artifacts that are
+missing or changed since the last sync are fetched, several at a time, partial
+downloads are resumed, and every artifact with a known SHA-256 is verified
+against it before it replaces the local copy. An HTTP repository with a
+SHA256SUMS is mirrored as that file lists it; one without it is crawled from its
+index pages, and its artifacts can not be verified and are reported as
+unverified. imcl is then pointed at the local mirror.
+
+author: Tom Davison (@tntdavison784)
+"""
+
+import fcntl
+import os
+import re
+import time
+from multiprocessing.pool import ThreadPool
+
+try:
+    from urllib.parse import quote, unquote, urljoin
+except ImportError:
+    from urllib import quote, unquote
+    from urlparse import urljoin
+
+from ansible.module_utils.ibm_im_repo import is_remote
+from ansible.module_utils.ibm_json_file import read_json, write_json
+from ansible.module_utils.ibm_kit_verify import parse_manifest, sha256_file
+from ansible.module_utils.urls import open_url
+
+
+MANIFEST = 'SHA256SUMS'
+MIRROR_STATE = '.ibm_imcl_mirror.json'
+MIRROR_LOCK = '.ibm_imcl_mirror.lock'
+PART_SUFFIX = '.part'
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_WORKERS = 4
+RETRIES = 2
+HREF = re.compile(r'href="([^"?#]+)"', re.I)
+
+
+class MirrorError(Exception):
+    """Raised when a repository could not be listed or an artifact not fetched."""
+    pass
+
+
+def mirror_path(mirror_dir, src):
+    """Function that returns the local directory src is mirrored to under mirror_dir."""
+
+    name = re.sub(r'[^A-Za-z0-9._-]+', '_', src.split('://')[-1].strip('/'))
+    return os.path.join(mirror_dir, name)
+
+
+def _list_local(src):
+    """Function that returns {relative path: {size, stamp, sha256}} for a directory repository."""
+
+    checksums = {}
+    if os.path.isfile(os.path.join(src, MANIFEST)):
+        with open(os.path.join(src, MANIFEST), 'rb') as f_obj:
+            checksums = parse_manifest(f_obj.read())
+
+    artifacts = {}
+    for root, dirs, files in os.walk(src):
+        for name in files:
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, src)
+            stat = os.stat(path)
+            artifacts[relative] = dict(size=stat.st_size, stamp=stat.st_mtime, sha256=checksums.get(relative))
+    return artifacts
+
+
+def _crawl(url, base, seen):
+    """Function that lists the files below url from the server's directory index pages."""
+
+    try:
+        page = open_url(url, timeout=30).read().decode('utf-8', 'replace')
+    except Exception as e:
+        raise MirrorError("Could not list {0}: {1}".format(url, e))
+
+    files = []
+    for href in HREF.findall(page):
+        target = urljoin(url, href)
+        if not target.startswith(base) or target == url or target in seen:
+            continue
+        seen.add(target)
+        if target.endswith('/'):
+            files.extend(_crawl(target, base, seen))
+        else:
+            files.append(unquote(target[len(base):]))
+    return files
+
+
+def _head(url):
+    """Function that returns the size and validator (ETag or Last-Modified) of a remote artifact."""
+
+    response = open_url(url, method='HEAD', timeout=30)
+    headers = response.info()
+    size = headers.get('Content-Length')
+    return dict(size=int(size) if size is not None else None,
+                stamp=headers.get('ETag') or headers.get('Last-Modified'))
+
+
+def _list_remote(src, workers):
+    """Function that returns {relative path: {size, stamp, sha256}} for an HTTP repository.
+    The artifacts come from the repository's SHA256SUMS manifest when it has one,
+    otherwise from the server's directory index pages. Sizes and validators are
+    fetched with parallel HEAD requests.
+    """
+
+    base = src.rstrip('/') + '/'
+    checksums = {}
+    try:
+        checksums = parse_manifest(open_url(base + MANIFEST, timeout=30).read())
+    except Exception:
+        pass
+
+    relatives = sorted(checksums) if checksums else _crawl(base, base, set())
+    pool = ThreadPool(workers)
+    try:
+        heads = pool.map(lambda relative: _head(base + quote(relative)), relatives)
+    except Exception as e:
+        raise MirrorError("Could not stat the artifacts of {0}: {1}".format(src, e))
+    finally:
+        pool.close()
+
+    artifacts = {}
+    for relative, head in zip(relatives, heads):
+        head['sha256'] = checksums.get(relative)
+        artifacts[relative] = head
+    return artifacts
+
+
+def _fetch(src, mirror, relative, artifact):
+    """Function that fetches one artifact into the mirror.
+    The download goes to a .part file first and resumes where an earlier,
+    interrupted download of it stopped. The complete file is checked against the
+    expected SHA-256 (from the manifest, or hashed from a directory source) and
+    only then renamed into place. A remote artifact without a manifest entry is
+    renamed into place as it arrived. Returns (bytes transferred, sha256, verified).
+    """
+
+    target = os.path.join(mirror, relative)
+    part = target + PART_SUFFIX
+    if not os.path.isdir(os.path.dirname(target)):
+        try:
+            os.makedirs(os.path.dirname(target))
+        except OSError:
+            if not os.path.isdir(os.path.dirname(target)):
+                raise
+
+    for attempt in range(RETRIES + 1):
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        if artifact['size'] is not None and offset > artifact['size']:
+            os.remove(part)
+            offset = 0
+
+        transferred = 0
+        if is_remote(src):
+            headers = {'Range': 'bytes={0}-'.format(offset)} if offset else {}
+            response = open_url(src.rstrip('/') + '/' + quote(relative), headers=headers, timeout=60)
+            if offset and response.getcode() != 206:
+                offset = 0
+            source = response
+        else:
+            source = open(os.path.join(src, relative), 'rb')
+            source.seek(offset)
+
+        try:
+            with open(part, 'ab' if offset else 'wb') as f_obj:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    f_obj.write(chunk)
+                    transferred += len(chunk)
+        finally:
+            source.close()
+
+        if artifact['size'] is not None and os.path.getsize(part) < artifact['size']:
+            # The connection dropped, resume from what arrived.
+            continue
+
+        expected = artifact['sha256']
+        if expected is None and not is_remote(src):
+            expected = sha256_file(os.path.join(src, relative))
+        sha256 = sha256_file(part)
+        if expected is None or sha256 == expected:
+            if artifact['stamp'] is not None and not is_remote(src):
+                os.utime(part, (artifact['stamp'], artifact['stamp']))
+            os.rename(part, target)
+            return transferred, sha256, expected is not None
+        os.remove(part)
+
+    raise MirrorError("No complete copy of {0} matching its checksum after {1} attempts".format(relative, RETRIES + 1))
+
+
+def _changed(mirror, relative, artifact, known):
+    """Function that tells if an artifact has to be fetched again."""
+
+    target = os.path.join(mirror, relative)
+    if known is None or not os.path.isfile(target):
+        return True
+    if artifact['sha256'] is not None:
+        return artifact['sha256'] != known.get('sha256')
+    if artifact['size'] is not None and artifact['size'] != os.path.getsize(target):
+        return True
+    return artifact['stamp'] is None or artifact['stamp'] != known.get('stamp')
+
+
+def mirror_repository(src, mirror, workers=DEFAULT_WORKERS, check_only=False):
+    """Function that brings the local mirror of repository src up to date.
+    Only missing and changed artifacts are fetched, workers at a time. Local files
+    that are gone from src are removed, so the mirror stays an exact copy.
+    With check_only set nothing is fetched or removed, and a remote src is not
+    contacted at all: the mirror is reported from its local state only.
+    Returns the sync statistics: fetched, removed and unchanged artifact counts,
+    the artifacts in the mirror that could not be verified against a SHA-256,
+    MB transferred, duration, MB/s and whether anything changed.
+    Tasks syncing the same mirror at the same time take turns.
+    """
+
+    if check_only and is_remote(src):
+        return _local_stats(src, mirror)
+    if check_only:
+        return _sync(src, mirror, workers, check_only)
+
+    if not os.path.isdir(mirror):
+        try:
+            os.makedirs(mirror)
+        except OSError:
+            if not os.path.isdir(mirror):
+                raise
+    with open(os.path.join(mirror, MIRROR_LOCK), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            return _sync(src, mirror, workers, check_only)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _local_stats(src, mirror):
+    """Function that reports a mirror from its local state, without listing src.
+    A mirror that was never synced will fetch everything; whether an existing one
+    is behind src is only known once src is listed, so it reports unchanged.
+    """
+
+    state = read_json(os.path.join(mirror, MIRROR_STATE), {})
+    return dict(src=src, mirror=mirror, fetched=None, removed=None, unchanged=len(state), changed=not state,
+                listed=False)
+
+
+def _sync(src, mirror, workers, check_only):
+    started = time.time()
+    artifacts = _list_remote(src, workers) if is_remote(src) else _list_local(src)
+    if not artifacts:
+        raise MirrorError("Repository {0} has no artifacts to mirror".format(src))
+
+    state = read_json(os.path.join(mirror, MIRROR_STATE), {})
+    fetch = sorted(relative for relative, artifact in artifacts.items()
+                   if _changed(mirror, relative, artifact, state.get(relative)))
+    remove = sorted(relative for relative in state if relative not in artifacts)
+
+    stats = dict(src=src, mirror=mirror, fetched=len(fetch), removed=len(remove),
+                 unchanged=len(artifacts) - len(fetch), changed=bool(fetch or remove))
+    if check_only:
+        return stats
+
+    def fetch_one(relative):
+        try:
+            return relative, _fetch(src, mirror, relative, artifacts[relative]), None
+        except Exception as e:
+            return relative, None, str(e)
+
+    pool = ThreadPool(workers)
+    try:
+        fetched = pool.map(fetch_one, fetch)
+    finally:
+        pool.close()
+
+    transferred = 0
+    errors = []
+    for relative, result, error in fetched:
+        if error is not None:
+            errors.append("{0}: {1}".format(relative, error))
+            continue
+        transferred += result[0]
+        state[relative] = dict(size=artifacts[relative]['size'], stamp=artifacts[relative]['stamp'],
+                               sha256=result[1], verified=result[2])
+
+    for relative in remove:
+        try:
+            os.remove(os.path.join(mirror, relative))
+        except OSError:
+            pass
+        state.pop(relative, None)
+    write_json(os.path.join(mirror, MIRROR_STATE), state)
+
+    if errors:
+        raise MirrorError("Failed to mirror {0}: {1}".format(src, '; '.join(errors)))
+
+    stats['unverified'] = sorted(relative for relative, known in state.items() if known.get('verified') is False)
+    duration = time.time() - started
+    stats['transferred_mb'] = round(transferred / 1024.0 / 1024.0, 1)
+    stats['duration'] = round(duration, 1)
+    stats['mb_per_second'] = round(stats['transferred_mb'] / duration, 1) if duration else None
+    return stats
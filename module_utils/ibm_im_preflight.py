@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Shared preflight checks run before imcl is started.
+
+An install or update that runs out of space in the installation directory,
+the shared resources directory or /tmp fails most of the way through, after
+the bulk of the run time is already spent. The helpers here compare the space
+an operation needs (from the offering sizes in the repository index) with a
+statvfs of every filesystem involved, so a doomed run is rejected before imcl
+starts, and report the shortfall per filesystem.
+
+author: Tom Davison (@tntdavison784)
+"""
+
+import os
+
+
+# Space needed on each target, as a share of the offering size recorded in the repository.
+# IM unpacks the payload into the installation directory, keeps a copy of it in the shared
+# resources directory for rollbacks and stages files in the temporary directory.
+SPACE_FACTORS = dict(dest=1.0, shared_resource=1.0, tmp=0.25)
+MB = 1024 * 1024
+
+
+def existing_parent(path):
+    """Function that returns path, or its nearest ancestor that exists."""
+
+    path = os.path.abspath(os.path.expanduser(path))
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return path
+
+
+def mount_point(path):
+    """Function that returns the mount point of the filesystem holding path."""
+
+    path = existing_parent(path)
+    device = os.stat(path).st_dev
+    while os.path.dirname(path) != path:
+        parent = os.path.dirname(path)
+        if os.stat(parent).st_dev != device:
+            break
+        path = parent
+    return path
+
+
+def free_bytes(path):
+    """Function that returns the bytes available to an unprivileged user on path's filesystem."""
+
+    stat = os.statvfs(existing_parent(path))
+    return stat.f_bavail * stat.f_frsize
+
+
+def space_report(requirements):
+    """Function that checks the free space of every filesystem in requirements.
+    requirements is a list of (label, path, bytes). Paths on the same filesystem
+    are added up, since they compete for the same free space.
+    Returns one dict per filesystem with its mount point, labels, required and
+    available MB and the shortfall in MB (0 when there is enough space).
+    """
+
+    filesystems = {}
+    for label, path, required in requirements:
+        device = os.stat(existing_parent(path)).st_dev
+        entry = filesystems.setdefault(device, dict(
+            filesystem=mount_point(path), targets=[], required=0, available=free_bytes(path)))
+        entry['targets'].append('{0} ({1})'.format(label, path))
+        entry['required'] += int(required)
+
+    report = []
+    for entry in sorted(filesystems.values(), key=lambda e: e['filesystem']):
+        entry['shortfall_mb'] = int(max(entry['required'] - entry['available'], 0) // MB)
+        entry['required_mb'] = int(entry.pop('required') // MB)
+        entry['available_mb'] = int(entry.pop('available') // MB)
+        report.append(entry)
+    return report
+
+
+def prerequisite_problems(imcl_path, writable):
+    """Function that returns what would make imcl fail right away.
+    Checks that imcl is executable and that every path in writable (or the
+    ancestor it will be created in) can be written to.
+    """
+
+    problems = []
+    if not os.access(imcl_path, os.X_OK):
+        problems.append("imcl {0} is missing or not executable".format(imcl_path))
+    for path in writable:
+        parent = existing_parent(path)
+        if not os.access(parent, os.W_OK):
+            problems.append("{0} is not writable (checked {1})".format(path, parent))
+    return problems
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""Shared helpers for pruning the IM agent data and shared resources directory.
+
+Installation Manager slows down as its agent data and the shared resources
+(IMShared) directory fill up with the payloads of superseded offering
+versions, kept for rollbacks, and with old logs. plan_prune sizes both trees
+with a parallel scandir walk and lists what can go without breaking IM:
+payloads of offering versions older than the installed one beyond the
+rollback retention asked for, logs past their retention and stale temporary
+files. Anything not recognized as one of those is left alone.
+
+author: Tom Davison (@tntdavison784)
+"""
+
+import os
+import re
+import shutil
+import time
+import xml.etree.ElementTree as ET
+from multiprocessing.pool import ThreadPool
+from ansible.module_utils.ibm_im_repo import version_key
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+DEFAULT_WORKERS = 8
+TMP_MIN_AGE = 3600
+MB = 1024 * 1024
+# IMShared keeps payloads in entries named <offering id>_<version>, e.g.
+# com.ibm.websphere.ND.v85_8.5.5011.20161206_1434
+VERSIONED = re.compile(r'^(?P<id>.+?)_(?P<version>\d+(\.\d+)+(_\d+)?)(\.\w+)?$')
+
+
+def _tree_bytes(path):
+    """Function that returns the bytes used by path, without following symlinks."""
+
+    try:
+        if not os.path.isdir(path) or os.path.islink(path):
+            return os.lstat(path).st_size
+    except OSError:
+        return 0
+
+    size = 0
+    if scandir is None:
+        for root, dirs, files in os.walk(path):
+            for name in files:
+                try:
+                    size += os.lstat(os.path.join(root, name)).st_size
+                except OSError:
+                    pass
+        return size
+
+    pending = [path]
+    while pending:
+        try:
+            entries = list(scandir(pending.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                else:
+                    size += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                pass
+    return size
+
+
+def sizes(paths, workers=DEFAULT_WORKERS):
+    """Function that returns {path: bytes} for every path, sized workers at a time."""
+
+    paths = list(paths)
+    if not paths:
+        return {}
+    pool = ThreadPool(min(workers, len(paths)))
+    try:
+        return dict(zip(paths, pool.map(_tree_bytes, paths)))
+    finally:
+        pool.close()
+
+
+def tree_size(path, workers=DEFAULT_WORKERS):
+    """Function that returns the bytes used by the tree path.
+    The entries right below path are sized in parallel, which is where trees
+    like IMShared spread their bulk.
+    """
+
+    try:
+        entries = [os.path.join(path, name) for name in os.listdir(path)]
+    except OSError:
+        return 0
+    return sum(sizes(entries, workers).values())
+
+
+def shared_resource_location(agent_data):
+    """Function that returns the shared resources directory recorded in installRegistry.xml, or None."""
+
+    try:
+        root = ET.parse(os.path.join(agent_data, 'installRegistry.xml')).getroot()
+    except (ET.ParseError, IOError, OSError):
+        return None
+    for prop in root.iter('property'):
+        if prop.get('name') == 'cacheLocation' and prop.get('value'):
+            return prop.get('value')
+    return None
+
+
+def _entries(path):
+    try:
+        return [os.path.join(path, name) for name in sorted(os.listdir(path))]
+    except OSError:
+        return []
+
+
+def _rollback_payloads(shared_resource, offerings, rollback_keep):
+    """Function that returns (path, reason) for the payloads in shared_resource that may go.
+    Per offering the installed version, anything newer and the rollback_keep
+    newest older versions are kept. Entries of offerings that are not installed
+    at all, or whose name is not <offering id>_<version>, are never touched.
+    """
+
+    installed = {}
+    for offering in offerings:
+        installed.setdefault(offering['id'], []).append(offering['version'])
+
+    found = {}
+    for parent in [shared_resource] + [p for p in _entries(shared_resource) if os.path.isdir(p)]:
+        for path in _entries(parent):
+            match = VERSIONED.match(os.path.basename(path))
+            if match is None or match.group('id') not in installed:
+                continue
+            found.setdefault(match.group('id'), {}).setdefault(match.group('version'), []).append(path)
+
+    candidates = []
+    for offering_id, versions in found.items():
+        oldest_installed = min(version_key(v) for v in installed[offering_id])
+        older = sorted((v for v in versions if version_key(v) < oldest_installed), key=version_key, reverse=True)
+        for version in older[rollback_keep:]:
+            reason = "rollback payload of {0} {1}, beyond the {2} kept".format(offering_id, version, rollback_keep)
+            candidates.extend((path, reason) for path in versions[version])
+    return candidates
+
+
+def _aged(path, max_age, now, reason):
+    aged = []
+    for entry in _entries(path):
+        try:
+            if now - os.lstat(entry).st_mtime > max_age:
+                aged.append((entry, reason))
+        except OSError:
+            pass
+    return aged
+
+
+def plan_prune(agent_data, shared_resource, offerings, rollback_keep=1, log_days=30, workers=DEFAULT_WORKERS,
+               prune_shared=False):
+    """Function that works out what can be pruned from the agent data and shared resources.
+    offerings are the installed offerings as read_agent_data returns them.
+    Rollback payloads in shared_resource are only candidates with prune_shared,
+    as IM is not told they are gone; the tree is sized either way.
+    Returns (candidates, usage): candidates is a list of dicts with path, kind
+    (rollback, log or tmp), reason and bytes; usage is {label: bytes} for the
+    agent data and shared resources trees.
+    """
+
+    now = time.time()
+    found = []
+    if shared_resource is not None and prune_shared:
+        found.extend(('rollback', path, reason)
+                     for path, reason in _rollback_payloads(shared_resource, offerings, rollback_keep))
+    found.extend(('log', path, reason) for path, reason in
+                 _aged(os.path.join(agent_data, 'logs'), log_days * 86400, now,
+                       "log older than {0} days".format(log_days)))
+    found.extend(('tmp', path, reason) for path, reason in
+                 _aged(os.path.join(agent_data, 'tmp'), TMP_MIN_AGE, now, "stale temporary file"))
+
+    measured = sizes([path for kind, path, reason in found], workers)
+    candidates = [dict(path=path, kind=kind, reason=reason, bytes=measured[path])
+                  for kind, path, reason in found]
+
+    usage = dict(agent_data=tree_size(agent_data, workers))
+    if shared_resource is not None:
+        usage['shared_resource'] = tree_size(shared_resource, workers)
+    return candidates, usage
+
+
+def _remove(path):
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except (IOError, OSError) as e:
+        return "{0}: {1}".format(path, e)
+    return None
+
+
+def prune(candidates, workers=DEFAULT_WORKERS):
+    """Function that removes the candidates plan_prune returned, workers at a time.
+    Returns (removed paths, errors).
+    """
+
+    if not candidates:
+        return [], []
+    pool = ThreadPool(min(workers, len(candidates)))
+    try:
+        errors = pool.map(_remove, [candidate['path'] for candidate in candidates])
+    finally:
+        pool.close()
+    removed = [candidate['path'] for candidate, error in zip(candidates, errors) if error is None]
+    return removed, [error for error in errors if error is not None]
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""Shared helpers for indexing IBM Installation Manager repositories.
+
+An IM repository (a directory, a zipped repository or an HTTP location) carries
+its metadata in repository.config, repository.xml and the Offerings/ directory.
+The helpers here build an index of the offerings it holds (ids, and per id the
+versions oldest to newest with their sizes) without starting imcl, and cache that
+index keyed by a digest of the metadata so it is only rebuilt when the repository
+changes.
+
+author: Tom Davison (@tntdavison784)
+"""
+
+import difflib
+import hashlib
+import os
+import re
+import time
+import xml.etree.ElementTree as ET
+import zipfile
+
+from ansible.module_utils.ibm_json_file import read_json, write_cache
+from ansible.module_utils.urls import open_url
+
+
+REPOSITORY_CACHE = 'repositories.json'
+METADATA_FILES = ['repository.config', 'repository.xml']
+SIZE_ATTRIBUTES = ['size', 'installSize', 'downloadSize']
+OFFERING_JAR = re.compile(r'(?:^|/)Offerings/([^/_]+)_([^/]+)\.jar$')
+
+
+def is_remote(src):
+    """Function that tells if src is an HTTP(S) repository."""
+
+    return src.startswith('http://') or src.startswith('https://')
+
+
+def version_key(version):
+    """Function that turns an IM version (8.5.5012.20170627_1018) into a sortable key.
+    Numeric parts sort before text parts at the same position, so two keys always compare.
+    """
+
+    return [(0, int(part)) if part.isdigit() else (1, part) for part in re.split(r'[._-]', version)]
+
+
+def _read_local(src):
+    """Function that returns (metadata, offering jar names) for a directory repository."""
+
+    metadata = {}
+    for name in METADATA_FILES:
+        try:
+            with open(os.path.join(src, name), 'rb') as f_obj:
+                metadata[name] = f_obj.read()
+        except (IOError, OSError):
+            pass
+
+    try:
+        jars = ['Offerings/' + jar for jar in os.listdir(os.path.join(src, 'Offerings'))]
+    except OSError:
+        jars = []
+    return metadata, jars
+
+
+def _read_zip(src):
+    """Function that returns (metadata, offering jar names) for a zipped repository.
+    The repository root is the shallowest directory in the archive holding repository.config.
+    """
+
+    metadata = {}
+    with zipfile.ZipFile(src) as archive:
+        names = archive.namelist()
+        configs = sorted([n for n in names if n.split('/')[-1] == 'repository.config'],
+                         key=lambda n: n.count('/'))
+        if not configs:
+            return metadata, []
+        root = configs[0][:-len('repository.config')]
+        for name in METADATA_FILES:
+            if root + name in names:
+                metadata[name] = archive.read(root + name)
+        jars = [n[len(root):] for n in names if n.startswith(root) and OFFERING_JAR.search(n[len(root):])]
+    return metadata, jars
+
+
+def _read_remote(src):
+    """Function that returns (metadata, offering jar names) for an HTTP repository.
+    HTTP repositories can not be listed, so offerings only come from repository.xml.
+    """
+
+    metadata = {}
+    for name in METADATA_FILES:
+        try:
+            metadata[name] = open_url(src.rstrip('/') + '/' + name, timeout=30).read()
+        except Exception:
+            pass
+    return metadata, []
+
+
+def _metadata_digest(metadata, jars):
+    digest = hashlib.sha256()
+    for name in METADATA_FILES:
+        digest.update(name.encode('utf-8'))
+        digest.update(metadata.get(name, b''))
+    for jar in sorted(jars):
+        digest.update(jar.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _size(element):
+    for attribute in SIZE_ATTRIBUTES:
+        value = element.get(attribute)
+        if value and value.isdigit():
+            return int(value)
+    return None
+
+
+def _build_index(metadata, jars):
+    """Function that builds {offering id: [{version, size}, ...]} sorted oldest to newest.
+    Only the version order is kept, so the last entry is the newest fix pack;
+    which base a fix pack applies to is not recorded.
+    """
+
+    found = {}
+    if 'repository.xml' in metadata:
+        try:
+            root = ET.fromstring(metadata['repository.xml'])
+        except ET.ParseError:
+            root = None
+        if root is not None:
+            for element in root.iter():
+                if element.tag.split('}')[-1] != 'offering':
+                    continue
+                if element.get('id') and element.get('version'):
+                    found[(element.get('id'), element.get('version'))] = _size(element)
+
+    for jar in jars:
+        match = OFFERING_JAR.search(jar)
+        if match and match.groups() not in found:
+            found[match.groups()] = None
+
+    offerings = {}
+    for (offering_id, version), size in found.items():
+        offerings.setdefault(offering_id, []).append(dict(version=version, size=size))
+    for versions in offerings.values():
+        versions.sort(key=lambda v: version_key(v['version']))
+    return offerings
+
+
+def repository_index(src, cache_dir, offline=False):
+    """Function that returns the offering index of the repository at src.
+    The index is cached keyed by the digest of the repository metadata, so it is
+    only rebuilt when the repository changed. With offline set, the network is never
+    touched and the last cached index of a remote repository is returned as is.
+    Returns None when src holds no repository metadata we can read.
+    """
+
+    cache_file = os.path.join(os.path.expanduser(cache_dir), REPOSITORY_CACHE)
+    cache = read_json(cache_file, {})
+    entry = cache.get(src)
+
+    if is_remote(src) and offline:
+        return entry['index'] if entry else None
+
+    try:
+        if is_remote(src):
+            metadata, jars = _read_remote(src)
+        elif os.path.isfile(src) and zipfile.is_zipfile(src):
+            metadata, jars = _read_zip(src)
+        else:
+            metadata, jars = _read_local(src)
+    except (IOError, OSError, zipfile.BadZipfile):
+        return None
+
+    if 'repository.config' not in metadata:
+        return None
+
+    digest = _metadata_digest(metadata, jars)
+    if entry and entry.get('digest') == digest:
+        return entry['index']
+
+    index = dict(offerings=_build_index(metadata, jars))
+    cache[src] = dict(digest=digest, index=index, updated=time.time())
+    write_cache(cache_file, cache)
+    return index
+
+
+def repositories_index(src, cache_dir, offline=False):
+    """Function that returns the merged offering index of a comma separated list of repositories.
+    imcl accepts several repositories in -repositories (e.g. a base install and a fix pack),
+    and an offering may come from any of them. Repositories without readable metadata are
+    skipped. Returns None when none of them could be indexed.
+    """
+
+    merged = None
+    for repository in [r.strip() for r in src.split(',') if r.strip()]:
+        index = repository_index(repository, cache_dir, offline)
+        if index is None:
+            continue
+        if merged is None:
+            merged = dict(offerings={})
+        for offering_id, versions in index['offerings'].items():
+            known = merged['offerings'].setdefault(offering_id, [])
+            known.extend([v for v in versions if v['version'] not in [k['version'] for k in known]])
+            known.sort(key=lambda v: version_key(v['version']))
+    return merged
+
+
+def split_package(package):
+    """Function that splits <id>_<version> into (id, version); version is None for a bare id."""
+
+    offering_id, sep, version = package.partition('_')
+    return offering_id, version or None
+
+
+def resolve_offering(index, package):
+    """Function that resolves a requested offering against the index.
+    A bare offering id resolves to its latest version (the newest fix pack),
+    <id>_<version> resolves to itself. Returns None when the repository lacks it.
+    """
+
+    offering_id, version = split_package(package)
+    versions = index['offerings'].get(offering_id)
+    if not versions:
+        return None
+    if version is None:
+        return '{0}_{1}'.format(offering_id, versions[-1]['version'])
+    if version in [v['version'] for v in versions]:
+        return package
+    return None
+
+
+def offering_size(index, package):
+    """Function that returns the recorded size in bytes of an offering, or None.
+    A bare offering id is sized as the version resolve_offering picks for it.
+    """
+
+    resolved = resolve_offering(index, package)
+    if resolved is None:
+        return None
+    offering_id, version = split_package(resolved)
+    for entry in index['offerings'].get(offering_id, []):
+        if entry['version'] == version:
+            return entry['size']
+    return None
+
+
+def suggest_offerings(index, package):
+    """Function that returns close matches for a mistyped offering."""
+
+    available = []
+    for offering_id, versions in index['offerings'].items():
+        available.append(offering_id)
+        available.extend(['{0}_{1}'.format(offering_id, v['version']) for v in versions])
+    return difflib.get_close_matches(package, available, n=3)
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Shared helpers for filesystem snapshots of IBM installations.
+
+imcl rollback is as slow as the update it undoes and depends on IM having
+kept its rollback files. Before an update, the installer modules can instead
+snapshot the installation directory as a tree of reflinks (copy-on-write
+clones, where the filesystem supports them) or hardlinks, which costs next to
+no space for files the update leaves alone. The IM agent data is small and
+rewritten in place by imcl, so it is always copied (or reflinked), never
+hardlinked. Restoring a snapshot is a reflink clone or a copy of that tree and
+two renames; a hardlinked restore would tie the live tree to the snapshot again.
+
+author: Tom Davison (@tntdavison784)
+"""
+
+import errno
+import os
+import shutil
+import subprocess as sp
+import time
+
+from ansible.module_utils.ibm_json_file import read_json, write_json
+
+
+SNAPSHOT_META = 'snapshot.json'
+SNAPSHOT_DIR = '.ibm_imcl_snapshots'
+
+
+def default_snapshot_dir(dest):
+    """Function that returns the default snapshot directory for dest.
+    It sits next to dest, so it is on the same filesystem and hardlinks work.
+    """
+
+    return os.path.join(os.path.dirname(os.path.normpath(dest)), SNAPSHOT_DIR)
+
+
+def _reflink_tree(src, dst):
+    """Function that clones src to dst with copy-on-write reflinks.
+    Returns False when the filesystem or cp does not support reflinks.
+    """
+
+    with open(os.devnull, 'w') as devnull:
+        rc = sp.call(['cp', '-a', '--reflink=always', src, dst], stdout=devnull, stderr=devnull)
+    if rc != 0:
+        shutil.rmtree(dst, ignore_errors=True)
+        return False
+    return True
+
+
+def _link_tree(src, dst):
+    """Function that rebuilds src under dst with hardlinked files.
+    Files are copied instead when dst is on another filesystem.
+    Returns 'hardlink' or 'copy', whichever was needed for the last file.
+    """
+
+    method = 'hardlink'
+    for root, dirs, files in os.walk(src):
+        target = os.path.join(dst, os.path.relpath(root, src))
+        if not os.path.isdir(target):
+            os.makedirs(target)
+        shutil.copystat(root, target)
+
+        for name in dirs:
+            source = os.path.join(root, name)
+            if os.path.islink(source):
+                os.symlink(os.readlink(source), os.path.join(target, name))
+
+        for name in files:
+            source = os.path.join(root, name)
+            if os.path.islink(source):
+                os.symlink(os.readlink(source), os.path.join(target, name))
+                continue
+            if method == 'hardlink':
+                try:
+                    os.link(source, os.path.join(target, name))
+                    continue
+                except OSError as e:
+                    if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                        raise
+                    method = 'copy'
+            shutil.copy2(source, os.path.join(target, name))
+    return method
+
+
+def clone_tree(src, dst, hardlink=True):
+    """Function that clones the tree src to dst as cheaply as the filesystem allows.
+    Without hardlink, files are reflinked or copied, so no file of dst shares
+    an inode with src. Returns the method used: 'reflink', 'hardlink' or 'copy'.
+    """
+
+    if _reflink_tree(src, dst):
+        return 'reflink'
+    if hardlink:
+        return _link_tree(src, dst)
+    shutil.copytree(src, dst, symlinks=True)
+    return 'copy'
+
+
+def list_snapshots(snapshot_dir, source=None):
+    """Function that returns the snapshots in snapshot_dir, oldest first.
+    With source set, only the snapshots whose first tree is source are returned.
+    """
+
+    snapshots = []
+    try:
+        names = os.listdir(snapshot_dir)
+    except OSError:
+        return snapshots
+
+    for name in names:
+        snapshot = read_json(os.path.join(snapshot_dir, name, SNAPSHOT_META))
+        if snapshot is None:
+            continue
+        if source is None or snapshot['trees'][0]['source'] == os.path.normpath(source):
+            snapshots.append(snapshot)
+    return sorted(snapshots, key=lambda s: s['created'])
+
+
+def create_snapshot(snapshot_dir, sources, label=None, copied=()):
+    """Function that snapshots every directory in sources into snapshot_dir.
+    The sources in copied are never hardlinked, for directories whose files
+    are rewritten in place. Returns the snapshot metadata: id, created, label,
+    the method used per source and the time it took.
+    """
+
+    started = time.time()
+    snapshot_id = time.strftime('%Y%m%d%H%M%S', time.localtime(started))
+    path = os.path.join(snapshot_dir, snapshot_id)
+    suffix = 1
+    while os.path.exists(path):
+        suffix += 1
+        path = os.path.join(snapshot_dir, '{0}-{1}'.format(snapshot_id, suffix))
+    os.makedirs(path)
+
+    copied = [os.path.normpath(source) for source in copied]
+    trees = []
+    try:
+        for number, source in enumerate(sources):
+            source = os.path.normpath(source)
+            tree = os.path.join(path, 'tree{0}'.format(number))
+            trees.append(dict(source=source, tree=tree, method=clone_tree(source, tree, source not in copied)))
+    except (IOError, OSError, shutil.Error):
+        shutil.rmtree(path, ignore_errors=True)
+        raise
+
+    snapshot = dict(id=os.path.basename(path), path=path, created=started, label=label, trees=trees,
+                    duration=round(time.time() - started, 1))
+    write_json(os.path.join(path, SNAPSHOT_META), snapshot)
+    return snapshot
+
+
+def restore_snapshot(snapshot):
+    """Function that puts every source of a snapshot back the way it was.
+    The snapshot tree is reflinked or copied next to the source, never
+    hardlinked, and swapped in by rename, so the snapshot itself stays usable
+    and the live directory is only missing for the instant between the two renames.
+    Returns the time it took.
+    """
+
+    started = time.time()
+    for tree in snapshot['trees']:
+        source = tree['source']
+        staged = '{0}.restore-{1}'.format(source, os.getpid())
+        retired = '{0}.rolled-back-{1}'.format(source, os.getpid())
+        shutil.rmtree(staged, ignore_errors=True)
+        clone_tree(tree['tree'], staged, hardlink=False)
+
+        if os.path.exists(source):
+            os.rename(source, retired)
+        os.rename(staged, source)
+        shutil.rmtree(retired, ignore_errors=True)
+    return round(time.time() - started, 1)
+
+
+def prune_snapshots(snapshot_dir, keep, source=None):
+    """Function that evicts all but the newest keep snapshots of source.
+    Returns the ids of the evicted snapshots.
+    """
+
+    snapshots = list_snapshots(snapshot_dir, source)
+    evicted = snapshots[:max(len(snapshots) - keep, 0)]
+    for snapshot in evicted:
+        shutil.rmtree(snapshot['path'], ignore_errors=True)
+    return [snapshot['id'] for snapshot in evicted]
+
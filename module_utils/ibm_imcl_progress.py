@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""Shared helpers for running long imcl operations with live progress.
+
+imcl install/update runs take tens of minutes. Instead of blocking in
+module.run_command until imcl exits, run_imcl streams imcl's stdout (started
+with -showProgress) and its -log file as they are written, keeps a JSON status
+file up to date for async pollers, and aborts the run as soon as a known fatal
+pattern (disk full, unreachable repository, CRIM* error codes) shows up.
+
+author: Tom Davison (@tntdavison784)
+"""
+
+import os
+import re
+import select
+import signal
+import subprocess as sp
+import time
+
+from ansible.module_utils.ibm_json_file import write_cache
+
+
+FATAL_PATTERNS = [
+    r'CRIM[A-Z]?\d{4}E',
+    r'No space left on device',
+    r'[Nn]ot enough (disk )?space',
+    r'[Rr]epository .*(could not be|cannot be|is not) (found|reached|accessed|available)',
+    r'[Cc]annot connect to',
+    r'UnknownHostException',
+    r'ERROR: .*[Rr]epositor',
+]
+STATUS_INTERVAL = 1.0
+OUTPUT_TAIL = 200
+
+
+class ProgressParser(object):
+    """Parser for imcl -showProgress output.
+    imcl prints a percentage ruler, a dashed bar of the ruler's width and then
+    one dot per step of progress underneath it.
+    """
+
+    def __init__(self):
+        self.width = None
+        self.dots = 0
+        self.percent = 0
+
+    def feed(self, line):
+        stripped = line.strip()
+        if not stripped:
+            return self.percent
+        if self.width is None and set(stripped) <= set('-|') and len(stripped) > 10:
+            self.width = len(stripped)
+            return self.percent
+        if self.width and set(stripped) == set('.'):
+            self.dots += len(stripped)
+            self.percent = max(self.percent, min(100, self.dots * 100 // self.width))
+            return self.percent
+        found = re.findall(r'(\d{1,3})\s*%', stripped)
+        if len(found) == 1:
+            self.percent = max(self.percent, min(100, int(found[0])))
+        return self.percent
+
+    def partial(self, pending):
+        """Returns the percentage including the dots of a line still being printed."""
+
+        stripped = pending.strip()
+        if self.width and stripped and set(stripped) == set('.'):
+            return max(self.percent, min(100, (self.dots + len(stripped)) * 100 // self.width))
+        return self.percent
+
+
+def write_status(status_file, status):
+    """Function that atomically replaces the JSON status file."""
+
+    if status_file is None:
+        return
+    status['updated'] = time.time()
+    write_cache(status_file, status)
+
+
+class LogFollower(object):
+    """Follows the imcl -log file from where it ended before imcl started."""
+
+    def __init__(self, log_file):
+        self.log_file = log_file
+        self.pending = ''
+        try:
+            self.offset = os.path.getsize(log_file)
+        except OSError:
+            self.offset = 0
+
+    def read_lines(self):
+        if self.log_file is None:
+            return []
+        try:
+            size = os.path.getsize(self.log_file)
+        except OSError:
+            return []
+        if size < self.offset:
+            # imcl truncated the previous run's log
+            self.offset = 0
+        if size == self.offset:
+            return []
+        with open(self.log_file, 'rb') as f_obj:
+            f_obj.seek(self.offset)
+            data = f_obj.read(size - self.offset)
+        self.offset = size
+        data = self.pending + data.decode('utf-8', 'replace')
+        lines = data.split('\n')
+        self.pending = lines.pop()
+        return lines
+
+
+def _kill(child):
+    try:
+        os.killpg(child.pid, signal.SIGTERM)
+        time.sleep(2)
+        os.killpg(child.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def run_imcl(cmd, log_file=None, status_file=None, fail_patterns=None, operation=None):
+    """Function that runs an imcl command line while streaming its progress.
+    -showProgress is added to the command, stdout/stderr and the -log file are
+    read as they grow, and status_file is rewritten with the phase, percentage,
+    last output line and timings. When a fatal pattern shows up the whole imcl
+    process group is killed instead of waiting for a doomed run to finish.
+    Returns a tuple of (rc, output, error) where error is the fatal line or None.
+    """
+
+    if '-showProgress' not in cmd:
+        cmd = '{0} -showProgress'.format(cmd)
+
+    fatal = re.compile('|'.join(FATAL_PATTERNS + list(fail_patterns or [])))
+    parser = ProgressParser()
+    follower = LogFollower(log_file)
+    output = []
+    pending = ''
+    error = None
+
+    child = sp.Popen(cmd, shell=True, stdout=sp.PIPE, stderr=sp.STDOUT,
+                     preexec_fn=os.setsid)
+
+    status = dict(operation=operation, pid=child.pid, phase='running', percent=0,
+                  started=time.time(), log=log_file, last_line=None)
+    write_status(status_file, status)
+    last_write = time.time()
+    stdout_fd = child.stdout.fileno()
+    stdout_open = True
+
+    while stdout_open:
+        ready = select.select([stdout_fd], [], [], STATUS_INTERVAL)[0]
+        lines = []
+        if ready:
+            data = os.read(stdout_fd, 65536)
+            if not data:
+                stdout_open = False
+            data = pending + data.decode('utf-8', 'replace')
+            lines = data.split('\n')
+            pending = lines.pop() if stdout_open else ''
+            if not stdout_open and lines and not lines[-1]:
+                lines.pop()
+
+        for line in lines:
+            output.append(line)
+            parser.feed(line)
+            if line.strip() and set(line.strip()) != set('.'):
+                status['last_line'] = line.strip()
+
+        for line in lines + follower.read_lines():
+            if error is None and fatal.search(line):
+                error = line.strip()
+
+        del output[:-OUTPUT_TAIL]
+        status['percent'] = parser.partial(pending)
+
+        if error is not None:
+            status['phase'] = 'aborting'
+            status['error'] = error
+            write_status(status_file, status)
+            _kill(child)
+            break
+
+        if time.time() - last_write >= STATUS_INTERVAL:
+            write_status(status_file, status)
+            last_write = time.time()
+
+    rc = child.wait()
+
+    # Name the error imcl only wrote to its log right before failing.
+    if rc != 0:
+        for line in follower.read_lines() + [follower.pending]:
+            if error is None and fatal.search(line):
+                error = line.strip()
+
+    status['rc'] = rc
+    status['finished'] = time.time()
+    status['duration'] = round(status['finished'] - status['started'], 1)
+    if error is not None:
+        status['phase'] = 'aborted' if status['phase'] == 'aborting' else 'failed'
+        status['error'] = error
+    elif rc != 0:
+        status['phase'] = 'failed'
+    else:
+        status['phase'] = 'finished'
+        status['percent'] = 100
+    write_status(status_file, status)
+
+    return rc, '\n'.join(output), error
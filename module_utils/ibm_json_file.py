@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Shared helpers for the small JSON files the IBM modules keep state in.
+
+Caches, queue tickets, kit metadata, mirror state and status files are all
+read by other tasks on the same host while they are written. write_json
+therefore writes a file next to the target and renames it into place, so a
+reader sees either the old or the new content, never a partial one.
+
+author: Tom Davison (@tntdavison784)
+"""
+
+import json
+import os
+
+
+def read_json(json_file, default=None):
+    """Function that returns the content of a JSON file, or default when it is missing or unreadable."""
+
+    try:
+        with open(json_file, 'r') as f_obj:
+            return json.load(f_obj)
+    except (IOError, OSError, ValueError):
+        return default
+
+
+def write_json(json_file, data):
+    """Function that atomically replaces a JSON file, creating its directory when needed.
+    Raises IOError or OSError when it can not be written.
+    """
+
+    json_dir = os.path.dirname(json_file)
+    if json_dir and not os.path.isdir(json_dir):
+        try:
+            os.makedirs(json_dir)
+        except OSError:
+            if not os.path.isdir(json_dir):
+                raise
+    tmp_file = '{0}.{1}'.format(json_file, os.getpid())
+    with open(tmp_file, 'w') as f_obj:
+        json.dump(data, f_obj)
+    os.rename(tmp_file, json_file)
+
+
+def write_cache(json_file, data):
+    """Function that writes a JSON file like write_json, but ignores errors.
+    For caches and status files, which are only an optimisation, never fail a task over them.
+    """
+
+    try:
+        write_json(json_file, data)
+    except (IOError, OSError):
+        pass
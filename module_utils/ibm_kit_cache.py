@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""Shared content-addressed cache of extracted installation kits.
+
+The installer modules (ibm_im, ibmim, ibm_imcl, tx, webgate) need an extracted
+kit on disk. Rather than copying and unzipping multi-GB kits on every run,
+cached_kit extracts a zip or tar kit (or a WAS_ND_*_1of3.zip style set of
+parts, extracted in parallel) once per content hash and hands back the
+extracted directory. Entries are evicted least recently used first once the
+cache grows past its disk budget.
+
+author: Tom Davison (@tntdavison784)
+"""
+
+import fcntl
+import glob
+import hashlib
+import os
+import re
+import shutil
+import subprocess as sp
+import tarfile
+import time
+import zipfile
+from multiprocessing.pool import ThreadPool
+
+from ansible.module_utils.ibm_json_file import read_json, write_json
+from ansible.module_utils.ibm_kit_verify import cached_digest, read_digests, write_digests
+
+
+DEFAULT_KIT_CACHE_DIR = '~/.ansible/ibm_kits'
+DEFAULT_KIT_CACHE_MB = 20480
+DIGEST_CACHE = 'digests.json'
+# A kit used this recently may still be installed from by another task, it is not evicted.
+EVICT_GRACE = 6 * 3600
+MULTI_PART = re.compile(r'^(.*)_(\d+)of(\d+)(\.zip|\.tar|\.tar\.gz|\.tgz)$')
+
+
+class KitError(Exception):
+    """Raised when a kit is incomplete or can not be extracted."""
+    pass
+
+
+def kit_parts(kit):
+    """Function that returns every part of the kit kit belongs to.
+    WAS_ND_V8.5.5_1of3.zip style kits come in several parts that only work
+    together, so naming any one of them means the whole set. Fails when a part
+    of the set is missing.
+    """
+
+    kit = os.path.abspath(os.path.expanduser(kit))
+    match = MULTI_PART.match(os.path.basename(kit))
+    if match is None:
+        return [kit]
+
+    prefix, total, suffix = match.group(1), int(match.group(3)), match.group(4)
+    parts = [os.path.join(os.path.dirname(kit), '{0}_{1}of{2}{3}'.format(prefix, number, total, suffix))
+             for number in range(1, total + 1)]
+    missing = [part for part in parts if not os.path.isfile(part)]
+    if missing:
+        raise KitError("Kit {0} is missing part(s) {1}".format(kit, ', '.join(missing)))
+    return parts
+
+
+def _extract_zip(part, target):
+    """Function that extracts a zip, keeping the unix permissions of its entries."""
+
+    with zipfile.ZipFile(part) as archive:
+        for info in archive.infolist():
+            extracted = archive.extract(info, target)
+            mode = info.external_attr >> 16
+            if mode and not info.filename.endswith('/'):
+                os.chmod(extracted, mode & 0o7777)
+
+
+def _extract(part, target):
+    """Function that extracts one kit part into target.
+    unzip/tar are preferred since they run outside the GIL, so the parts of a
+    set really extract in parallel. The Python zipfile/tarfile modules are the fallback.
+    """
+
+    is_zip = part.endswith('.zip')
+    cmd = ['unzip', '-q', '-o', part, '-d', target] if is_zip else ['tar', '-xf', part, '-C', target]
+    try:
+        with open(os.devnull, 'w') as devnull:
+            if sp.call(cmd, stdout=devnull, stderr=devnull) == 0:
+                return
+    except OSError:
+        pass
+
+    try:
+        if is_zip:
+            _extract_zip(part, target)
+        else:
+            with tarfile.open(part) as archive:
+                archive.extractall(target)
+    except (IOError, OSError, zipfile.BadZipfile, tarfile.TarError) as e:
+        raise KitError("Failed to extract {0}: {1}".format(part, e))
+
+
+def _tree_size(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def kit_root(path):
+    """Function that descends into a kit that wraps everything in a single top directory."""
+
+    entries = os.listdir(path)
+    while len(entries) == 1 and os.path.isdir(os.path.join(path, entries[0])):
+        path = os.path.join(path, entries[0])
+        entries = os.listdir(path)
+    return path
+
+
+def find_in_kit(root, name):
+    """Function that returns the shallowest file called name below root, or None."""
+
+    found = None
+    for path, dirs, files in os.walk(root):
+        if name in files and (found is None or path.count(os.sep) < found.count(os.sep)):
+            found = os.path.join(path, name)
+        dirs.sort()
+    return found
+
+
+def _evict_entry(cache_dir, key, now):
+    """Function that removes one kit under its lock, unless another task holds the lock
+    or used the kit within EVICT_GRACE. Returns whether the kit was removed.
+    """
+
+    with open(os.path.join(cache_dir, key + '.lock'), 'a') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            return False
+        try:
+            meta = read_json(os.path.join(cache_dir, key + '.json'))
+            if meta is None or now - meta['last_used'] < EVICT_GRACE:
+                return False
+            os.remove(os.path.join(cache_dir, key + '.json'))
+            shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+            return True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def evict(cache_dir, budget_mb, keep=None):
+    """Function that evicts the least recently used kits until the cache fits budget_mb.
+    The kit keep is never evicted, and neither is a kit another task is extracting
+    or used within EVICT_GRACE, as it may still be installed from.
+    Returns the keys that were evicted.
+    """
+
+    entries = []
+    for meta_file in glob.glob(os.path.join(cache_dir, '*.json')):
+        if os.path.basename(meta_file) == DIGEST_CACHE:
+            continue
+        meta = read_json(meta_file)
+        if meta is not None:
+            entries.append(meta)
+
+    now = time.time()
+    used = sum(entry['size'] for entry in entries)
+    evicted = []
+    for entry in sorted(entries, key=lambda e: e['last_used']):
+        if used <= budget_mb * 1024 * 1024:
+            break
+        if entry['key'] == keep or now - entry['last_used'] < EVICT_GRACE:
+            continue
+        if _evict_entry(cache_dir, entry['key'], now):
+            used -= entry['size']
+            evicted.append(entry['key'])
+    return evicted
+
+
+def cached_kit(kit, cache_dir=DEFAULT_KIT_CACHE_DIR, budget_mb=DEFAULT_KIT_CACHE_MB, workers=4):
+    """Function that returns the extracted directory of a zip or tar kit.
+    The kit is identified by the SHA-256 of its parts (cached by size and mtime,
+    so an unchanged kit is not read again), and extracted only when no entry for
+    that hash exists yet; the parts of a multi-part kit are extracted in parallel.
+    Tasks extracting the same kit at the same time take turns.
+    Returns a tuple of (path, info) where info tells the key, whether it was a
+    cache hit, the extraction time and the evicted keys.
+    """
+
+    cache_dir = os.path.expanduser(cache_dir)
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            if not os.path.isdir(cache_dir):
+                raise
+
+    parts = kit_parts(kit)
+    digest_file = os.path.join(cache_dir, DIGEST_CACHE)
+    digests = read_digests(digest_file)
+    key = hashlib.sha256(''.join(cached_digest(part, digests)[0] for part in parts).encode('utf-8')).hexdigest()[:16]
+    write_digests(digest_file, digests)
+
+    extracted = os.path.join(cache_dir, key)
+    meta_file = extracted + '.json'
+    info = dict(key=key, kit=parts, hit=True, extract_time=0.0)
+
+    with open(extracted + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            meta = read_json(meta_file)
+            if meta is None or not os.path.isdir(extracted):
+                info['hit'] = False
+                started = time.time()
+                staging = '{0}.tmp-{1}'.format(extracted, os.getpid())
+                shutil.rmtree(staging, ignore_errors=True)
+                os.makedirs(staging)
+
+                pool = ThreadPool(min(workers, len(parts)))
+                try:
+                    errors = pool.map(lambda part: _try_extract(part, staging), parts)
+                finally:
+                    pool.close()
+                errors = [error for error in errors if error]
+                if errors:
+                    shutil.rmtree(staging, ignore_errors=True)
+                    raise KitError('; '.join(errors))
+
+                shutil.rmtree(extracted, ignore_errors=True)
+                os.rename(staging, extracted)
+                meta = dict(key=key, kit=parts, size=_tree_size(extracted), created=time.time())
+                info['extract_time'] = round(time.time() - started, 1)
+
+            meta['last_used'] = time.time()
+            write_json(meta_file, meta)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+    info['evicted'] = evict(cache_dir, budget_mb, keep=key)
+    return kit_root(extracted), info
+
+
+def _try_extract(part, target):
+    try:
+        _extract(part, target)
+    except KitError as e:
+        return str(e)
+    return None
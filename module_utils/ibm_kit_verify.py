@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""Shared SHA-256 verification of installation kits against a manifest.
+
+A truncated or corrupted kit only shows up as a cryptic installer failure
+long after the install started. verify_kit checks every file a manifest
+(sha256sum format) lists before the installer runs: files are hashed with
+large mmap'ed reads in a thread pool, and digests are cached by path, size
+and mtime, so verifying an unchanged kit again is instant.
+
+author: Tom Davison (@tntdavison784)
+"""
+
+import hashlib
+import mmap
+import os
+import time
+from multiprocessing.pool import ThreadPool
+
+from ansible.module_utils.ibm_json_file import read_json, write_cache
+
+
+CHUNK_SIZE = 16 * 1024 * 1024
+DEFAULT_WORKERS = 4
+
+
+def parse_manifest(data):
+    """Function that parses sha256sum output into {relative path: sha256}."""
+
+    if isinstance(data, bytes):
+        data = data.decode('utf-8', 'replace')
+    checksums = {}
+    for line in data.splitlines():
+        fields = line.strip().split(None, 1)
+        if len(fields) != 2 or line.lstrip().startswith('#'):
+            continue
+        relative = fields[1].lstrip('*')
+        if relative.startswith('./'):
+            relative = relative[2:]
+        checksums[relative] = fields[0].lower()
+    return checksums
+
+
+def sha256_file(path):
+    """Function that returns the SHA-256 of a file.
+    The file is mmap'ed and hashed in large slices, which hashlib does without
+    holding the GIL, so several files hash in parallel across threads.
+    """
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f_obj:
+        size = os.fstat(f_obj.fileno()).st_size
+        view = None
+        if size:
+            try:
+                mapped = mmap.mmap(f_obj.fileno(), 0, access=mmap.ACCESS_READ)
+            except (mmap.error, ValueError, OverflowError):
+                mapped = None
+            try:
+                view = memoryview(mapped) if mapped is not None else None
+            except TypeError:
+                # Python 2 can not take a memoryview of an mmap
+                mapped.close()
+
+        if view is None:
+            for chunk in iter(lambda: f_obj.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+            return digest.hexdigest()
+
+        try:
+            for offset in range(0, size, CHUNK_SIZE):
+                digest.update(view[offset:offset + CHUNK_SIZE])
+        finally:
+            del view
+            mapped.close()
+    return digest.hexdigest()
+
+
+def read_digests(digest_file):
+    """Function that reads the digest cache, {path: [size, mtime, sha256]}."""
+
+    return read_json(os.path.expanduser(digest_file), {})
+
+
+def write_digests(digest_file, digests):
+    """Function that atomically replaces the digest cache."""
+
+    write_cache(os.path.expanduser(digest_file), digests)
+
+
+def cached_digest(path, digests):
+    """Function that returns the SHA-256 of path, using and filling the digest cache.
+    Returns a tuple of (sha256, cached).
+    """
+
+    stat = os.stat(path)
+    known = digests.get(path)
+    if known and known[0] == stat.st_size and known[1] == stat.st_mtime:
+        return known[2], True
+    sha256 = sha256_file(path)
+    digests[path] = [stat.st_size, stat.st_mtime, sha256]
+    return sha256, False
+
+
+def verify_kit(manifest, digest_file, root=None, workers=DEFAULT_WORKERS):
+    """Function that verifies every file listed in a sha256sum manifest.
+    Paths in the manifest are relative to root, which defaults to the manifest's
+    directory. Files are hashed workers at a time, and unchanged files take their
+    digest from the cache in digest_file.
+    Returns a dict with the verified files, the failed ones (missing or not
+    matching), the files taken from the cache, MB hashed, duration and MB/s.
+    """
+
+    started = time.time()
+    with open(manifest, 'rb') as f_obj:
+        checksums = parse_manifest(f_obj.read())
+    if root is None:
+        root = os.path.dirname(os.path.abspath(manifest))
+
+    digests = read_digests(digest_file)
+
+    def check(relative):
+        path = os.path.join(root, relative)
+        if not os.path.isfile(path):
+            return relative, 'missing', False, 0
+        try:
+            sha256, cached = cached_digest(path, digests)
+        except (IOError, OSError) as e:
+            return relative, str(e), False, 0
+        size = 0 if cached else os.path.getsize(path)
+        if sha256 != checksums[relative]:
+            return relative, 'checksum mismatch (truncated or corrupted)', cached, size
+        return relative, None, cached, size
+
+    pool = ThreadPool(workers)
+    try:
+        checked = pool.map(check, sorted(checksums))
+    finally:
+        pool.close()
+    write_digests(digest_file, digests)
+
+    hashed = sum(size for relative, error, cached, size in checked)
+    duration = time.time() - started
+    report = dict(
+        manifest=manifest,
+        verified=len([c for c in checked if c[1] is None]),
+        failed=dict((relative, error) for relative, error, cached, size in checked if error is not None),
+        cached=len([c for c in checked if c[2]]),
+        hashed_mb=round(hashed / 1024.0 / 1024.0, 1),
+        duration=round(duration, 2)
+    )
+    report['mb_per_second'] = round(report['hashed_mb'] / duration, 1) if duration and hashed else None
+    return report
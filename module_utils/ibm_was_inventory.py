@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""Shared readers for what a WAS installation and its profiles hold on disk.
+
+versionInfo.sh, manageprofiles.sh -listProfiles and serverStatus.sh each start
+a JVM to report what a few XML files already say. The readers here parse
+those files directly: the *.product files for the installed products, the
+profileRegistry.xml for the profiles and every node's serverindex.xml for the
+servers and their ports. inventory walks a set of installation roots with
+them, in parallel, and keeps the result in a fact cache that is only trusted
+while the mtimes of everything it was read from are unchanged.
+
+author: Tom Davison (@tntdavison784)
+"""
+
+import glob
+import os
+import re
+import time
+import xml.etree.ElementTree as ET
+from multiprocessing.pool import ThreadPool
+
+from ansible.module_utils.ibm_json_file import read_json, write_json
+from ansible.module_utils.ibm_was_proc import process_table
+
+
+DEFAULT_ROOTS = ['/opt/IBM/WebSphere/AppServer', '/opt/WebSphere/AppServer', '/opt/WebSphere85/AppServer',
+                 '/opt/WebSphere/AppServer8.5.5', '/opt/IBM/ProcessServer', '/opt/IBM/HTTPServer',
+                 '/opt/IBM/WebSphere/Plugins']
+DEFAULT_FACT_CACHE = '~/.ansible/ibm_was_facts.json'
+DEFAULT_WORKERS = 8
+CACHE_VERSION = 1
+
+_REGISTRIES = {}
+
+
+def _parse(path, stamps):
+    """Function that parses an XML file and records its mtime in stamps. Returns the root or None."""
+
+    _stamp(path, stamps)
+    try:
+        return ET.parse(path).getroot()
+    except (ET.ParseError, IOError, OSError):
+        return None
+
+
+def _stamp(path, stamps):
+    try:
+        stamps[path] = os.stat(path).st_mtime
+    except OSError:
+        stamps[path] = None
+
+
+def read_products(was_root, stamps=None):
+    """Function that returns {product id: {name, version, build_level}} from properties/version/*.product."""
+
+    stamps = {} if stamps is None else stamps
+    version_dir = os.path.join(was_root, 'properties', 'version')
+    _stamp(version_dir, stamps)
+    products = {}
+    for product_file in sorted(glob.glob(os.path.join(version_dir, '*.product'))):
+        root = _parse(product_file, stamps)
+        if root is None:
+            continue
+        build = root.find('build-info')
+        product_id = root.findtext('id') or os.path.basename(product_file)[:-len('.product')]
+        products[product_id] = dict(name=root.get('name'), version=root.findtext('version'),
+                                    build_level=build.get('level') if build is not None else None)
+    return products
+
+
+class ProfileRegistryError(Exception):
+    """Raised when profileRegistry.xml exists but can not be read."""
+    pass
+
+
+def _registry_profiles(root):
+    profiles = {}
+    for profile in root.iter('profile'):
+        if profile.get('name'):
+            profiles[profile.get('name')] = dict(path=profile.get('path'), template=profile.get('template'),
+                                                 default=profile.get('isDefault') == 'true')
+    return profiles
+
+
+def read_profile_registry(was_root, stamps=None):
+    """Function that returns {profile: {path, template, default}} from properties/profileRegistry.xml."""
+
+    stamps = {} if stamps is None else stamps
+    root = _parse(os.path.join(was_root, 'properties', 'profileRegistry.xml'), stamps)
+    return _registry_profiles(root) if root is not None else {}
+
+
+def profile_registry(was_root):
+    """Function that returns the exact profiles of an installation as {profile: {path, template, default}}.
+    The registry is parsed again only when its mtime or size changed. An
+    installation without a profileRegistry.xml has no profiles yet; one that
+    can not be parsed raises ProfileRegistryError rather than reading as empty.
+    """
+
+    registry = os.path.join(was_root, 'properties', 'profileRegistry.xml')
+    try:
+        stat = os.stat(registry)
+    except OSError:
+        return {}
+    key = (stat.st_mtime, stat.st_size)
+    if _REGISTRIES.get(registry, (None,))[0] != key:
+        try:
+            _REGISTRIES[registry] = (key, _registry_profiles(ET.parse(registry).getroot()))
+        except (ET.ParseError, IOError, OSError) as e:
+            raise ProfileRegistryError("Could not read {0}: {1}".format(registry, e))
+    return _REGISTRIES[registry][1]
+
+
+def parse_list_profiles(output):
+    """Function that returns the profile names manageprofiles.sh -listProfiles printed, e.g. [Dmgr01, Custom01]."""
+
+    match = re.search(r'\[([^\]]*)\]', output or '')
+    if match is None:
+        return []
+    return [name.strip() for name in match.group(1).split(',') if name.strip()]
+
+
+def existing_profiles(module, was_root, source='registry'):
+    """Function that returns the names of the profiles of an installation.
+    source registry reads profileRegistry.xml, without a JVM; source
+    manageprofiles runs manageprofiles.sh -listProfiles.
+    """
+
+    if source == 'manageprofiles':
+        rc, out, err = module.run_command([os.path.join(was_root, 'bin', 'manageprofiles.sh'), '-listProfiles'])
+        if rc != 0:
+            module.fail_json(
+                msg="manageprofiles.sh -listProfiles failed in {0}".format(was_root),
+                changed=False,
+                stdout=out,
+                stderr=err
+            )
+        return parse_list_profiles(out)
+
+    try:
+        return sorted(profile_registry(was_root))
+    except ProfileRegistryError as e:
+        module.fail_json(
+            msg="{0}. Set existence_check to manageprofiles to list the profiles with manageprofiles.sh".format(e),
+            changed=False
+        )
+
+
+def setup_value(profile_path, name, stamps=None):
+    """Function that returns a WAS_CELL/WAS_NODE style value set in the profile's setupCmdLine.sh, or None."""
+
+    setup = os.path.join(profile_path, 'bin', 'setupCmdLine.sh')
+    if stamps is not None:
+        _stamp(setup, stamps)
+    try:
+        with open(setup, 'r') as f_obj:
+            for line in f_obj:
+                match = re.match(r'\s*(?:export\s+)?{0}=["\']?([^"\'\s]+)'.format(name), line)
+                if match:
+                    return match.group(1)
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def read_serverindex(serverindex, stamps=None):
+    """Function that returns {server: {type, ports}} from a node's serverindex.xml.
+    ports maps every endpoint name (BOOTSTRAP_ADDRESS, WC_defaulthost, ...) to its port.
+    """
+
+    stamps = {} if stamps is None else stamps
+    root = _parse(serverindex, stamps)
+    servers = {}
+    if root is None:
+        return servers
+    for entry in root.iter('serverEntries'):
+        ports = {}
+        for endpoint in entry.iter('specialEndpoints'):
+            address = endpoint.find('endPoint')
+            if address is not None and address.get('port'):
+                ports[endpoint.get('endPointName')] = int(address.get('port'))
+        servers[entry.get('serverName')] = dict(type=entry.get('serverType'), ports=ports)
+    return servers
+
+
+def read_profile(profile_path, stamps=None):
+    """Function that returns the cell, node and servers (with ports) of one profile.
+    The servers are those of the profile's own node, named in setupCmdLine.sh;
+    a dmgr profile also holds the configuration of every federated node.
+    """
+
+    stamps = {} if stamps is None else stamps
+    cell = setup_value(profile_path, 'WAS_CELL', stamps)
+    node = setup_value(profile_path, 'WAS_NODE', stamps)
+    nodes_dirs = glob.glob(os.path.join(profile_path, 'config', 'cells', cell or '*', 'nodes'))
+    for nodes_dir in nodes_dirs:
+        _stamp(nodes_dir, stamps)
+
+    servers = {}
+    for nodes_dir in nodes_dirs:
+        for node_dir in sorted(glob.glob(os.path.join(nodes_dir, node or '*'))):
+            for server, entry in read_serverindex(os.path.join(node_dir, 'serverindex.xml'), stamps).items():
+                entry['node'] = os.path.basename(node_dir)
+                servers[server] = entry
+    if cell is None and nodes_dirs:
+        cell = os.path.basename(os.path.dirname(nodes_dirs[0]))
+    return dict(cell=cell, node=node, servers=servers)
+
+
+def _read_root(was_root):
+    """Function that returns (facts, stamps) for the static parts of one installation root."""
+
+    stamps = {}
+    _stamp(was_root, stamps)
+    if stamps[was_root] is None:
+        return None, stamps
+    return dict(products=read_products(was_root, stamps), profiles=read_profile_registry(was_root, stamps)), stamps
+
+
+def _read_profile(profile_path):
+    stamps = {}
+    return read_profile(profile_path, stamps), stamps
+
+
+def _valid(cache, roots):
+    """Function that tells whether a cached inventory still matches the files it was read from."""
+
+    if cache is None or cache.get('version') != CACHE_VERSION or cache.get('roots') != roots:
+        return False
+    for path, mtime in cache['stamps'].items():
+        try:
+            current = os.stat(path).st_mtime
+        except OSError:
+            current = None
+        if current != mtime:
+            return False
+    return True
+
+
+def _scan(roots, workers):
+    """Function that reads every root, then every profile of every root, workers at a time."""
+
+    pool = ThreadPool(max(1, min(workers, len(roots))))
+    try:
+        read = pool.map(_read_root, roots)
+    finally:
+        pool.close()
+
+    stamps = {}
+    installs = {}
+    profile_paths = []
+    for root, (facts, root_stamps) in zip(roots, read):
+        stamps.update(root_stamps)
+        if facts is None:
+            continue
+        installs[root] = facts
+        profile_paths.extend(profile['path'] for profile in facts['profiles'].values() if profile['path'])
+
+    if profile_paths:
+        pool = ThreadPool(max(1, min(workers, len(profile_paths))))
+        try:
+            read = dict(zip(profile_paths, pool.map(_read_profile, profile_paths)))
+        finally:
+            pool.close()
+        for facts in installs.values():
+            for profile in facts['profiles'].values():
+                if profile['path'] in read:
+                    details, profile_stamps = read[profile['path']]
+                    profile.update(details)
+                    stamps.update(profile_stamps)
+    return installs, stamps
+
+
+def add_process_state(installs):
+    """Function that adds the live state and pid of every server from one /proc scan."""
+
+    table = process_table()
+    for facts in installs.values():
+        for profile in facts['profiles'].values():
+            for server, entry in profile.get('servers', {}).items():
+                if entry['type'] == 'WEB_SERVER':
+                    continue
+                check = table.check(os.path.join(profile['path'], 'logs', server, server + '.pid'),
+                                    profile['path'], server)
+                entry.update(state='STARTED' if check['running'] else 'STOPPED', pid=check['pid'],
+                             stale_pid=check['stale'])
+    return installs
+
+
+def inventory(roots=None, cache_file=DEFAULT_FACT_CACHE, use_cache=True, processes=True, workers=DEFAULT_WORKERS):
+    """Function that returns what the installation roots hold: products, profiles, servers and ports.
+    The static part is taken from cache_file while none of the files and
+    directories it was read from changed, and is read again (and the cache
+    rewritten) otherwise. With processes set, the live state of every server is
+    added from /proc. Roots that do not exist are left out.
+    Returns (installs, info) where info tells whether the cache was used and how long it took.
+    """
+
+    started = time.time()
+    roots = sorted(set(os.path.normpath(root) for root in (roots or DEFAULT_ROOTS)))
+    cache_file = os.path.expanduser(cache_file)
+    cache = read_json(cache_file) if use_cache else None
+
+    if _valid(cache, roots):
+        installs = cache['installs']
+        info = dict(cache=cache_file, hit=True)
+    else:
+        installs, stamps = _scan(roots, workers)
+        info = dict(cache=cache_file, hit=False)
+        if use_cache:
+            write_json(cache_file, dict(version=CACHE_VERSION, roots=roots, stamps=stamps, installs=installs,
+                                        created=time.time()))
+
+    if processes:
+        add_process_state(installs)
+    info['duration'] = round(time.time() - started, 3)
+    return installs, info
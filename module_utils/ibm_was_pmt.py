@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""Shared helpers for running manageprofiles.sh -create for many profiles at once.
+
+Every manageprofiles.sh -create is a JVM of its own that runs for minutes, so
+building a cell one profile per task takes an hour. create_profiles runs the
+creates in a worker pool instead. The pool is sized by the memory available
+for one manageprofiles JVM per worker, and creates from the same
+profile template take turns on a per-template lock, which also holds against
+other tasks on the host. Every profile reports how long it waited for its
+template and how long its create took.
+
+Left to itself, manageprofiles probes for free ports and checks them against
+the existing profiles on every create. plan_ports works the ports out up front
+instead: it indexes the ports of every existing profile's serverindex.xml and
+the ports listening on the host, and hands every new profile its own block,
+written to a -portsFile. Concurrent creates then never race for a port. The
+blocks are recorded in ports_dir under a lock, and count as taken for other
+tasks on the host until release_ports is called once the creates finished
+(or the task that reserved them is gone).
+
+author: Tom Davison (@tntdavison784)
+"""
+
+import errno
+import fcntl
+import glob
+import hashlib
+import multiprocessing
+import os
+import subprocess as sp
+import time
+from multiprocessing.pool import ThreadPool
+
+from ansible.module_utils.ibm_json_file import read_json, write_json
+from ansible.module_utils.ibm_was_inventory import profile_registry, read_profile, read_serverindex
+from ansible.module_utils.ibm_was_server import available_mb
+
+
+DEFAULT_LOCK_DIR = '/tmp/ibm_pmt_locks'
+PMT_JVM_MB = 512
+POLL_INTERVAL = 1.0
+OUTPUT_TAIL = 4000
+DEFAULT_PORTS_DIR = '/tmp/ibm_pmt_ports'
+DEFAULT_STARTING_PORT = 20000
+DEFAULT_PORT_BLOCK = 20
+RESERVATIONS = 'reservations.json'
+RESERVATION_TTL = 6 * 3600
+MAX_PORT = 65535
+# The ports a WAS 8.5 profile of the shipped templates defines, used when no existing
+# profile of the same template tells them.
+TEMPLATE_PORTS = {
+    'management': ['WC_adminhost', 'WC_adminhost_secure', 'BOOTSTRAP_ADDRESS', 'SOAP_CONNECTOR_ADDRESS',
+                   'IPC_CONNECTOR_ADDRESS', 'SAS_SSL_SERVERAUTH_LISTENER_ADDRESS',
+                   'CSIV2_SSL_SERVERAUTH_LISTENER_ADDRESS', 'CSIV2_SSL_MUTUALAUTH_LISTENER_ADDRESS',
+                   'ORB_LISTENER_ADDRESS', 'CELL_DISCOVERY_ADDRESS', 'DCS_UNICAST_ADDRESS',
+                   'DataPowerMgr_inbound_secure', 'XDAGENT_PORT', 'OVERLAY_UDP_LISTENER_ADDRESS',
+                   'OVERLAY_TCP_LISTENER_ADDRESS', 'STATUS_LISTENER_ADDRESS'],
+    'managed': ['BOOTSTRAP_ADDRESS', 'SOAP_CONNECTOR_ADDRESS', 'IPC_CONNECTOR_ADDRESS',
+                'SAS_SSL_SERVERAUTH_LISTENER_ADDRESS', 'CSIV2_SSL_SERVERAUTH_LISTENER_ADDRESS',
+                'CSIV2_SSL_MUTUALAUTH_LISTENER_ADDRESS', 'ORB_LISTENER_ADDRESS', 'NODE_DISCOVERY_ADDRESS',
+                'NODE_IPV6_MULTICAST_DISCOVERY_ADDRESS', 'NODE_MULTICAST_DISCOVERY_ADDRESS', 'DCS_UNICAST_ADDRESS',
+                'XDAGENT_PORT', 'OVERLAY_UDP_LISTENER_ADDRESS', 'OVERLAY_TCP_LISTENER_ADDRESS'],
+}
+
+
+def pmt_workers(jobs, jvm_mb=PMT_JVM_MB, max_workers=None):
+    """Function that returns how many creates may run at the same time.
+    That is as many manageprofiles JVMs of jvm_mb as the available memory holds
+    (the CPU count when it is unknown), never more than max_workers.
+    """
+
+    memory = available_mb()
+    limit = memory // max(jvm_mb, 1) if memory is not None else multiprocessing.cpu_count()
+    if max_workers:
+        limit = min(limit, max_workers)
+    return max(1, min(limit, jobs))
+
+
+class TemplateLock(object):
+    """Lock on a profile template path, held by at most slots creates at a time.
+    Every slot is a flock on its own file below lock_dir, so the lock holds
+    across threads and across tasks, and is released when its holder exits.
+    """
+
+    def __init__(self, template, lock_dir=DEFAULT_LOCK_DIR, slots=1):
+        key = hashlib.sha1(os.path.normpath(template).encode('utf-8')).hexdigest()[:12]
+        self.lock_files = [os.path.join(lock_dir, '{0}.{1}.lock'.format(key, slot)) for slot in range(max(slots, 1))]
+        self.held = None
+        if not os.path.isdir(lock_dir):
+            try:
+                os.makedirs(lock_dir)
+            except OSError:
+                if not os.path.isdir(lock_dir):
+                    raise
+
+    def __enter__(self):
+        while True:
+            for lock_file in self.lock_files:
+                lock = open(lock_file, 'a')
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except (IOError, OSError):
+                    lock.close()
+                    continue
+                self.held = lock
+                return self
+            time.sleep(POLL_INTERVAL)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        fcntl.flock(self.held, fcntl.LOCK_UN)
+        self.held.close()
+        self.held = None
+
+
+def _create(job):
+    """Function that runs one manageprofiles.sh -create under its template lock and times it.
+    Any error taking the lock or starting the create fails this job only.
+    """
+
+    name, cmd, template, lock_dir, slots = job
+    queued = started = time.time()
+    try:
+        with TemplateLock(template, lock_dir, slots):
+            started = time.time()
+            child = sp.Popen(cmd, stdout=sp.PIPE, stderr=sp.STDOUT)
+            output = child.communicate()[0]
+            rc = child.returncode
+    except Exception as e:
+        output, rc = "Could not run {0}: {1}".format(name, e), 1
+    if isinstance(output, bytes):
+        output = output.decode('utf-8', 'replace')
+
+    result = dict(profile=name, rc=rc, changed=rc == 0, status='created' if rc == 0 else 'failed',
+                  waited=round(started - queued, 1), duration=round(time.time() - started, 1))
+    if rc != 0:
+        result['output'] = output[-OUTPUT_TAIL:]
+    return result
+
+
+def create_profiles(jobs, jvm_mb=PMT_JVM_MB, max_workers=None, lock_dir=DEFAULT_LOCK_DIR, slots=1):
+    """Function that runs manageprofiles.sh -create for every job in a worker pool.
+    jobs is a list of (profile, command, template path). Returns (results, workers)
+    where results has per profile its status (created or failed), rc, the
+    seconds it waited for its template lock and the seconds its create took,
+    and the tail of the output of a failed create.
+    """
+
+    if not jobs:
+        return [], 0
+    workers = pmt_workers(len(jobs), jvm_mb, max_workers)
+    pool = ThreadPool(workers)
+    try:
+        results = pool.map(_create, [(name, cmd, template, lock_dir, slots) for name, cmd, template in jobs], 1)
+    finally:
+        pool.close()
+    return results, workers
+
+
+def listening_ports():
+    """Function that returns the TCP ports something listens on, from /proc/net/tcp and tcp6."""
+
+    ports = set()
+    for table in ['/proc/net/tcp', '/proc/net/tcp6']:
+        try:
+            with open(table, 'r') as f_obj:
+                next(f_obj)
+                for line in f_obj:
+                    fields = line.split()
+                    # st 0A is TCP_LISTEN
+                    if len(fields) > 3 and fields[3] == '0A':
+                        ports.add(int(fields[1].rpartition(':')[2], 16))
+        except (IOError, OSError, StopIteration, ValueError):
+            pass
+    return ports
+
+
+def used_ports(profiles):
+    """Function that returns every port the serverindex.xml of the profiles assigns, on any of their nodes."""
+
+    ports = set()
+    for profile in profiles.values():
+        if not profile.get('path'):
+            continue
+        for index in glob.glob(os.path.join(profile['path'], 'config', 'cells', '*', 'nodes', '*', 'serverindex.xml')):
+            for server in read_serverindex(index).values():
+                ports.update(server['ports'].values())
+    return ports
+
+
+def _template_key(template):
+    return os.path.normpath(template.rstrip('/'))
+
+
+def template_port_names(template, profiles):
+    """Function that returns the port names a profile created from template defines.
+    They are taken from an existing profile created from the same template, or
+    else from the shipped template of the same name. None when neither tells.
+    """
+
+    for profile in profiles.values():
+        if profile.get('template') and profile.get('path') and \
+                _template_key(profile['template']) == _template_key(template):
+            names = set()
+            for server in read_profile(profile['path'])['servers'].values():
+                names.update(server['ports'])
+            if names:
+                return sorted(names)
+    return TEMPLATE_PORTS.get(os.path.basename(_template_key(template)))
+
+
+def _free_block(start, size, block, taken):
+    while start + size - 1 <= MAX_PORT:
+        if not any(port in taken for port in range(start, start + size)):
+            return start
+        start += block
+    return None
+
+
+def _lock_reservations(ports_dir):
+    if not os.path.isdir(ports_dir):
+        try:
+            os.makedirs(ports_dir)
+        except OSError:
+            if not os.path.isdir(ports_dir):
+                raise
+    lock = open(os.path.join(ports_dir, '{0}.lock'.format(RESERVATIONS)), 'a')
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    return lock
+
+
+def _unlock_reservations(lock):
+    fcntl.flock(lock, fcntl.LOCK_UN)
+    lock.close()
+
+
+def _reservation_live(reservation, now):
+    """Function that tells whether the task that reserved a block may still be creating its profile."""
+
+    if now - reservation.get('reserved', 0) > RESERVATION_TTL:
+        return False
+    try:
+        os.kill(reservation['pid'], 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    except (KeyError, TypeError):
+        return False
+    return True
+
+
+def _plan_blocks(was_root, new_profiles, starting_port, block, reserved):
+    profiles = profile_registry(was_root)
+    taken = used_ports(profiles) | listening_ports() | reserved
+    plan = {}
+    start = starting_port
+    for name, template in new_profiles:
+        names = template_port_names(template, profiles)
+        size = max(len(names) if names else block, 1)
+        start = _free_block(start, size, max(block, size), taken)
+        if start is None:
+            raise ValueError("No free block of {0} ports left for profile {1} from port {2} on".format(
+                size, name, starting_port))
+        ports = dict((port_name, start + offset) for offset, port_name in enumerate(names)) if names else None
+        plan[name] = dict(start=start, ports=ports)
+        taken.update(range(start, start + size))
+        start += max(block, size)
+    return plan
+
+
+def plan_ports(was_root, new_profiles, starting_port=DEFAULT_STARTING_PORT, block=DEFAULT_PORT_BLOCK,
+               ports_dir=None):
+    """Function that hands every new profile a block of ports no existing profile or listener uses.
+    new_profiles is a list of (profile, template path). Blocks are block ports
+    apart from starting_port on, and a block is skipped as soon as one of its
+    ports is taken, so the same host state always yields the same plan.
+    With ports_dir, the blocks other tasks reserved there count as taken too, and
+    the planned blocks are reserved under the same lock until release_ports.
+    Returns {profile: {start, ports}} where ports maps the template's port names
+    to their ports, or is None when the names are unknown and only the start applies.
+    Raises ValueError when the port range runs out.
+    """
+
+    if ports_dir is None:
+        return _plan_blocks(was_root, new_profiles, starting_port, block, set())
+
+    reservations_file = os.path.join(ports_dir, RESERVATIONS)
+    lock = _lock_reservations(ports_dir)
+    try:
+        now = time.time()
+        planning = set(name for name, template in new_profiles)
+        reservations = dict((name, reservation) for name, reservation in read_json(reservations_file, {}).items()
+                            if name not in planning and _reservation_live(reservation, now))
+        reserved = set()
+        for reservation in reservations.values():
+            reserved.update(range(reservation['start'], reservation['end']))
+
+        plan = _plan_blocks(was_root, new_profiles, starting_port, block, reserved)
+        for name, planned in plan.items():
+            size = len(planned['ports']) if planned['ports'] else max(block, 1)
+            reservations[name] = dict(start=planned['start'], end=planned['start'] + size,
+                                      pid=os.getpid(), reserved=now)
+        write_json(reservations_file, reservations)
+        return plan
+    finally:
+        _unlock_reservations(lock)
+
+
+def release_ports(ports_dir, profiles):
+    """Function that drops the port blocks this task reserved for profiles, once their creates finished."""
+
+    reservations_file = os.path.join(ports_dir, RESERVATIONS)
+    lock = _lock_reservations(ports_dir)
+    try:
+        reservations = read_json(reservations_file, {})
+        mine = [name for name in profiles if reservations.get(name, {}).get('pid') == os.getpid()]
+        if mine:
+            for name in mine:
+                del reservations[name]
+            write_json(reservations_file, reservations)
+    finally:
+        _unlock_reservations(lock)
+
+
+def write_ports_file(ports_dir, profile, ports):
+    """Function that writes the -portsFile of a profile, one name=port per line. Returns its path."""
+
+    if not os.path.isdir(ports_dir):
+        try:
+            os.makedirs(ports_dir)
+        except OSError:
+            if not os.path.isdir(ports_dir):
+                raise
+    ports_file = os.path.join(ports_dir, '{0}.ports'.format(profile))
+    tmp_file = '{0}.{1}'.format(ports_file, os.getpid())
+    with open(tmp_file, 'w') as f_obj:
+        for name in sorted(ports, key=lambda port_name: ports[port_name]):
+            f_obj.write('{0}={1}\n'.format(name, ports[name]))
+    os.rename(tmp_file, ports_file)
+    return ports_file
+
+
+def port_args(plan, ports_dir, profile):
+    """Function that returns the manageprofiles.sh arguments applying the planned ports of a profile."""
+
+    if plan[profile]['ports'] is None:
+        return ['-startingPort', str(plan[profile]['start'])]
+    return ['-portsFile', write_ports_file(ports_dir, profile, plan[profile]['ports'])]
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""Shared process-state engine for the WAS and IHS control modules.
+
+A .pid file only tells that a process was started once: a JVM killed with
+kill -9, or a host that rebooted, leaves it behind, and a start task then
+skips a server that is not running. ProcessTable reads /proc once per module
+run and maps every WAS JVM to the profile, cell, node and server on its
+command line. check then cross-checks a pid file against that snapshot and
+tells whether the process really runs, whether the pid file is stale, and
+whether a running process has no (or another) pid in its pid file.
+
+author: Tom Davison (@tntdavison784)
+"""
+
+import glob
+import os
+
+
+PROC = '/proc'
+# Main class of a WAS JVM, followed by <profile>/config <cell> <node> <server>.
+WS_SERVER = 'com.ibm.ws.runtime.WsServer'
+
+_TABLE = None
+
+
+def _read(path, mode='r'):
+    try:
+        with open(path, mode) as f_obj:
+            return f_obj.read()
+    except (IOError, OSError):
+        return None
+
+
+def read_pid(pid_file):
+    """Function that returns the pid recorded in pid_file, or None."""
+
+    content = _read(pid_file)
+    try:
+        return int(content.strip()) if content else None
+    except ValueError:
+        return None
+
+
+class ProcessTable(object):
+    """Snapshot of the processes in /proc, with the WAS JVMs among them by profile and server."""
+
+    def __init__(self, proc=PROC):
+        self.proc = proc
+        self.processes = {}
+        self.jvms = {}
+        self._boot_time = None
+
+        try:
+            entries = os.listdir(proc)
+        except OSError:
+            entries = []
+        for entry in entries:
+            if not entry.isdigit():
+                continue
+            cmdline = _read(os.path.join(proc, entry, 'cmdline'), 'rb')
+            if not cmdline:
+                # Kernel threads and processes that exited while scanning.
+                continue
+            args = cmdline.decode('utf-8', 'replace').rstrip('\0').split('\0')
+            self.processes[int(entry)] = args
+            jvm = self._was_jvm(int(entry), args)
+            if jvm is not None:
+                self.jvms[(jvm['profile_root'], jvm['server'])] = jvm
+
+    @staticmethod
+    def _was_jvm(pid, args):
+        """Function that returns the profile, cell, node and server of a WAS JVM command line, or None."""
+
+        if WS_SERVER not in args:
+            return None
+        position = args.index(WS_SERVER)
+        if len(args) < position + 5:
+            return None
+        config_root, cell, node, server = args[position + 1:position + 5]
+        return dict(pid=pid, profile_root=os.path.realpath(os.path.dirname(config_root.rstrip('/'))),
+                    cell=cell, node=node, server=server)
+
+    def boot_time(self):
+        """Function that returns when the host booted, as an epoch timestamp, or None."""
+
+        if self._boot_time is None:
+            for line in (_read(os.path.join(self.proc, 'stat')) or '').splitlines():
+                if line.startswith('btime '):
+                    self._boot_time = int(line.split()[1])
+        return self._boot_time
+
+    def started(self, pid):
+        """Function that returns when pid started, as an epoch timestamp, or None."""
+
+        stat = _read(os.path.join(self.proc, str(pid), 'stat'))
+        if stat is None or self.boot_time() is None:
+            return None
+        # The command name may hold spaces, the fields after it are fixed.
+        fields = stat.rpartition(')')[2].split()
+        return self.boot_time() + int(fields[19]) / float(os.sysconf('SC_CLK_TCK'))
+
+    def server_jvm(self, profile_root, server):
+        """Function that returns the JVM of server in the profile at profile_root, or None."""
+
+        return self.jvms.get((os.path.realpath(profile_root), server))
+
+    def profile_jvms(self, profile_root):
+        """Function that returns {server: jvm} for every running JVM of the profile at profile_root."""
+
+        profile_root = os.path.realpath(profile_root)
+        return dict((server, jvm) for (root, server), jvm in self.jvms.items() if root == profile_root)
+
+    def _matches(self, pid, server=None, command=None):
+        args = self.processes.get(pid)
+        if args is None:
+            return False
+        if server is not None:
+            return server in args
+        if command is not None:
+            return os.path.basename(args[0]) == command
+        return True
+
+    def check(self, pid_file, profile_root=None, server=None, command=None):
+        """Function that cross-checks pid_file against the running processes.
+        A WAS server (profile_root and server given) is looked up by its JVM
+        command line, so it is found even without a pid file; otherwise the
+        recorded pid has to be alive and, when command is given, run it.
+        Returns a dict: running, pid (of the running process), file_pid (as
+        recorded), stale (the pid file names a process that does not run) and
+        missing (the process runs but the pid file does not name it).
+        """
+
+        file_pid = read_pid(pid_file)
+        pid = None
+        if server is not None and profile_root is not None:
+            jvm = self.server_jvm(profile_root, server)
+            if jvm is not None:
+                pid = jvm['pid']
+        if pid is None and file_pid is not None and self._matches(file_pid, server, command):
+            pid = file_pid
+        return dict(running=pid is not None, pid=pid, pid_file=pid_file, file_pid=file_pid,
+                    stale=file_pid is not None and file_pid != pid,
+                    missing=pid is not None and file_pid != pid)
+
+    def check_profile(self, profile_root):
+        """Function that checks every pid file below <profile_root>/logs and every JVM of the profile.
+        Returns {server: check} for the servers that run or left a pid file behind.
+        """
+
+        servers = set(self.profile_jvms(profile_root))
+        for pid_file in glob.glob(os.path.join(profile_root, 'logs', '*', '*.pid')):
+            servers.add(os.path.basename(pid_file)[:-len('.pid')])
+        return dict((server, self.check(os.path.join(profile_root, 'logs', server, server + '.pid'),
+                                        profile_root, server))
+                    for server in servers)
+
+
+def process_table(refresh=False):
+    """Function that returns the ProcessTable of this module run, scanning /proc on first use."""
+
+    global _TABLE
+    if _TABLE is None or refresh:
+        _TABLE = ProcessTable()
+    return _TABLE
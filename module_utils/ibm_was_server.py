@@ -0,0 +1,521 @@
+# -*- coding: utf-8 -*-
+"""Shared helpers for starting and stopping WAS servers without waiting on them.
+
+startServer.sh and stopServer.sh take minutes per JVM, and a module blocking
+on each of them serializes a whole play. launch_detached starts the script in
+its own session, under a small watcher process that records the pid, phase,
+timestamps and exit code in a JSON status file, and returns right away. The
+module exits while the script keeps running; a later task reads the status
+file, or waits on it with wait_for.
+
+author: Tom Davison (@tntdavison784)
+"""
+
+import fcntl
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import subprocess as sp
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+from ansible.module_utils.ibm_json_file import read_json, write_json
+from ansible.module_utils.ibm_was_proc import process_table
+
+
+STATUS_FILE = 'ansible_server_status.json'
+POLL_INTERVAL = 1.0
+DEFAULT_JVM_MB = 1024
+SYSTEM_OUT = 'SystemOut.log'
+LAUNCH_CACHE = 'ansible_launch'
+READY_MARKER = r'WSVR0001I'
+# Error occurred during startup, and an application module failing to start
+STARTUP_ERRORS = [r'WSVR0009E', r'WSVR0040E']
+
+# Runs detached from the module: starts the command, records its pid, waits for it
+# and records how it ended. Kept self-contained, it runs outside the module's imports.
+WATCHER = '''
+import json, os, subprocess, sys, time
+
+cmd, status_file, output_file = sys.argv[1:4]
+status = json.loads(sys.argv[4])
+
+def write(status):
+    tmp_file = "%s.%d" % (status_file, os.getpid())
+    with open(tmp_file, "w") as f_obj:
+        json.dump(status, f_obj)
+    os.rename(tmp_file, status_file)
+
+status.update(watcher=os.getpid(), pgid=os.getpgrp())
+write(status)
+with open(output_file, "ab") as output:
+    try:
+        child = subprocess.Popen(cmd, shell=True, stdout=output, stderr=subprocess.STDOUT)
+    except OSError as e:
+        status.update(phase="failed", rc=127, finished=time.time(), error=str(e))
+        write(status)
+        sys.exit(1)
+    status.update(phase="running", pid=child.pid)
+    write(status)
+    rc = child.wait()
+status.update(phase="succeeded" if rc == 0 else "failed", rc=rc, finished=time.time())
+write(status)
+'''
+
+
+class LaunchError(Exception):
+    """Raised when WAS could not generate a launch script."""
+    pass
+
+
+def launch_config_files(was_root, profile_root, server):
+    """Function that returns the files whose content ends up in the launch script of server.
+    The JVM command line comes from the server's, node's and cell's configuration,
+    the profile's setupCmdLine.sh and SDK selection, and the WAS level installed.
+    """
+
+    patterns = [
+        os.path.join(profile_root, 'bin', 'setupCmdLine.sh'),
+        os.path.join(profile_root, 'properties', 'sdk', '*'),
+        os.path.join(profile_root, 'config', 'cells', '*', '*.xml'),
+        os.path.join(profile_root, 'config', 'cells', '*', 'nodes', '*', '*.xml'),
+        os.path.join(profile_root, 'config', 'cells', '*', 'nodes', '*', 'servers', server, '*.xml'),
+        os.path.join(was_root, 'properties', 'version', '*.product'),
+    ]
+    files = []
+    for pattern in patterns:
+        files.extend(glob.glob(pattern))
+    return sorted(files)
+
+
+def config_digest(files):
+    """Function that digests the path, size and mtime of every file in files."""
+
+    digest = hashlib.sha1()
+    for path in files:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        digest.update('{0}:{1}:{2};'.format(path, stat.st_size, stat.st_mtime).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def launch_script(start_cmd, profile_root, server, files):
+    """Function that returns a cached launch script for server, generating it when needed.
+    start_cmd is the WAS wrapper (startServer.sh <server>, startManager.sh or
+    startNode.sh). Its -script option writes the command line of the real JVM
+    to a script instead of starting it, which costs one launcher JVM. The script
+    is kept in <profile>/logs/ansible_launch and only regenerated when the
+    digest of files changed. Tasks generating the same script take turns.
+    Returns (script, info) where info tells the digest, whether the script was
+    regenerated and how long that took.
+    """
+
+    cache_dir = os.path.join(profile_root, 'logs', LAUNCH_CACHE)
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            if not os.path.isdir(cache_dir):
+                raise
+    script = os.path.join(cache_dir, 'start_{0}.sh'.format(server))
+    meta_file = os.path.join(cache_dir, 'start_{0}.json'.format(server))
+    digest = config_digest(files)
+    info = dict(script=script, digest=digest, regenerated=False, generate_time=0.0)
+
+    with open(os.path.join(cache_dir, 'start_{0}.lock'.format(server)), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            meta = read_status(meta_file)
+            if meta is not None and meta.get('digest') == digest and os.path.isfile(script):
+                return script, info
+
+            started = time.time()
+            staged = '{0}.{1}'.format(script, os.getpid())
+            child = sp.Popen('{0} -script {1} -background'.format(start_cmd, staged), shell=True,
+                             stdout=sp.PIPE, stderr=sp.STDOUT)
+            output = child.communicate()[0]
+            if child.returncode != 0 or not os.path.isfile(staged):
+                if os.path.exists(staged):
+                    os.remove(staged)
+                if isinstance(output, bytes):
+                    output = output.decode('utf-8', 'replace')
+                raise LaunchError('{0} -script failed with rc {1}: {2}'.format(start_cmd, child.returncode,
+                                                                               output.strip()))
+            os.chmod(staged, 0o755)
+            os.rename(staged, script)
+            write_json(meta_file, dict(digest=digest, created=time.time(), command=start_cmd))
+            info.update(regenerated=True, generate_time=round(time.time() - started, 1))
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return script, info
+
+
+def start_with_script(script, pid_file, output_file, timeout, poll_interval=POLL_INTERVAL):
+    """Function that starts a JVM straight from its launch script.
+    The script was generated with -background, so it returns once the JVM is
+    spawned. The start is done when the JVM writes a fresh pid file for a live
+    process. Returns (rc, error), error being None on success.
+    """
+
+    started = time.time()
+    if not os.path.isdir(os.path.dirname(output_file)):
+        try:
+            os.makedirs(os.path.dirname(output_file))
+        except OSError:
+            if not os.path.isdir(os.path.dirname(output_file)):
+                raise
+    with open(output_file, 'ab') as output:
+        child = sp.Popen(['/bin/sh', script], stdout=output, stderr=sp.STDOUT, preexec_fn=os.setsid)
+        rc = child.wait()
+    if rc != 0:
+        return rc, 'Launch script {0} failed with rc {1}, see {2}'.format(script, rc, output_file)
+
+    while time.time() - started < timeout:
+        try:
+            if os.stat(pid_file).st_mtime >= started - 1:
+                with open(pid_file, 'r') as f_obj:
+                    if _alive(int(f_obj.read().strip())):
+                        return 0, None
+        except (IOError, OSError, ValueError):
+            pass
+        time.sleep(poll_interval)
+    return 1, 'No live pid file {0} after {1}s, see {2}'.format(pid_file, timeout, output_file)
+
+
+def available_mb():
+    """Function that returns the memory available for new processes in MB, or None when unknown."""
+
+    meminfo = {}
+    try:
+        with open('/proc/meminfo', 'r') as f_obj:
+            for line in f_obj:
+                key, sep, value = line.partition(':')
+                meminfo[key] = int(value.split()[0]) // 1024
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+    if 'MemAvailable' in meminfo:
+        return meminfo['MemAvailable']
+    return meminfo.get('MemFree', 0) + meminfo.get('Cached', 0) + meminfo.get('Buffers', 0)
+
+
+def worker_limit(jobs, jvm_mb=DEFAULT_JVM_MB, max_workers=None):
+    """Function that returns how many server starts/stops may run at the same time.
+    Every start spins up a JVM that is CPU heavy while it initializes and needs
+    jvm_mb of memory, so the limit is the smaller of the CPU count and the
+    number of JVMs the available memory holds. max_workers overrides it.
+    """
+
+    if max_workers:
+        return max(1, min(max_workers, jobs))
+    limit = multiprocessing.cpu_count()
+    memory = available_mb()
+    if memory is not None:
+        limit = min(limit, memory // max(jvm_mb, 1))
+    return max(1, min(limit, jobs))
+
+
+def read_status(status_file):
+    """Function that returns the status recorded in status_file, or None."""
+
+    return read_json(status_file)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def launch_detached(cmd, status_file, output_file, action=None, extra=None):
+    """Function that starts cmd in its own session and returns without waiting for it.
+    The watcher keeps status_file up to date: phase (launching, running,
+    succeeded or failed), the watcher and script pids, launched/finished
+    timestamps and the exit code. Output goes to output_file. extra is stored
+    in the status as is.
+    Returns the initial status.
+    """
+
+    status = dict(action=action, command=cmd, output=output_file, phase='launching',
+                  launched=time.time(), finished=None, rc=None, pid=None)
+    status.update(extra or {})
+    write_json(status_file, status)
+
+    with open(os.devnull, 'r+') as devnull:
+        watcher = sp.Popen([sys.executable, '-c', WATCHER, cmd, status_file, output_file, json.dumps(status)],
+                           stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True,
+                           preexec_fn=os.setsid)
+    status.update(watcher=watcher.pid, pgid=watcher.pid)
+    return status
+
+
+def log_position(log_file):
+    """Function that returns where log_file ends now, as a dict of inode and offset."""
+
+    try:
+        stat = os.stat(log_file)
+    except OSError:
+        return dict(inode=None, offset=0)
+    return dict(inode=stat.st_ino, offset=stat.st_size)
+
+
+class LogFollower(object):
+    """Follows a WAS log such as SystemOut.log from a recorded position, across rotations.
+    WAS rotates by renaming SystemOut.log to SystemOut_<timestamp>.log and starting a
+    new one. The follower keeps reading the file it has open, so nothing written
+    before the rotation is lost, then carries on with the new SystemOut.log.
+    """
+
+    def __init__(self, log_file, position=None):
+        self.log_file = log_file
+        self.position = position or dict(inode=None, offset=0)
+        self.f_obj = None
+        self.pending = ''
+
+    def _open(self):
+        """Opens the file the recorded position belongs to, the live log or a rotated copy of it."""
+
+        base, ext = os.path.splitext(self.log_file)
+        candidates = [self.log_file] + sorted(glob.glob(base + '_*' + ext), reverse=True)
+        for candidate in candidates:
+            try:
+                if self.position['inode'] is not None and os.stat(candidate).st_ino == self.position['inode']:
+                    self.f_obj = open(candidate, 'rb')
+                    if os.fstat(self.f_obj.fileno()).st_size >= self.position['offset']:
+                        self.f_obj.seek(self.position['offset'])
+                    return
+            except (IOError, OSError):
+                continue
+        # A log that did not exist yet at launch, or whose rotated copy is gone, is read from the start.
+        try:
+            self.f_obj = open(self.log_file, 'rb')
+        except (IOError, OSError):
+            self.f_obj = None
+
+    def read_lines(self):
+        if self.f_obj is None:
+            self._open()
+            if self.f_obj is None:
+                return []
+
+        data = self.f_obj.read()
+        try:
+            rotated = os.stat(self.log_file).st_ino != os.fstat(self.f_obj.fileno()).st_ino
+        except OSError:
+            rotated = False
+        if rotated:
+            # Everything up to the rotation is read, switch to the new log.
+            data += self.f_obj.read()
+            self.f_obj.close()
+            self.position = dict(inode=None, offset=0)
+            self._open()
+
+        lines = (self.pending + data.decode('utf-8', 'replace')).split('\n')
+        self.pending = lines.pop()
+        return lines
+
+    def close(self):
+        if self.f_obj is not None:
+            self.f_obj.close()
+            self.f_obj = None
+
+
+def wait_ready(log_file, position, timeout, fail_patterns=None, abort=None, poll_interval=0.5):
+    """Function that follows log_file from position until the server is open for e-business.
+    Returns as soon as WSVR0001I shows up, or fails fast on a startup error code,
+    on a line matching fail_patterns, or when abort() returns an error message
+    (e.g. the start script failed). Returns a dict with ready, error (the
+    offending line or message), line (the ready line) and timed_out.
+    """
+
+    ready = re.compile(READY_MARKER)
+    fatal = re.compile('|'.join(STARTUP_ERRORS + list(fail_patterns or [])))
+    follower = LogFollower(log_file, position)
+    deadline = time.time() + timeout
+    try:
+        while True:
+            for line in follower.read_lines():
+                if fatal.search(line):
+                    return dict(ready=False, error=line.strip(), line=None, timed_out=False)
+                if ready.search(line):
+                    return dict(ready=True, error=None, line=line.strip(), timed_out=False)
+            error = abort() if abort is not None else None
+            if error:
+                return dict(ready=False, error=error, line=None, timed_out=False)
+            if time.time() >= deadline:
+                return dict(ready=False, error=None, line=None, timed_out=True)
+            time.sleep(poll_interval)
+    finally:
+        follower.close()
+
+
+def current_status(status_file):
+    """Function that reads status_file and tells when its watcher died without recording an end.
+    Such a launch gets phase 'lost'.
+    """
+
+    status = read_status(status_file)
+    if status is None or status['phase'] not in ['launching', 'running']:
+        return status
+    if status.get('watcher') and not _alive(status['watcher']):
+        # The watcher may have just finished, read once more before calling it lost.
+        status = read_status(status_file)
+        if status['phase'] in ['launching', 'running']:
+            status['phase'] = 'lost'
+    return status
+
+
+def wait_for(status_file, timeout, poll_interval=POLL_INTERVAL):
+    """Function that waits until the launch recorded in status_file has ended, or timeout seconds passed.
+    Returns the last status, with waited set to the seconds spent waiting and
+    timed_out when the deadline passed first.
+    """
+
+    started = time.time()
+    while True:
+        status = current_status(status_file)
+        if status is None or status['phase'] not in ['launching', 'running']:
+            break
+        if time.time() - started >= timeout:
+            status['timed_out'] = True
+            break
+        time.sleep(poll_interval)
+
+    if status is not None:
+        status['waited'] = round(time.time() - started, 1)
+        if status.get('finished'):
+            status['duration'] = round(status['finished'] - status['launched'], 1)
+    return status
+
+
+STATUS_ALL_CACHE = 'ansible_status_all.json'
+STATUS_ALL_TTL = 30
+# serverStatus.sh -all: ADMU0508I: The Application Server "server1" is STARTED
+#                       ADMU0509I: The Node Agent "nodeagent" cannot be reached. It appears to be stopped.
+SERVER_STATUS = re.compile(r'ADMU050[89]I: The (?P<type>.+?) "(?P<server>[^"]+)" (is (?P<state>\w+)|cannot be reached)')
+SERVER_TYPES = {'DEPLOYMENT_MANAGER': 'Deployment Manager', 'NODE_AGENT': 'Node Agent',
+                'APPLICATION_SERVER': 'Application Server', 'WEB_SERVER': 'Web Server'}
+
+
+def _setup_value(profile_root, name):
+    """Function that returns a WAS_CELL/WAS_NODE style value set in the profile's setupCmdLine.sh, or None."""
+
+    try:
+        with open(os.path.join(profile_root, 'bin', 'setupCmdLine.sh'), 'r') as f_obj:
+            for line in f_obj:
+                match = re.match(r'\s*{0}=["\']?([^"\'\s]+)'.format(name), line)
+                if match:
+                    return match.group(1)
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def profile_servers(profile_root):
+    """Function that returns {server: type} for the servers of the profile's own node.
+    They come from the node's serverindex.xml. A dmgr profile holds the
+    configuration of every federated node, so only the node named in
+    setupCmdLine.sh is looked at when it is known.
+    """
+
+    node = _setup_value(profile_root, 'WAS_NODE') or '*'
+    servers = {}
+    for index in glob.glob(os.path.join(profile_root, 'config', 'cells', '*', 'nodes', node, 'serverindex.xml')):
+        try:
+            root = ET.parse(index).getroot()
+        except (ET.ParseError, IOError, OSError):
+            continue
+        for entry in root.iter('serverEntries'):
+            if entry.get('serverName'):
+                servers[entry.get('serverName')] = entry.get('serverType')
+    if not servers:
+        for server_dir in glob.glob(os.path.join(profile_root, 'config', 'cells', '*', 'nodes', node, 'servers', '*')):
+            if os.path.isfile(os.path.join(server_dir, 'server.xml')):
+                servers[os.path.basename(server_dir)] = None
+    return servers
+
+
+def native_status(profile_root, servers):
+    """Function that derives the status of servers from their pid files and /proc, without a JVM.
+    Returns {server: {state, type, pid, uptime, stale_pid, missing_pid}}.
+    stale_pid is set when a pid file is left behind by a server that is no
+    longer running, missing_pid when a running server's pid file does not name it.
+    """
+
+    now = time.time()
+    table = process_table()
+    status = {}
+    for server, server_type in servers.items():
+        check = table.check(os.path.join(profile_root, 'logs', server, server + '.pid'), profile_root, server)
+        entry = dict(state='STOPPED', type=server_type, pid=check['pid'], uptime=None, stale_pid=check['stale'],
+                     missing_pid=check['missing'])
+        if check['running']:
+            started = table.started(check['pid'])
+            entry.update(state='STARTED', uptime=int(now - started) if started is not None else None)
+        launch = current_status(os.path.join(profile_root, 'logs', server, STATUS_FILE))
+        if launch is not None and launch['phase'] in ['launching', 'running']:
+            entry['state'] = 'STARTING' if launch['action'] == 'start' else 'STOPPING'
+        status[server] = entry
+    return status
+
+
+def parse_server_status(output):
+    """Function that turns the output of serverStatus.sh -all into {server: {state, type}}."""
+
+    types = dict((label, server_type) for server_type, label in SERVER_TYPES.items())
+    status = {}
+    for match in SERVER_STATUS.finditer(output):
+        status[match.group('server')] = dict(state=(match.group('state') or 'STOPPED').upper(),
+                                             type=types.get(match.group('type'), match.group('type')))
+    return status
+
+
+def status_all(profile_root, source='native', ttl=STATUS_ALL_TTL):
+    """Function that returns the status of every server of a profile, cached for ttl seconds.
+    source native reads pid files and /proc; source script runs serverStatus.sh
+    -all once for the whole profile, and pids and uptimes are added natively.
+    Returns (servers, info) where info tells the source, whether the cache was
+    used and its age.
+    """
+
+    cache_file = os.path.join(profile_root, 'logs', STATUS_ALL_CACHE)
+    cached = read_status(cache_file)
+    if cached is not None and cached.get('source') == source and 0 <= time.time() - cached['checked'] < ttl:
+        return cached['servers'], dict(source=source, cached=True, age=round(time.time() - cached['checked'], 1))
+
+    servers = profile_servers(profile_root)
+    status = native_status(profile_root, servers)
+    if source == 'script':
+        child = sp.Popen([os.path.join(profile_root, 'bin', 'serverStatus.sh'), '-all'],
+                         stdout=sp.PIPE, stderr=sp.STDOUT)
+        output = child.communicate()[0]
+        if isinstance(output, bytes):
+            output = output.decode('utf-8', 'replace')
+        reported = parse_server_status(output)
+        if child.returncode != 0 and not reported:
+            raise LaunchError('serverStatus.sh -all failed with rc {0}: {1}'.format(child.returncode,
+                                                                                   output.strip()))
+        for server, entry in reported.items():
+            if server not in status:
+                status[server] = native_status(profile_root, {server: entry['type']})[server]
+            status[server].update(state=entry['state'], type=status[server]['type'] or entry['type'])
+
+    if os.path.isdir(os.path.dirname(cache_file)):
+        write_json(cache_file, dict(source=source, checked=time.time(), servers=status))
+    return status, dict(source=source, cached=False, age=0.0)
+
+
+def forget_status_all(profile_root):
+    """Function that drops the cached status_all of a profile, after a server was started or stopped."""
+
+    try:
+        os.remove(os.path.join(profile_root, 'logs', STATUS_ALL_CACHE))
+    except OSError:
+        pass
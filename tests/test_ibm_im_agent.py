@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Tests for the IM agent data readers, against agent data written by the fake imcl.
+
+Every test builds <tmp>/eclipse/tools/imcl from library/mock_ibm_imcl_package_handler.py,
+with a config.ini pointing cic.appDataLocation at <tmp>/agent, and installs an
+offering of a generated repository with it, so installRegistry.xml is written the
+way IM writes it.
+
+author: Tom Davison (@tntdavison784)
+"""
+
+import os
+import shutil
+import stat
+import subprocess as sp
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import ansible.module_utils
+    ansible.module_utils.__path__.append(os.path.join(ROOT, 'module_utils'))
+    from ansible.module_utils import ibm_im_agent
+except ImportError:
+    ibm_im_agent = None
+
+
+FAKE_IMCL = os.path.join(ROOT, 'library', 'mock_ibm_imcl_package_handler.py')
+OFFERING = 'com.example.offering0.v85'
+VERSION = '8.5.5002.20180101_0000'
+
+
+class ModuleFailed(Exception):
+    pass
+
+
+class FakeModule(object):
+    """Stand-in for AnsibleModule with the run_command and fail_json the readers use."""
+
+    def __init__(self):
+        self.commands = []
+
+    def run_command(self, cmd, use_unsafe_shell=False):
+        self.commands.append(cmd)
+        child = sp.Popen(cmd, shell=use_unsafe_shell, stdout=sp.PIPE, stderr=sp.PIPE)
+        stdout, stderr = child.communicate()
+        return child.returncode, stdout.decode('utf-8'), stderr.decode('utf-8')
+
+    def fail_json(self, **kwargs):
+        raise ModuleFailed(kwargs['msg'])
+
+
+@unittest.skipIf(ibm_im_agent is None, 'ansible is not installed')
+class AgentDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.agent = os.path.join(self.tmp, 'agent')
+        self.cache_dir = os.path.join(self.tmp, 'cache')
+        self.imcl = os.path.join(self.tmp, 'eclipse', 'tools', 'imcl')
+        os.makedirs(os.path.dirname(self.imcl))
+        os.makedirs(os.path.join(self.tmp, 'eclipse', 'configuration'))
+        shutil.copy(FAKE_IMCL, self.imcl)
+        os.chmod(self.imcl, os.stat(self.imcl).st_mode | stat.S_IXUSR)
+        with open(os.path.join(self.tmp, 'eclipse', 'configuration', 'config.ini'), 'w') as f_obj:
+            f_obj.write('cic.appDataLocation={0}\n'.format(self.agent))
+
+        repository = os.path.join(self.tmp, 'repo')
+        self.imcl_run('generateRepository', repository, '2')
+        self.imcl_run('install', OFFERING, '-repositories', repository,
+                      '-installationDirectory', os.path.join(self.tmp, 'was'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def imcl_run(self, *args):
+        env = dict(os.environ)
+        env.pop('FAKE_IMCL_DATA', None)
+        sp.check_call([sys.executable, self.imcl] + list(args), env=env, stdout=sp.PIPE)
+
+    def break_registry(self, content='<notARegistry/>'):
+        with open(os.path.join(self.agent, 'installRegistry.xml'), 'w') as f_obj:
+            f_obj.write(content)
+
+    def test_agent_data_location(self):
+        self.assertEqual(ibm_im_agent.agent_data_location(self.imcl), self.agent)
+
+    def test_read_agent_data(self):
+        offerings = ibm_im_agent.read_agent_data(self.agent)
+        self.assertEqual(len(offerings), 1)
+        self.assertEqual(offerings[0]['id'], OFFERING)
+        self.assertEqual(offerings[0]['version'], VERSION)
+        self.assertEqual(offerings[0]['package'], '{0}_{1}'.format(OFFERING, VERSION))
+        self.assertEqual(offerings[0]['location'], os.path.join(self.tmp, 'was'))
+        self.assertEqual(offerings[0]['features'], ['core.feature'])
+
+    def test_package_installed_prefix(self):
+        packages = [o['package'] for o in ibm_im_agent.read_agent_data(self.agent)]
+        self.assertTrue(ibm_im_agent.package_installed(OFFERING, packages))
+        self.assertTrue(ibm_im_agent.package_installed('{0}_{1}'.format(OFFERING, VERSION), packages))
+        self.assertFalse(ibm_im_agent.package_installed('com.example.offering0', packages))
+        self.assertFalse(ibm_im_agent.package_installed('com.example.offering1.v85', packages))
+
+    def test_inventory_from_agent_data(self):
+        module = FakeModule()
+        packages, source = ibm_im_agent.installed_inventory(module, self.imcl, cache_dir=self.cache_dir)
+        self.assertEqual(source, 'agent_data')
+        self.assertEqual(packages, ['{0}_{1}'.format(OFFERING, VERSION)])
+        self.assertEqual(module.commands, [])
+
+    def test_inventory_falls_back_to_cached_imcl(self):
+        self.break_registry()
+        module = FakeModule()
+        packages, source = ibm_im_agent.installed_inventory(module, self.imcl, cache_dir=self.cache_dir)
+        self.assertEqual(source, 'imcl')
+        self.assertTrue(ibm_im_agent.package_installed(OFFERING, packages))
+
+        packages, source = ibm_im_agent.installed_inventory(module, self.imcl, cache_dir=self.cache_dir)
+        self.assertEqual(source, 'cache')
+        self.assertTrue(ibm_im_agent.package_installed(OFFERING, packages))
+        self.assertEqual(len(module.commands), 1)
+
+    def test_offline_uses_stale_cache(self):
+        self.break_registry()
+        ibm_im_agent.installed_inventory(FakeModule(), self.imcl, cache_dir=self.cache_dir)
+        self.break_registry('<stillNotARegistry/>')
+
+        module = FakeModule()
+        packages, source = ibm_im_agent.installed_inventory(module, self.imcl, cache_dir=self.cache_dir,
+                                                            offline=True)
+        self.assertEqual(source, 'cache')
+        self.assertTrue(ibm_im_agent.package_installed(OFFERING, packages))
+        self.assertEqual(module.commands, [])
+
+    def test_offline_without_cache_never_starts_imcl(self):
+        self.break_registry()
+        module = FakeModule()
+        self.assertRaises(ModuleFailed, ibm_im_agent.installed_inventory, module, self.imcl,
+                          cache_dir=self.cache_dir, offline=True)
+        self.assertEqual(module.commands, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""Tests for the repository mirror, syncing directory to directory and from a local HTTP server.
+
+The HTTP repository is a directory served by the standard library's HTTP server
+in a thread, which also records the paths it was asked for.
+
+author: Tom Davison (@tntdavison784)
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    from http.server import HTTPServer, SimpleHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import ansible.module_utils
+    ansible.module_utils.__path__.append(os.path.join(ROOT, 'module_utils'))
+    from ansible.module_utils import ibm_im_mirror
+except ImportError:
+    ibm_im_mirror = None
+
+
+ARTIFACTS = {
+    'repository.config': b'LayoutPolicy=Composite\n',
+    'Offerings/com.example.offering0.v85_8.5.5000.jar': b'offering' * 4096,
+    'native/payload.zip': b'payload' * 8192,
+}
+
+
+def sha256(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+class RepositoryHandler(SimpleHTTPRequestHandler):
+    """Serves the repository directory of the server, and records every request."""
+
+    def translate_path(self, path):
+        relative = path.split('?', 1)[0].split('#', 1)[0].lstrip('/')
+        return os.path.join(self.server.directory, *relative.split('/'))
+
+    def do_HEAD(self):
+        self.server.requests.append(('HEAD', self.path))
+        SimpleHTTPRequestHandler.do_HEAD(self)
+
+    def do_GET(self):
+        self.server.requests.append(('GET', self.path))
+        SimpleHTTPRequestHandler.do_GET(self)
+
+    def log_message(self, *args):
+        pass
+
+
+@unittest.skipIf(ibm_im_mirror is None, 'ansible is not installed')
+class MirrorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, 'src')
+        self.mirror = os.path.join(self.tmp, 'mirror')
+        for relative, content in ARTIFACTS.items():
+            self.write(relative, content)
+
+    def tearDown(self):
+        if getattr(self, 'server', None) is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def write(self, relative, content):
+        path = os.path.join(self.src, relative)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f_obj:
+            f_obj.write(content)
+
+    def write_manifest(self, checksums=None):
+        if checksums is None:
+            checksums = dict((relative, sha256(content)) for relative, content in ARTIFACTS.items())
+        self.write(ibm_im_mirror.MANIFEST, ''.join(
+            '{0}  {1}\n'.format(digest, relative) for relative, digest in sorted(checksums.items())).encode('utf-8'))
+
+    def serve(self):
+        self.server = HTTPServer(('127.0.0.1', 0), RepositoryHandler)
+        self.server.directory = self.src
+        self.server.requests = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return 'http://127.0.0.1:{0}/'.format(self.server.server_address[1])
+
+    def assertMirrored(self, relatives):
+        for relative in relatives:
+            with open(os.path.join(self.mirror, relative), 'rb') as f_obj:
+                self.assertEqual(f_obj.read(), ARTIFACTS[relative])
+
+    def test_directory_sync_is_incremental(self):
+        stats = ibm_im_mirror.mirror_repository(self.src, self.mirror)
+        self.assertEqual((stats['fetched'], stats['removed'], stats['unchanged']), (3, 0, 0))
+        self.assertEqual(stats['unverified'], [])
+        self.assertMirrored(ARTIFACTS)
+
+        stats = ibm_im_mirror.mirror_repository(self.src, self.mirror)
+        self.assertEqual((stats['fetched'], stats['changed']), (0, False))
+
+        self.write('repository.config', b'LayoutPolicy=Composite\nchanged=true\n')
+        os.remove(os.path.join(self.src, 'native', 'payload.zip'))
+        stats = ibm_im_mirror.mirror_repository(self.src, self.mirror)
+        self.assertEqual((stats['fetched'], stats['removed'], stats['unchanged']), (1, 1, 1))
+        self.assertFalse(os.path.exists(os.path.join(self.mirror, 'native', 'payload.zip')))
+
+    def test_directory_fetch_resumes_partial_download(self):
+        relative = 'native/payload.zip'
+        target = os.path.join(self.mirror, relative)
+        os.makedirs(os.path.dirname(target))
+        with open(target + ibm_im_mirror.PART_SUFFIX, 'wb') as f_obj:
+            f_obj.write(ARTIFACTS[relative][:1000])
+
+        artifact = dict(size=len(ARTIFACTS[relative]), stamp=None, sha256=None)
+        transferred, digest, verified = ibm_im_mirror._fetch(self.src, self.mirror, relative, artifact)
+        self.assertEqual(transferred, len(ARTIFACTS[relative]) - 1000)
+        self.assertEqual(digest, sha256(ARTIFACTS[relative]))
+        self.assertTrue(verified)
+        self.assertMirrored([relative])
+
+    def test_http_sync_with_manifest(self):
+        self.write_manifest()
+        url = self.serve()
+        stats = ibm_im_mirror.mirror_repository(url, self.mirror)
+        self.assertEqual(stats['fetched'], 3)
+        self.assertEqual(stats['unverified'], [])
+        self.assertMirrored(ARTIFACTS)
+
+        del self.server.requests[:]
+        stats = ibm_im_mirror.mirror_repository(url, self.mirror)
+        self.assertEqual(stats['fetched'], 0)
+        self.assertEqual([path for method, path in self.server.requests if method == 'GET'],
+                         ['/' + ibm_im_mirror.MANIFEST])
+
+    def test_http_sync_without_manifest_is_unverified(self):
+        url = self.serve()
+        stats = ibm_im_mirror.mirror_repository(url, self.mirror)
+        self.assertEqual(stats['fetched'], 3)
+        self.assertEqual(stats['unverified'], sorted(ARTIFACTS))
+        self.assertMirrored(ARTIFACTS)
+
+    def test_http_checksum_mismatch_fails(self):
+        checksums = dict((relative, sha256(content)) for relative, content in ARTIFACTS.items())
+        checksums['native/payload.zip'] = sha256(b'something else')
+        self.write_manifest(checksums)
+        url = self.serve()
+        self.assertRaises(ibm_im_mirror.MirrorError, ibm_im_mirror.mirror_repository, url, self.mirror)
+        self.assertFalse(os.path.exists(os.path.join(self.mirror, 'native', 'payload.zip')))
+
+    def test_check_only_never_contacts_http(self):
+        self.write_manifest()
+        url = self.serve()
+        stats = ibm_im_mirror.mirror_repository(url, self.mirror, check_only=True)
+        self.assertEqual((stats['changed'], stats['listed']), (True, False))
+        self.assertEqual(self.server.requests, [])
+        self.assertFalse(os.path.exists(self.mirror))
+
+
+if __name__ == '__main__':
+    unittest.main()